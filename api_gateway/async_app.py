@@ -0,0 +1,737 @@
+"""
+Async execution mode for the API gateway.
+
+Same routes and responses as app.py, served by an ASGI server
+(e.g. `uvicorn async_app:app --port 9080`) on top of a non-blocking
+HTTP client. In /api/create_order, token verification and customer
+validation run concurrently. The cart is reserved with a single batch
+call, or, with INVENTORY_BATCH_RESERVE off, every line item runs its product
+lookup, availability check and reservation at the same time as the other
+line items. Order latency therefore follows the slowest dependency rather
+than the sum of all of them.
+"""
+from quart import Quart, request, jsonify
+import asyncio
+import os
+import time
+from datetime import datetime
+import jwt
+from background import CONFIRM_MODE, async_confirmation_runner_from_env
+from encoding import FastJSONProvider
+from idempotency import async_idempotent, async_mark_committed, idempotency_store_from_env
+from metrics import init_async_metrics, record_compensation, timed_stage
+from product_cache import invalidation_allowed, product_cache_from_env
+from resilience import UpstreamUnavailable
+from tokens import token_verifier_from_env
+from tracing import init_async_tracing
+from upstream import AsyncUpstreamClient, env_bool, service_timeout
+
+app = Quart(__name__)
+app.json = FastJSONProvider(app)
+init_async_metrics(app)
+init_async_tracing(app)
+
+AUTH_SERVICE_URL = os.environ.get('AUTH_SERVICE_URL', 'http://localhost:5001')
+CUSTOMER_SERVICE_URL = os.environ.get('CUSTOMER_SERVICE_URL', 'http://localhost:5002')
+INVENTORY_SERVICE_URL = os.environ.get('INVENTORY_SERVICE_URL', 'http://localhost:5003')
+PAYMENT_SERVICE_URL = os.environ.get('PAYMENT_SERVICE_URL', 'http://localhost:5004')
+ORDER_SERVICE_URL = os.environ.get('ORDER_SERVICE_URL', 'http://localhost:5005')
+
+auth_service = AsyncUpstreamClient('auth_service', AUTH_SERVICE_URL, timeout=service_timeout('AUTH_SERVICE', 5))
+customer_service = AsyncUpstreamClient('customer_service', CUSTOMER_SERVICE_URL, timeout=service_timeout('CUSTOMER_SERVICE', 5))
+inventory_service = AsyncUpstreamClient('inventory_service', INVENTORY_SERVICE_URL, timeout=service_timeout('INVENTORY_SERVICE', 5))
+payment_service = AsyncUpstreamClient('payment_service', PAYMENT_SERVICE_URL, timeout=service_timeout('PAYMENT_SERVICE', 10))
+order_service = AsyncUpstreamClient('order_service', ORDER_SERVICE_URL, timeout=service_timeout('ORDER_SERVICE', 5))
+
+UPSTREAMS = [auth_service, customer_service, inventory_service, payment_service, order_service]
+
+# Reserve the whole cart with one call to POST /reservations/batch instead of
+# three inventory calls per line item
+INVENTORY_BATCH_RESERVE = env_bool('INVENTORY_BATCH_RESERVE', True)
+
+# Verify JWTs in-process (with an exp-bounded claims cache) instead of calling
+# auth_service /verify; see tokens.py for the modes
+AUTH_VERIFY_MODE, token_verifier = token_verifier_from_env()
+
+# Product name/price, read through from inventory_service
+product_cache = product_cache_from_env()
+
+# Post-payment reservation confirmation (background with retry, or inline)
+confirmations = async_confirmation_runner_from_env()
+
+# Idempotency-Key deduplication for create_order (in-flight waits and stored responses)
+idempotency_store = idempotency_store_from_env()
+
+# When payment_service answers 202 (PAYMENT_MODE=async), create_order long-polls
+# for the outcome for up to PAYMENT_WAIT_TIMEOUT seconds. Each poll lasts at most
+# PAYMENT_LONG_POLL_SECONDS, below BREAKER_SLOW_CALL_SECONDS so waiting is not a slow call.
+PAYMENT_WAIT_TIMEOUT = float(os.environ.get('PAYMENT_WAIT_TIMEOUT', 30))
+PAYMENT_LONG_POLL_SECONDS = float(os.environ.get('PAYMENT_LONG_POLL_SECONDS', 1))
+# If the payment cannot be cancelled then because a worker is already charging it,
+# the gateway waits up to PAYMENT_SETTLE_TIMEOUT more for the outcome. A payment
+# whose outcome is still unknown is not failed: the order is recorded as
+# payment_pending and order_service's payment reconciler settles it.
+PAYMENT_SETTLE_TIMEOUT = float(os.environ.get('PAYMENT_SETTLE_TIMEOUT', 60))
+
+
+def failure_status(step_response, status):
+    """503 when a step failed because its dependency rejected the call (see resilience.py)"""
+    return 503 if step_response.get('unavailable') else status
+
+
+def invalid_products(products):
+    """Why the order's products are malformed, or None if every line has a product_id and a positive integer quantity"""
+    if not isinstance(products, list):
+        return "products must be a list"
+    for product in products:
+        if not isinstance(product, dict) or not isinstance(product.get('product_id'), str):
+            return "Each product must have a product_id"
+        quantity = product.get('quantity')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+            return "Each product must have a positive integer quantity"
+    return None
+
+
+@app.after_serving
+async def close_upstreams():
+    await confirmations.drain()
+    for client in UPSTREAMS:
+        await client.aclose()
+
+
+@app.route('/api/create_order', methods=['POST'])
+@async_idempotent(idempotency_store)
+async def create_order():
+    """
+    1. Authenticate/authorize customer token and validate customer (concurrently)
+    2. Check product availability & reserve stock (one batch call, or all line items concurrently)
+    3. Process payment
+    4. Create order record
+    5. Return order confirmation
+    """
+    try:
+        data = await request.get_json()
+
+        token = data.get('token')
+        customer_id = data.get('customer_id')
+        products = data.get('products')
+        payment_method = data.get('payment_method')
+
+        if not all([token, customer_id, products, payment_method]):
+            return jsonify({
+                "success": False,
+                "error": "token, customer_id, products, and payment_method are required"
+            }), 400
+
+        products_error = invalid_products(products)
+        if products_error:
+            return jsonify({"success": False, "error": products_error}), 400
+
+        # Authenticate token and validate customer concurrently
+        auth_response, customer_response = await asyncio.gather(
+            authenticate_token(token),
+            validate_customer(customer_id)
+        )
+
+        if not auth_response['success']:
+            return jsonify({
+                "success": False,
+                "error": "Authentication failed",
+                "details": auth_response['error']
+            }), failure_status(auth_response, 401)
+
+        if not customer_response['success']:
+            return jsonify({
+                "success": False,
+                "error": "Customer validation failed",
+                "details": customer_response['error']
+            }), failure_status(customer_response, 400)
+
+        customer_info = customer_response['data']
+
+        # Check product availability & reserve stock
+        if INVENTORY_BATCH_RESERVE:
+            reservation_response = await reserve_products_batch(products, customer_id)
+        else:
+            reservation_response = await reserve_products_concurrently(products, customer_id)
+
+        if not reservation_response['success']:
+            return jsonify({
+                "success": False,
+                "error": reservation_response['error'],
+                "details": reservation_response['details']
+            }), failure_status(reservation_response, 400)
+
+        reservation_ids = [line['reservation_id'] for line in reservation_response['lines']]
+        line_prices = [line['price'] for line in reservation_response['lines']]
+        total_amount = sum(price * p['quantity'] for price, p in zip(line_prices, products))
+
+        # Process payment
+        payment_response = await process_payment(customer_id, total_amount, payment_method)
+        payment_pending = payment_response.get('pending', False)
+        if not payment_response['success'] and not payment_pending:
+            await cancel_reservations(reservation_ids, 'payment_failed')
+            return jsonify({
+                "success": False,
+                "error": "Payment processing failed",
+                "details": payment_response['error']
+            }), failure_status(payment_response, 400)
+
+        payment_id = payment_response['payment_id']
+        # The customer has paid, or may have: from here on a retry must get this request's outcome
+        await async_mark_committed()
+
+        # Create order record
+        order_data = {
+            "customer_id": customer_id,
+            "products": [{"product_id": p['product_id'], "quantity": p['quantity'], "price": price} for p, price in zip(products, line_prices)],
+            "total_amount": total_amount,
+            "payment_id": payment_id,
+            "reservation_ids": reservation_ids,
+            # An unknown payment outcome keeps the reservations for order_service's payment reconciler
+            "status": "payment_pending" if payment_pending else "confirmed",
+            "shipping_address": data.get('shipping_address'),
+            "billing_address": data.get('billing_address')
+        }
+
+        order_response = await create_order_record(order_data)
+        if not order_response['success']:
+            return jsonify({
+                "success": False,
+                "error": "Order creation failed",
+                "details": order_response['error'],
+                "payment_id": payment_id,
+                "reservation_ids": reservation_ids
+            }), failure_status(order_response, 500)
+
+        order_id = order_response['order_id']
+
+        # Confirm reservations off the response path, retrying on failure.
+        # In outbox mode order_service recorded the confirmation with the order.
+        if CONFIRM_MODE != 'outbox' and not payment_pending:
+            await confirmations.submit(confirm_reservations, reservation_ids)
+
+        return jsonify({
+            "success": True,
+            "message": "Order created; payment is still being processed" if payment_pending else "Order created successfully",
+            "order_confirmation": {
+                "order_id": order_id,
+                "customer_id": customer_id,
+                "customer_name": customer_info['name'],
+                "products": products,
+                "total_amount": total_amount,
+                "payment_id": payment_id,
+                "status": order_data['status'],
+                "created_at": datetime.utcnow().isoformat()
+            }
+        }), 202 if payment_pending else 201
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": "Internal server error",
+            "details": str(e)
+        }), 500
+
+@timed_stage('reserve')
+async def reserve_products_batch(products, customer_id):
+    read = product_cache.begin_read()
+    try:
+        response = await inventory_service.post(
+            "/reservations/batch",
+            json={
+                "customer_id": customer_id,
+                "items": [{"product_id": p['product_id'], "quantity": p['quantity']} for p in products]
+            }
+        )
+
+        data = response.json()
+        if response.status_code == 200:
+            for line in data['reservations']:
+                product_cache.put(line['product_id'], {
+                    "product_id": line['product_id'],
+                    "name": line['name'],
+                    "price": line['price']
+                }, read)
+            return {
+                "success": data['reserved'],
+                "lines": [
+                    {"reservation_id": line['reservation_id'], "price": line['price']}
+                    for line in data['reservations']
+                ]
+            }
+
+        product_id = data.get('product_id')
+        if response.status_code == 404:
+            error = f"Product {product_id} not found"
+        elif data.get('error') == 'Insufficient stock':
+            error = f"Product {product_id} is not available"
+        else:
+            error = "Failed to reserve stock"
+        return {
+            "success": False,
+            "error": error,
+            "details": data.get('error', 'Stock reservation failed')
+        }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": "Failed to reserve stock",
+            "details": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": "Failed to reserve stock",
+            "details": f"Inventory service error: {str(e)}"
+        }
+
+async def reserve_products_concurrently(products, customer_id):
+    """Reserve every line item at once; used when batch reservation is disabled"""
+    line_results = await asyncio.gather(*[
+        reserve_line_item(product['product_id'], product['quantity'], customer_id)
+        for product in products
+    ])
+
+    failed_line = next((line for line in line_results if not line['success']), None)
+    if failed_line:
+        await cancel_reservations([line['reservation_id'] for line in line_results if line['success']], 'reservation_failed')
+        return failed_line
+
+    return {"success": True, "lines": line_results}
+
+async def reserve_line_item(product_id, quantity, customer_id):
+    """Look up and check a single line item concurrently, then reserve its stock"""
+    product_details, availability_response = await asyncio.gather(
+        get_product_details(product_id),
+        check_product_availability(product_id, quantity)
+    )
+
+    if not product_details['success']:
+        return {
+            "success": False,
+            "error": f"Product {product_id} not found",
+            "details": product_details['error'],
+            "unavailable": product_details.get('unavailable', False)
+        }
+
+    if not availability_response['success']:
+        return {
+            "success": False,
+            "error": f"Product {product_id} is not available",
+            "details": availability_response['error'],
+            "unavailable": availability_response.get('unavailable', False)
+        }
+
+    reservation_response = await reserve_product_stock(product_id, quantity, customer_id)
+    if not reservation_response['success']:
+        return {
+            "success": False,
+            "error": f"Failed to reserve stock for product {product_id}",
+            "details": reservation_response['error'],
+            "unavailable": reservation_response.get('unavailable', False)
+        }
+
+    return {
+        "success": True,
+        "reservation_id": reservation_response['reservation_id'],
+        "price": product_details['data']['price']
+    }
+
+@timed_stage('auth')
+async def authenticate_token(token):
+    if token_verifier is not None:
+        try:
+            claims = token_verifier.verify(token)
+            return {
+                "success": True,
+                "user_id": claims['user_id'],
+                "username": claims['username']
+            }
+        except jwt.ExpiredSignatureError:
+            return {
+                "success": False,
+                "error": "Token has expired"
+            }
+        except (jwt.InvalidTokenError, KeyError):
+            if AUTH_VERIFY_MODE == 'local':
+                return {
+                    "success": False,
+                    "error": "Invalid token"
+                }
+
+    try:
+        response = await auth_service.post(
+            "/verify",
+            json={"token": token}
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            return {
+                "success": True,
+                "user_id": data['user_id'],
+                "username": data['username']
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Authentication failed')
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Auth service error: {str(e)}"
+        }
+
+@timed_stage('customer_validation')
+async def validate_customer(customer_id):
+    try:
+        response = await customer_service.read(
+            "/customers/<customer_id>/validate",
+            f"/customers/{customer_id}/validate"
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            return {
+                "success": data['valid'],
+                "data": {
+                    "customer_id": data['customer_id'],
+                    "name": data['name'],
+                    "email": data['email']
+                }
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Customer validation failed')
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Customer service error: {str(e)}"
+        }
+
+@timed_stage('product_lookup')
+async def get_product_details(product_id):
+    cached = product_cache.get(product_id)
+    if cached is not None:
+        return {
+            "success": True,
+            "data": cached
+        }
+
+    read = product_cache.begin_read()
+    try:
+        response = await inventory_service.read(
+            "/products/<product_id>",
+            f"/products/{product_id}"
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            product = {
+                "product_id": data['_id'],
+                "name": data['name'],
+                "price": data['price']
+            }
+            product_cache.put(product_id, product, read)
+            return {
+                "success": True,
+                "data": product
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Product not found')
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Inventory service error: {str(e)}"
+        }
+
+@timed_stage('availability')
+async def check_product_availability(product_id, quantity):
+    try:
+        response = await inventory_service.read(
+            "/products/<product_id>/availability",
+            f"/products/{product_id}/availability",
+            params={"quantity": quantity}
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            return {
+                "success": data['available'],
+                "data": {
+                    "product_id": data['product_id'],
+                    "available_quantity": data['available_quantity']
+                },
+                "error": None if data['available'] else 'Insufficient stock'
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Availability check failed')
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Inventory service error: {str(e)}"
+        }
+
+@timed_stage('reserve')
+async def reserve_product_stock(product_id, quantity, customer_id):
+    try:
+        response = await inventory_service.post(
+            f"/products/{product_id}/reserve",
+            json={"quantity": quantity, "customer_id": customer_id}
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            return {
+                "success": data['reserved'],
+                "reservation_id": data['reservation_id']
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Stock reservation failed')
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Inventory service error: {str(e)}"
+        }
+
+@timed_stage('payment')
+async def process_payment(customer_id, amount, payment_method):
+    try:
+        response = await payment_service.post(
+            "/payments/process",
+            json={
+                "customer_id": customer_id,
+                "amount": amount,
+                "payment_method": payment_method,
+                "currency": "USD"
+            }
+        )
+
+        if response.status_code == 202:
+            # Accepted for processing in the background. The payment exists from
+            # now on, so not learning its outcome must not fail the order.
+            payment_id = response.json()['payment_id']
+            try:
+                response = await wait_for_payment(payment_id)
+            except Exception as e:
+                return unsettled_payment(payment_id, f"Payment outcome unknown: {str(e)}")
+            if response.status_code == 202:
+                return unsettled_payment(payment_id, "Payment is still being processed")
+
+        if response.status_code == 200:
+            data = response.json()
+            return {
+                "success": data['success'],
+                "payment_id": data['payment_id'],
+                "transaction_id": data['transaction_id']
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Payment processing failed'),
+                "unavailable": response.status_code == 503
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Payment service error: {str(e)}"
+        }
+
+def unsettled_payment(payment_id, error):
+    """process_payment result for a payment that was accepted but whose outcome is unknown"""
+    return {
+        "success": False,
+        "pending": True,
+        "payment_id": payment_id,
+        "error": error
+    }
+
+async def wait_for_payment(payment_id):
+    """asyncio counterpart of wait_for_payment() in app.py"""
+    response = await poll_payment(payment_id, PAYMENT_WAIT_TIMEOUT)
+    if response.status_code != 202 or outcome_unknown(response):
+        return response
+
+    cancel_response = await payment_service.post(f"/payments/{payment_id}/cancel")
+    if cancel_response.status_code == 400:
+        # Cancelled before any worker picked it up: nothing was charged
+        return cancel_response
+    if cancel_response.status_code == 409:
+        return await poll_payment(payment_id, PAYMENT_SETTLE_TIMEOUT)
+    return response
+
+def outcome_unknown(response):
+    """The provider's answer was lost; only payment_service's reconciliation can tell (see async_payments.py)"""
+    return response.json().get('status') == "unknown"
+
+async def poll_payment(payment_id, timeout):
+    """asyncio counterpart of poll_payment() in app.py"""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = max(deadline - time.monotonic(), 0)
+        response = await payment_service.get(
+            f"/payments/{payment_id}/wait",
+            params={"timeout": round(min(remaining, PAYMENT_LONG_POLL_SECONDS), 3)}
+        )
+        if response.status_code != 202 or remaining <= 0 or outcome_unknown(response):
+            return response
+
+@timed_stage('order_record')
+async def create_order_record(order_data):
+    try:
+        response = await order_service.post(
+            "/orders",
+            json=order_data
+        )
+
+        if response.status_code == 201:
+            data = response.json()
+            return {
+                "success": True,
+                "order_id": data['order_id']
+            }
+        else:
+            return {
+                "success": False,
+                "error": response.json().get('error', 'Order creation failed')
+            }
+    except UpstreamUnavailable as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "unavailable": True
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Order service error: {str(e)}"
+        }
+
+async def cancel_reservations(reservation_ids, reason):
+    """Compensation: release reservations taken by an order that cannot complete"""
+    if not reservation_ids:
+        return
+    try:
+        response = await inventory_service.post(
+            "/reservations/cancel_batch",
+            json={"reservation_ids": reservation_ids}
+        )
+        succeeded = response.status_code == 200
+        if not succeeded:
+            print(f"Failed to cancel reservations {reservation_ids}: {response.json().get('error')}")
+    except Exception as e:
+        succeeded = False
+        print(f"Failed to cancel reservations {reservation_ids}: {str(e)}")
+    record_compensation(reason, len(reservation_ids), succeeded)
+
+@timed_stage('confirm')
+async def confirm_reservations(reservation_ids):
+    """Raises on failure so the confirmation runner can retry it"""
+    response = await inventory_service.post(
+        "/reservations/confirm_batch",
+        json={"reservation_ids": reservation_ids}
+    )
+    if response.status_code != 200:
+        raise RuntimeError(response.json().get('error', 'Reservation confirmation failed'))
+
+@app.route('/api/auth/login', methods=['POST'])
+async def login():
+    """Proxy to auth service for user login"""
+    try:
+        response = await auth_service.post(
+            "/login",
+            json=await request.get_json()
+        )
+        return jsonify(response.json()), response.status_code
+    except UpstreamUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/cache/products', methods=['GET'])
+async def product_cache_stats():
+    """Hit/miss counters of the product metadata cache"""
+    return jsonify(product_cache.stats()), 200
+
+@app.route('/api/cache/products/invalidate', methods=['POST'])
+async def invalidate_all_products():
+    """Invalidation hook for bulk product changes"""
+    if not invalidation_allowed(request.headers, request.remote_addr):
+        return jsonify({"error": "Invalidation token required"}), 403
+    product_cache.invalidate()
+    return jsonify({"invalidated": True}), 200
+
+@app.route('/api/cache/products/<product_id>/invalidate', methods=['POST'])
+async def invalidate_product(product_id):
+    """Invalidation hook called by inventory_service when a product changes"""
+    if not invalidation_allowed(request.headers, request.remote_addr):
+        return jsonify({"error": "Invalidation token required"}), 403
+    product_cache.invalidate(product_id)
+    return jsonify({"invalidated": True, "product_id": product_id}), 200
+
+@app.route('/api/upstreams', methods=['GET'])
+async def upstream_stats():
+    """Connection pool configuration and request counters per downstream service"""
+    token_stats = token_verifier.stats() if token_verifier is not None else {}
+    return jsonify({
+        "upstreams": [client.stats() for client in UPSTREAMS],
+        "token_verification": dict(token_stats, mode=AUTH_VERIFY_MODE),
+        "confirmations": confirmations.stats(),
+        "idempotency": idempotency_store.stats()
+    }), 200
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 9080))
+    uvicorn.run(app, host='0.0.0.0', port=port)
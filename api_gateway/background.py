@@ -0,0 +1,141 @@
+"""
+Retrying background execution for follow-up work that the client does not
+need to wait for, such as confirming reservations once an order is recorded.
+
+A task is a callable that raises on failure. It is retried with exponential
+backoff until it succeeds or runs out of attempts. Failures are counted and
+logged, never raised to the request that submitted the task. Tasks still
+queued or retrying when the process exits are lost; for reservation
+confirmations, order_service's payment reconciler confirms the reservations
+of confirmed orders again once they are RECONCILE_MIN_AGE old.
+
+Configuration (environment):
+    CONFIRM_MODE            background | inline | outbox (default background);
+                            outbox leaves confirmation to order_service's outbox worker
+    CONFIRM_WORKERS         background threads (default 4)
+    CONFIRM_RETRIES         retries after the first attempt (default 5)
+    CONFIRM_RETRY_BACKOFF   first retry delay in seconds, doubled per retry (default 0.5)
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RetryingExecutor:
+    """Runs tasks on a thread pool (or inline) with retry and backoff."""
+
+    def __init__(self, workers=4, retries=5, backoff=0.5, mode='background'):
+        self.retries = retries
+        self.backoff = backoff
+        self.mode = mode
+        self.inline = mode == 'inline'
+        self.workers = workers
+        self.counters = {"submitted": 0, "succeeded": 0, "retried": 0, "failed": 0}
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Threads do not survive a fork, so each worker process builds its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='background')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def submit(self, func, *args):
+        self._count('submitted')
+        if self.inline:
+            self.run(func, *args)
+        else:
+            # Run in a copy of the submitter's context so upstream calls keep its request ID
+            self._pool().submit(contextvars.copy_context().run, self.run, func, *args)
+
+    def run(self, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                func(*args)
+                self._count('succeeded')
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    self._count('failed')
+                    print(f"{func.__name__} failed after {attempt + 1} attempts: {str(e)}")
+                    return False
+                self._count('retried')
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def stats(self):
+        return dict(self.counters, mode=self.mode, workers=self.workers)
+
+
+class AsyncRetryingRunner:
+    """asyncio counterpart of RetryingExecutor for the async gateway."""
+
+    def __init__(self, retries=5, backoff=0.5, mode='background'):
+        self.retries = retries
+        self.backoff = backoff
+        self.mode = mode
+        self.inline = mode == 'inline'
+        self.counters = {"submitted": 0, "succeeded": 0, "retried": 0, "failed": 0}
+        self._tasks = set()
+
+    async def submit(self, func, *args):
+        self.counters['submitted'] += 1
+        if self.inline:
+            await self.run(func, *args)
+            return
+
+        task = asyncio.create_task(self.run(func, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                await func(*args)
+                self.counters['succeeded'] += 1
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    self.counters['failed'] += 1
+                    print(f"{func.__name__} failed after {attempt + 1} attempts: {str(e)}")
+                    return False
+                self.counters['retried'] += 1
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return dict(self.counters, mode=self.mode, pending=len(self._tasks))
+
+
+CONFIRM_MODES = ('background', 'inline', 'outbox')
+CONFIRM_MODE = os.environ.get('CONFIRM_MODE', 'background')
+if CONFIRM_MODE not in CONFIRM_MODES:
+    raise ValueError(f"CONFIRM_MODE must be one of {CONFIRM_MODES}, got {CONFIRM_MODE!r}")
+
+
+def _confirm_settings():
+    return {
+        "retries": int(os.environ.get('CONFIRM_RETRIES', 5)),
+        "backoff": float(os.environ.get('CONFIRM_RETRY_BACKOFF', 0.5)),
+        "mode": CONFIRM_MODE
+    }
+
+
+def confirmation_executor_from_env():
+    return RetryingExecutor(workers=int(os.environ.get('CONFIRM_WORKERS', 4)), **_confirm_settings())
+
+
+def async_confirmation_runner_from_env():
+    return AsyncRetryingRunner(**_confirm_settings())
@@ -0,0 +1,66 @@
+"""
+Gunicorn settings for api_gateway. gunicorn reads this file from the working
+directory, so the container only runs `gunicorn`.
+
+Configuration (environment):
+    PORT                 listen port (default 9080)
+    WORKER_CLASS         sync | gthread | gevent | asgi;
+                         asgi serves async_app.py on uvicorn workers (default gevent)
+    WORKERS              worker processes (default 2 x CPUs + 1)
+    THREADS              threads per gthread worker (default 8)
+    WORKER_CONNECTIONS   concurrent requests per gevent worker (default 1000)
+    TIMEOUT              seconds before a silent worker is restarted (default: the longest
+                         payment wait plus 30); must be above the longest payment wait
+    KEEPALIVE            seconds an idle keep-alive connection is held open (default 5)
+    METRICS_DIR          where workers share their metrics (default a new temporary directory when WORKERS > 1)
+    PRODUCT_CACHE_DIR    where workers share product cache invalidations (default a new temporary directory when WORKERS > 1)
+"""
+import multiprocessing
+import os
+import tempfile
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent', 'asgi')
+
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"WORKER_CLASS must be one of {WORKER_CLASSES}, got {worker_class!r}")
+
+if worker_class == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'async_app:app'
+else:
+    wsgi_app = 'app:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 9080)}"
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+
+# A sync or gthread worker stays silent for the whole of a create_order, which
+# can wait for a payment for PAYMENT_WAIT_TIMEOUT, then PAYMENT_SETTLE_TIMEOUT
+# more, with a payment_service call (PAYMENT_SERVICE_TIMEOUT) to start it and
+# one to cancel it (see wait_for_payment in app.py). A worker restarted inside
+# that wait drops an order whose payment may still go through.
+payment_wait = (
+    float(os.environ.get('PAYMENT_WAIT_TIMEOUT', 30))
+    + float(os.environ.get('PAYMENT_SETTLE_TIMEOUT', 60))
+    + 2 * float(os.environ.get('PAYMENT_SERVICE_TIMEOUT', 10))
+)
+timeout = int(os.environ.get('TIMEOUT', payment_wait + 30))
+if timeout <= payment_wait:
+    raise ValueError(f"TIMEOUT must be above the longest payment wait ({payment_wait:g} s), got {timeout}")
+
+# Each worker writes its metrics to a file in METRICS_DIR and /metrics merges
+# them (see metrics_registry.py). A new directory per start, so the files of
+# an earlier run are never merged in.
+if workers > 1 and not os.environ.get('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+
+# The worker that receives a product cache invalidation passes it on to the
+# others through PRODUCT_CACHE_DIR (see product_cache.py)
+if workers > 1 and not os.environ.get('PRODUCT_CACHE_DIR'):
+    os.environ['PRODUCT_CACHE_DIR'] = tempfile.mkdtemp(prefix='product-cache-')
+
+# The app is imported by each worker after the fork, so every worker builds its
+# own upstream connection pools and background threads.
+preload_app = False
@@ -0,0 +1,273 @@
+"""
+Adaptive timeouts and hedging for idempotent upstream reads.
+
+Only calls made through UpstreamClient.read / AsyncUpstreamClient.read use
+this: the product lookup, the availability check and customer validation.
+Reservation, payment and order writes go through post() and keep the fixed
+per-service timeout. They are never hedged.
+
+Every read endpoint (e.g. inventory_service GET /products/<product_id>)
+keeps its most recent latencies:
+
+- Adaptive timeout: once LATENCY_MIN_SAMPLES reads were seen, the timeout
+  is ADAPTIVE_TIMEOUT_MULTIPLIER x the ADAPTIVE_TIMEOUT_PERCENTILE latency,
+  never below ADAPTIVE_TIMEOUT_MIN and never above the service's fixed
+  timeout. Timed-out reads are recorded at the timeout, so the timeout
+  grows back when the service slows down for everyone.
+- Hedging (HEDGE_ENABLED=true): when a read has not returned after the
+  HEDGE_PERCENTILE latency, the same read is sent again and whichever
+  response arrives first is used. Each service has a budget: every read
+  earns HEDGE_BUDGET_PERCENT / 100 of a hedge, up to HEDGE_BUDGET_BURST
+  saved, so hedging adds at most that share of extra reads even when the
+  whole service is slow. The losing read is not cancelled: it finishes in
+  the background, so slow reads still show up in the latency window.
+
+In the sync gateway the racing reads run on a pool of HEDGE_WORKERS
+threads, and the request thread waits for the first answer. A read never
+queues for that pool: when no thread is free, or the budget could not pay
+for a hedge anyway, the read runs in the request thread, unhedged. Queueing
+would otherwise count toward the hedge delay (firing hedges at a service
+that is not slow) without ever reaching the latency window.
+
+Configuration (environment):
+    ADAPTIVE_TIMEOUT             false keeps the fixed timeouts for reads (default true)
+    ADAPTIVE_TIMEOUT_PERCENTILE  latency percentile the timeout follows (default 99)
+    ADAPTIVE_TIMEOUT_MULTIPLIER  timeout = multiplier x that percentile (default 3)
+    ADAPTIVE_TIMEOUT_MIN         lower bound in seconds (default 1)
+    LATENCY_WINDOW               latencies kept per endpoint (default 256)
+    LATENCY_MIN_SAMPLES          reads seen before adapting or hedging (default 20)
+    HEDGE_ENABLED                send a second copy of slow reads (default false)
+    HEDGE_PERCENTILE             latency percentile after which to hedge (default 95)
+    HEDGE_MIN_DELAY              lower bound of the hedge delay in seconds (default 0.005)
+    HEDGE_BUDGET_PERCENT         extra reads hedging may add, in percent (default 10)
+    HEDGE_BUDGET_BURST           hedges that can be saved up (default 10)
+    HEDGE_WORKERS                threads running hedged reads in the sync gateway (default 16)
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+from metrics import METRICS_ENABLED, hedged_reads, read_timeout
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+ADAPTIVE_TIMEOUT = _env_bool('ADAPTIVE_TIMEOUT', 'true')
+ADAPTIVE_TIMEOUT_PERCENTILE = float(os.environ.get('ADAPTIVE_TIMEOUT_PERCENTILE', 99))
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.environ.get('ADAPTIVE_TIMEOUT_MULTIPLIER', 3))
+ADAPTIVE_TIMEOUT_MIN = float(os.environ.get('ADAPTIVE_TIMEOUT_MIN', 1.0))
+LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', 256))
+LATENCY_MIN_SAMPLES = int(os.environ.get('LATENCY_MIN_SAMPLES', 20))
+HEDGE_ENABLED = _env_bool('HEDGE_ENABLED', 'false')
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 95))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 0.005))
+HEDGE_BUDGET_PERCENT = float(os.environ.get('HEDGE_BUDGET_PERCENT', 10))
+HEDGE_BUDGET_BURST = float(os.environ.get('HEDGE_BUDGET_BURST', 10))
+HEDGE_WORKERS = int(os.environ.get('HEDGE_WORKERS', 16))
+
+# Percentiles are recomputed from a sorted copy of the window this often
+REFRESH_EVERY = 16
+
+
+class ReadPolicy:
+    """Latency window of one read endpoint and the timeout/hedge delay derived from it."""
+
+    def __init__(self, service, endpoint, max_timeout, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES):
+        self.service = service
+        self.endpoint = endpoint
+        self.max_timeout = max_timeout
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = [0.0] * window
+        self._count = 0
+        self._timeout = max_timeout
+        self._hedge_delay = None
+        self._lock = threading.Lock()
+
+    def observe(self, duration):
+        with self._lock:
+            self._samples[self._count % self.window] = duration
+            self._count += 1
+            if self._count < self.min_samples or self._count % REFRESH_EVERY:
+                return
+            samples = sorted(self._samples[:min(self._count, self.window)])
+
+        def percentile(q):
+            return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+        if ADAPTIVE_TIMEOUT:
+            self._timeout = min(self.max_timeout, max(ADAPTIVE_TIMEOUT_MIN, ADAPTIVE_TIMEOUT_MULTIPLIER * percentile(ADAPTIVE_TIMEOUT_PERCENTILE)))
+            if METRICS_ENABLED:
+                read_timeout.set(round(self._timeout, 4), self.service, self.endpoint)
+        if HEDGE_ENABLED:
+            self._hedge_delay = max(HEDGE_MIN_DELAY, percentile(HEDGE_PERCENTILE))
+
+    def timeout(self):
+        return self._timeout
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while hedging is off or still warming up"""
+        return self._hedge_delay
+
+    def stats(self):
+        return {
+            "endpoint": self.endpoint,
+            "reads": self._count,
+            "timeout": round(self._timeout, 4),
+            "hedge_delay": round(self._hedge_delay, 4) if self._hedge_delay is not None else None
+        }
+
+
+class HedgeBudget:
+    """Token bucket: each read earns a fraction of a hedge, each hedge spends one."""
+
+    def __init__(self, percent=HEDGE_BUDGET_PERCENT, burst=HEDGE_BUDGET_BURST):
+        self.ratio = percent / 100
+        self.burst = burst
+        self.counters = {"reads": 0, "hedged": 0, "hedge_won": 0, "budget_exhausted": 0}
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.counters['reads'] += 1
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def can_spend(self):
+        with self._lock:
+            return self._tokens >= 1
+
+    def spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.counters['budget_exhausted'] += 1
+                return False
+            self._tokens -= 1
+            self.counters['hedged'] += 1
+            return True
+
+    def won(self):
+        with self._lock:
+            self.counters['hedge_won'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, tokens=round(self._tokens, 2))
+
+
+def _record(policy, result):
+    if METRICS_ENABLED:
+        hedged_reads.inc(policy.service, policy.endpoint, result)
+
+
+_executor = None
+_executor_pid = None
+_executor_slots = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    # Threads do not survive a fork, so each worker process builds its own pool
+    global _executor, _executor_pid, _executor_slots
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+            _executor_slots = threading.BoundedSemaphore(HEDGE_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor, _executor_slots
+
+
+def _try_submit(attempt):
+    """Start attempt on a free pool thread; None if every thread is busy, so it never waits in the queue"""
+    pool, slots = _pool()
+    if not slots.acquire(blocking=False):
+        return None
+
+    # Each attempt runs in its own copy of the caller's context (request ID, trace)
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            return context.run(attempt)
+        finally:
+            slots.release()
+
+    return pool.submit(run)
+
+
+def hedged(policy, budget, attempt, delay):
+    """Run attempt(), and once more if the first has not finished after delay; first success wins"""
+    primary = _try_submit(attempt) if budget.can_spend() else None
+    if primary is None:
+        # No hedge could follow, or the pool is busy: the read is cheaper in this thread
+        return attempt()
+
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+
+    if not budget.spend():
+        _record(policy, 'budget_exhausted')
+        return primary.result()
+
+    hedge = _try_submit(attempt)
+    if hedge is None:
+        _record(policy, 'pool_busy')
+        return primary.result()
+
+    done, _ = wait((primary, hedge), return_when=FIRST_COMPLETED)
+    winner = next((future for future in (primary, hedge) if future in done and future.exception() is None), None)
+    if winner is None:
+        # The first one to finish failed; the other is the only chance left
+        winner = hedge if primary in done else primary
+    if winner is hedge:
+        budget.won()
+    _record(policy, 'hedge_won' if winner is hedge else 'primary_won')
+    # The loser keeps running on the pool and is discarded
+    return winner.result()
+
+
+# Keeps losing asyncio reads referenced until they finish
+_detached = set()
+
+
+def _detach(task):
+    def done(task):
+        _detached.discard(task)
+        if not task.cancelled():
+            task.exception()
+    _detached.add(task)
+    task.add_done_callback(done)
+
+
+async def hedged_async(policy, budget, attempt, delay):
+    """asyncio counterpart of hedged()"""
+    primary = asyncio.ensure_future(attempt())
+    hedge = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        if not budget.spend():
+            _record(policy, 'budget_exhausted')
+            return await primary
+
+        hedge = asyncio.ensure_future(attempt())
+        done, _ = await asyncio.wait({primary, hedge}, return_when=asyncio.FIRST_COMPLETED)
+        winner = next((task for task in (primary, hedge) if task in done and task.exception() is None), None)
+        if winner is None:
+            winner = hedge if primary in done else primary
+        if winner is hedge:
+            budget.won()
+        _record(policy, 'hedge_won' if winner is hedge else 'primary_won')
+        return await winner
+    finally:
+        for task in (primary, hedge):
+            if task is not None and not task.done():
+                _detach(task)
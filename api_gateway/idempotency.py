@@ -0,0 +1,418 @@
+"""
+Idempotency-Key support for the gateway's write routes.
+
+A request carrying an `Idempotency-Key` header runs at most once per key:
+- while the first request is in flight, duplicates wait for its result;
+- once it completes, duplicates get the stored response back
+  (marked with `Idempotent-Replayed: true`) without touching any service;
+- reusing a key with a different request body is rejected with 422.
+
+A view calls mark_committed() once it has done something a retry must not
+repeat (create_order: the payment went through). From then on the response
+is stored whatever its status, 5xx and unhandled errors included, so a
+retry gets the same failure back instead of paying again. A request that
+fails before that point committed nothing: its key is released and a retry
+runs it again.
+
+Keys are kept in MongoDB when IDEMPOTENCY_MONGO_URI (or MONGO_URI) is set:
+one document per key in the gateway_idempotency collection, claimed with an
+insert on the unique _id, so every gateway process and host sees the same
+keys. Duplicates of an in-flight request poll its document. A request whose
+process died holds its key until IDEMPOTENCY_LEASE runs out; after that a
+retry takes the key over, unless the request had already committed, in which
+case the key stays blocked (409) until it expires, because its outcome is
+unknown. A TTL index removes keys IDEMPOTENCY_TTL seconds after they were
+created.
+
+Without Mongo, keys live in a bounded in-process LRU cache. That only
+deduplicates retries that reach the same process, so it is only correct with
+a single gateway worker (WORKERS=1). When the cache is full of in-flight
+requests, new keys are refused with 503.
+
+Configuration (environment):
+    IDEMPOTENCY_MONGO_URI      MongoDB for the keys (default MONGO_URI; unset: in-process cache)
+    IDEMPOTENCY_TTL            seconds a key and its response are kept (default 86400)
+    IDEMPOTENCY_CACHE_SIZE     in-process cache: max stored keys (default 10000)
+    IDEMPOTENCY_WAIT_TIMEOUT   seconds a duplicate waits for the in-flight request (default 30)
+    IDEMPOTENCY_LEASE          Mongo: seconds before an unfinished request's key can be taken over (default 120)
+    IDEMPOTENCY_POLL_INTERVAL  Mongo: seconds between reads while waiting (default 0.05)
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, jsonify, make_response, request
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Body stored for an unhandled error after the request committed
+COMMITTED_ERROR = ({"success": False, "error": "Internal server error"}, 500)
+
+
+class IdempotencyEntry:
+    def __init__(self, fingerprint, owner=None):
+        self.fingerprint = fingerprint
+        self.owner = owner
+        self.committed = False
+        self.done = threading.Event()
+        self.response = None
+        self.expires_at = None
+
+
+class IdempotencyStore:
+    """Bounded TTL store of in-flight and completed requests keyed by idempotency key, for one process."""
+
+    backend = 'memory'
+
+    def __init__(self, ttl=86400, max_size=10000, wait_timeout=30):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.counters = {"executed": 0, "replayed": 0, "waited": 0, "conflicts": 0, "full": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key, fingerprint):
+        """
+        Register a request. Returns (state, entry), where state is 'new' (the
+        caller must run the request and then complete/abandon it), 'in_flight',
+        'done', 'conflict' or 'full' (no room for another key).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._evict()
+                if len(self._entries) >= self.max_size:
+                    self.counters['full'] += 1
+                    return 'full', None
+                entry = IdempotencyEntry(fingerprint)
+                self._entries[key] = entry
+                self.counters['executed'] += 1
+                return 'new', entry
+
+            self._entries.move_to_end(key)
+            if entry.fingerprint != fingerprint:
+                self.counters['conflicts'] += 1
+                return 'conflict', entry
+            if entry.done.is_set():
+                self.counters['replayed'] += 1
+                return 'done', entry
+            self.counters['waited'] += 1
+            return 'in_flight', entry
+
+    def wait(self, key, entry, timeout):
+        """True once the in-flight request finished (entry.response is None if it was abandoned)"""
+        return entry.done.wait(timeout)
+
+    def mark_committed(self, key, entry):
+        entry.committed = True
+
+    def complete(self, key, entry, response):
+        """Store the (body, status, headers) response and wake up waiting duplicates"""
+        with self._lock:
+            entry.response = response
+            entry.expires_at = time.monotonic() + self.ttl
+        entry.done.set()
+
+    def abandon(self, key, entry):
+        """Forget a request that failed so the next retry runs it again"""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def _evict(self):
+        # Only completed entries are evicted, oldest first; in-flight ones have waiters
+        if len(self._entries) < self.max_size:
+            return
+        for key in [key for key, entry in self._entries.items() if entry.done.is_set()]:
+            del self._entries[key]
+            if len(self._entries) < self.max_size:
+                return
+
+    def stats(self):
+        return dict(self.counters, backend=self.backend, stored_keys=len(self._entries), ttl=self.ttl, max_size=self.max_size)
+
+
+class MongoIdempotencyStore:
+    """Idempotency keys in a MongoDB collection, shared by every gateway process."""
+
+    backend = 'mongo'
+
+    def __init__(self, collection, ttl=86400, wait_timeout=30, lease=120, poll_interval=0.05):
+        self.collection = collection
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.counters = {"executed": 0, "replayed": 0, "waited": 0, "conflicts": 0, "taken_over": 0}
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', name='expires_at_ttl', expireAfterSeconds=0)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def begin(self, key, fingerprint):
+        """Same contract as IdempotencyStore.begin"""
+        from pymongo.errors import DuplicateKeyError
+
+        while True:
+            now = datetime.utcnow()
+            owner = uuid.uuid4().hex
+            try:
+                self.collection.insert_one({
+                    "_id": key,
+                    "fingerprint": fingerprint,
+                    "state": "in_flight",
+                    "owner": owner,
+                    "committed": False,
+                    "lease_until": now + timedelta(seconds=self.lease),
+                    "expires_at": now + timedelta(seconds=self.ttl)
+                })
+                self._count('executed')
+                return 'new', IdempotencyEntry(fingerprint, owner)
+            except DuplicateKeyError:
+                pass
+
+            document = self.collection.find_one({"_id": key})
+            if document is None:
+                # Released or expired since the insert failed
+                continue
+            if document['expires_at'] <= now:
+                # Expired, but the TTL monitor has not removed it yet
+                self.collection.delete_one({"_id": key, "owner": document['owner']})
+                continue
+
+            entry = self._entry(document)
+            if document['fingerprint'] != fingerprint:
+                self._count('conflicts')
+                return 'conflict', entry
+            if document['state'] == 'done':
+                self._count('replayed')
+                return 'done', entry
+            if document['lease_until'] <= now and not document['committed']:
+                # Its process died before doing anything that matters; run the request here
+                taken = self.collection.find_one_and_update(
+                    {"_id": key, "owner": document['owner'], "state": "in_flight", "committed": False},
+                    {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=self.lease)}}
+                )
+                if taken is None:
+                    continue
+                self._count('taken_over')
+                return 'new', IdempotencyEntry(fingerprint, owner)
+            self._count('waited')
+            return 'in_flight', entry
+
+    @staticmethod
+    def _entry(document):
+        entry = IdempotencyEntry(document['fingerprint'], document['owner'])
+        entry.committed = document['committed']
+        if document['state'] == 'done':
+            stored = document['response']
+            entry.response = (bytes(stored['body']), stored['status'], {"Content-Type": stored['content_type']})
+            entry.done.set()
+        return entry
+
+    def wait(self, key, entry, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            document = self.collection.find_one({"_id": key, "owner": entry.owner})
+            if document is None or document['state'] == 'done':
+                if document is not None:
+                    entry.response = self._entry(document).response
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def mark_committed(self, key, entry):
+        entry.committed = True
+        self.collection.update_one({"_id": key, "owner": entry.owner}, {"$set": {"committed": True}})
+
+    def complete(self, key, entry, response):
+        body, status, headers = response
+        entry.response = response
+        self.collection.update_one(
+            {"_id": key, "owner": entry.owner},
+            {"$set": {"state": "done", "response": {"body": body, "status": status, "content_type": headers['Content-Type']}}}
+        )
+
+    def abandon(self, key, entry):
+        self.collection.delete_one({"_id": key, "owner": entry.owner, "committed": False})
+
+    def stats(self):
+        return dict(self.counters, backend=self.backend, ttl=self.ttl, lease=self.lease)
+
+
+def idempotency_store_from_env():
+    ttl = float(os.environ.get('IDEMPOTENCY_TTL', 86400))
+    wait_timeout = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 30))
+    mongo_uri = os.environ.get('IDEMPOTENCY_MONGO_URI') or os.environ.get('MONGO_URI')
+    if not mongo_uri:
+        return IdempotencyStore(
+            ttl=ttl,
+            max_size=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)),
+            wait_timeout=wait_timeout
+        )
+
+    from pymongo import MongoClient
+
+    store = MongoIdempotencyStore(
+        MongoClient(mongo_uri).klea_ecommerce_gateway.gateway_idempotency,
+        ttl=ttl,
+        wait_timeout=wait_timeout,
+        lease=float(os.environ.get('IDEMPOTENCY_LEASE', 120)),
+        poll_interval=float(os.environ.get('IDEMPOTENCY_POLL_INTERVAL', 0.05))
+    )
+    try:
+        store.ensure_indexes()
+    except Exception as e:
+        print(f"Failed to create the idempotency TTL index: {str(e)}")
+    return store
+
+
+def mark_committed():
+    """
+    Record that the current request did something a retry must not repeat;
+    its response is stored from now on, whatever the status. No-op without
+    an Idempotency-Key.
+    """
+    active = g.get('idempotency')
+    if active is not None:
+        store, key, entry = active
+        store.mark_committed(key, entry)
+
+
+async def async_mark_committed():
+    """mark_committed for the Quart app"""
+    from quart import g as quart_g
+
+    active = quart_g.get('idempotency')
+    if active is not None:
+        store, key, entry = active
+        await asyncio.to_thread(store.mark_committed, key, entry)
+
+
+def _fingerprint(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def _error(message, status):
+    return {"success": False, "error": message}, status
+
+
+def _early_response(state, entry, waited):
+    """(body, status) for a request that must not run, or None when it should"""
+    if state == 'conflict':
+        return _error("Idempotency-Key was already used with a different request", 422)
+    if state == 'full':
+        return _error("Too many requests in progress; retry with the same Idempotency-Key", 503)
+    if state == 'in_flight' and not waited:
+        return _error("A request with this Idempotency-Key is still in progress", 409)
+    if state != 'new' and entry.response is None:
+        return _error("The original request failed; retry with the same Idempotency-Key", 409)
+    return None
+
+
+def _replay(response_class, entry):
+    """Rebuild the stored response"""
+    body, status, headers = entry.response
+    response = response_class(body, status=status, headers=headers)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _stored(response, body):
+    return body, response.status_code, {"Content-Type": response.content_type}
+
+
+def idempotent(store):
+    """Deduplicate a Flask view on the Idempotency-Key header"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+
+            scoped_key = f"{request.path}:{key}"
+            state, entry = store.begin(scoped_key, _fingerprint(request.get_data()))
+            waited = state == 'in_flight' and store.wait(scoped_key, entry, store.wait_timeout)
+            early = _early_response(state, entry, waited)
+            if early is not None:
+                body, status = early
+                return jsonify(body), status
+            if state != 'new':
+                return _replay(current_app.response_class, entry)
+
+            g.idempotency = (store, scoped_key, entry)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                if not entry.committed:
+                    store.abandon(scoped_key, entry)
+                    raise
+                body, status = COMMITTED_ERROR
+                response = make_response(jsonify(body), status)
+
+            if response.status_code >= 500 and not entry.committed:
+                store.abandon(scoped_key, entry)
+            else:
+                store.complete(scoped_key, entry, _stored(response, response.get_data()))
+            return response
+        return wrapper
+    return decorator
+
+
+def async_idempotent(store):
+    """Deduplicate a Quart view on the Idempotency-Key header"""
+    from quart import current_app as quart_app, g as quart_g, jsonify as quart_jsonify, make_response as quart_make_response, request as quart_request
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            key = quart_request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return await view(*args, **kwargs)
+
+            scoped_key = f"{quart_request.path}:{key}"
+            state, entry = await asyncio.to_thread(store.begin, scoped_key, _fingerprint(await quart_request.get_data()))
+            waited = state == 'in_flight' and await asyncio.to_thread(store.wait, scoped_key, entry, store.wait_timeout)
+            early = _early_response(state, entry, waited)
+            if early is not None:
+                body, status = early
+                return quart_jsonify(body), status
+            if state != 'new':
+                return _replay(quart_app.response_class, entry)
+
+            quart_g.idempotency = (store, scoped_key, entry)
+            try:
+                response = await quart_make_response(await view(*args, **kwargs))
+            except Exception:
+                if not entry.committed:
+                    await asyncio.to_thread(store.abandon, scoped_key, entry)
+                    raise
+                body, status = COMMITTED_ERROR
+                response = await quart_make_response(quart_jsonify(body), status)
+
+            if response.status_code >= 500 and not entry.committed:
+                await asyncio.to_thread(store.abandon, scoped_key, entry)
+            else:
+                await asyncio.to_thread(store.complete, scoped_key, entry, _stored(response, await response.get_data()))
+            return response
+        return wrapper
+    return decorator
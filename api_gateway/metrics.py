@@ -0,0 +1,139 @@
+"""
+In-process metrics, served in the Prometheus text format at GET /metrics:
+
+    http_requests_total{method, route, status}
+    http_request_duration_seconds{method, route}        histogram
+    order_stage_duration_seconds{stage}                 histogram, one per create_order step
+    compensations_total{reason, outcome}                cancel_reservations calls
+    compensated_reservations_total{reason}              reservations released by them
+    circuit_breaker_state{service}                      gauge: 0 closed, 1 half-open, 2 open (the worst worker)
+    circuit_breaker_transitions_total{service, state}   state changes (see resilience.py)
+    upstream_rejected_total{service, reason}            calls failed fast: circuit_open, bulkhead_full
+    bulkhead_in_flight{service}                         gauge, calls in flight per service
+    upstream_read_timeout_seconds{service, endpoint}    gauge, adaptive read timeout, the longest worker's (see hedging.py)
+    upstream_hedged_reads_total{service, endpoint, result}  primary_won, hedge_won, budget_exhausted, pool_busy
+
+Stages: auth, customer_validation, product_lookup, availability, reserve,
+payment, order_record, confirm. With INVENTORY_BATCH_RESERVE the lookup,
+availability check and reservation are one call, recorded as `reserve`.
+
+Recording is a dict lookup and a few additions under a lock, cheap enough to
+leave on under full load (see benchmarks/metrics_overhead.py). With several
+gunicorn workers, /metrics merges the numbers of all of them (see
+metrics_registry.py).
+
+Configuration (environment):
+    METRICS_ENABLED   false turns off recording and the /metrics route (default true)
+"""
+import inspect
+import os
+import time
+from functools import wraps
+
+from flask import Response, g, request
+
+from metrics_registry import Registry
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+registry = Registry()
+http_requests = registry.counter('http_requests_total', "Requests handled", ('method', 'route', 'status'))
+http_duration = registry.histogram('http_request_duration_seconds', "Request handling time", ('method', 'route'))
+
+
+order_stage_duration = registry.histogram('order_stage_duration_seconds', "create_order step time", ('stage',))
+compensations = registry.counter('compensations_total', "cancel_reservations calls", ('reason', 'outcome'))
+compensated_reservations = registry.counter('compensated_reservations_total', "Reservations released by compensation", ('reason',))
+
+breaker_state = registry.gauge('circuit_breaker_state', "Circuit breaker state (0 closed, 1 half-open, 2 open)", ('service',), merge='max')
+breaker_transitions = registry.counter('circuit_breaker_transitions_total', "Circuit breaker state changes", ('service', 'state'))
+upstream_rejections = registry.counter('upstream_rejected_total', "Upstream calls failed fast", ('service', 'reason'))
+bulkhead_in_flight = registry.gauge('bulkhead_in_flight', "Upstream calls in flight", ('service',))
+read_timeout = registry.gauge('upstream_read_timeout_seconds', "Adaptive read timeout", ('service', 'endpoint'), merge='max')
+hedged_reads = registry.counter('upstream_hedged_reads_total', "Reads that were slow enough to hedge", ('service', 'endpoint', 'result'))
+
+
+def timed_stage(stage):
+    """Record the duration of every call of the decorated helper (sync or async) as a saga stage"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    order_stage_duration.observe(time.perf_counter() - started, stage)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                order_stage_duration.observe(time.perf_counter() - started, stage)
+        return wrapper
+    return decorator
+
+
+def record_compensation(reason, reservation_count, succeeded):
+    if METRICS_ENABLED:
+        compensations.inc(reason, 'ok' if succeeded else 'failed')
+        if succeeded:
+            compensated_reservations.inc(reason, amount=reservation_count)
+
+
+def init_metrics(app):
+    """Time every request of a Flask app and serve GET /metrics"""
+    if not METRICS_ENABLED:
+        return
+
+    registry.start_flusher()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            http_duration.observe(time.perf_counter() - started, request.method, route)
+            http_requests.inc(request.method, route, response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_async_metrics(app):
+    """Quart counterpart of init_metrics"""
+    if not METRICS_ENABLED:
+        return
+
+    from quart import Response as QuartResponse, g as quart_g, request as quart_request
+
+    registry.start_flusher()
+
+    @app.before_request
+    async def start_timer():
+        quart_g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    async def record_request(response):
+        started = quart_g.pop('metrics_started', None)
+        if started is not None:
+            route = quart_request.url_rule.rule if quart_request.url_rule is not None else 'unmatched'
+            http_duration.observe(time.perf_counter() - started, quart_request.method, route)
+            http_requests.inc(quart_request.method, route, response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    async def metrics():
+        return QuartResponse(registry.render(), mimetype='text/plain; version=0.0.4')
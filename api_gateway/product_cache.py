@@ -0,0 +1,189 @@
+"""
+Read-through cache for product metadata (name, price) in the gateway.
+
+Entries expire after a TTL and the least recently used entry is evicted once
+the cache is full. inventory_service calls the gateway's invalidation route
+when a product changes.
+
+Each gateway worker keeps its own cache, and the invalidation request
+reaches only one of them. With PRODUCT_CACHE_DIR set (gunicorn.conf.py sets
+it whenever more than one worker runs), that worker also touches a marker
+file there, one per product plus one for "every product". A cache hit checks
+the markers' modification times, outside the cache lock and at most every
+PRODUCT_CACHE_CHECK_MS per entry, so an entry cached before the latest
+invalidation is dropped by every worker within that interval. Marker files
+are empty and are never removed; there is at most one per product ever
+changed.
+
+A read that started before an invalidation must not store what it read
+after it: callers take begin_read() before asking inventory_service and
+hand it to put(), which skips the value if an invalidation landed since.
+
+The invalidation routes answer only callers presenting
+CACHE_INVALIDATION_TOKEN in the X-Invalidation-Token header, or, with no
+token configured, callers on the gateway's own host.
+
+Configuration (environment):
+    PRODUCT_CACHE_TTL     seconds an entry stays fresh; 0 disables the cache (default 30)
+    PRODUCT_CACHE_SIZE    max cached products (default 10000)
+    PRODUCT_CACHE_DIR     directory shared by the gateway's workers for invalidations (default unset: this worker only)
+    PRODUCT_CACHE_CHECK_MS    milliseconds between checks of an entry's invalidation markers (default 100)
+    CACHE_INVALIDATION_TOKEN  shared secret required by the invalidation routes (default unset: local callers only)
+"""
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Marker touched when every product is invalidated; not a valid product ID
+ALL_PRODUCTS = '_all'
+
+INVALIDATION_TOKEN_HEADER = 'X-Invalidation-Token'
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def invalidation_allowed(headers, remote_addr, token=None):
+    """Whether a caller may invalidate cached products: the shared token, or a local caller when there is none"""
+    token = os.environ.get('CACHE_INVALIDATION_TOKEN') if token is None else token
+    if token:
+        return hmac.compare_digest(headers.get(INVALIDATION_TOKEN_HEADER, '').encode(), token.encode())
+    return remote_addr in LOCAL_ADDRESSES
+
+
+class ProductCache:
+    """Bounded TTL + LRU cache keyed by product ID."""
+
+    def __init__(self, ttl=30, max_size=10000, shared_dir=None, check_interval=0.1):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared_dir = shared_dir
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.skipped_puts = 0
+        # product ID -> [value, expires_at, read_started, checked_at]
+        self._entries = OrderedDict()
+        # Bumped by every invalidation in this worker
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, product_id):
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(product_id)
+            if entry is not None and entry[1] <= now:
+                del self._entries[product_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            if not self.shared_dir or now - entry[3] < self.check_interval:
+                self._entries.move_to_end(product_id)
+                self.hits += 1
+                return entry[0]
+
+        # The markers are checked without holding the lock
+        invalidated = self._invalidated_since(product_id, entry[2])
+        with self._lock:
+            if invalidated:
+                if self._entries.get(product_id) is entry:
+                    del self._entries[product_id]
+                self.misses += 1
+                return None
+            entry[3] = now
+            self.hits += 1
+            return entry[0]
+
+    def begin_read(self):
+        """Token for a read from inventory_service that is about to start; pass it to put()"""
+        with self._lock:
+            return self._generation, time.time()
+
+    def put(self, product_id, value, read=None):
+        """Cache value, read since read (a begin_read() token; default now), unless an invalidation landed since"""
+        if not self.enabled:
+            return
+
+        generation, read_started = read or self.begin_read()
+        checked_at = time.monotonic()
+        if self._invalidated_since(product_id, read_started):
+            with self._lock:
+                self.skipped_puts += 1
+            return
+
+        with self._lock:
+            if self._generation != generation:
+                self.skipped_puts += 1
+                return
+            self._entries[product_id] = [value, time.monotonic() + self.ttl, read_started, checked_at]
+            self._entries.move_to_end(product_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, product_id=None):
+        """Drop one product, or every product when product_id is None, in every worker sharing shared_dir"""
+        with self._lock:
+            if product_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(product_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+        if self.shared_dir:
+            path = self._marker(product_id)
+            os.makedirs(self.shared_dir, exist_ok=True)
+            with open(path, 'a'):
+                pass
+            os.utime(path)
+
+    def _marker(self, product_id):
+        # IDs that cannot be a file name cannot be a product either; invalidate everything to be safe
+        name = product_id if product_id is not None and product_id.isalnum() else ALL_PRODUCTS
+        return os.path.join(self.shared_dir, name)
+
+    def _invalidated_since(self, product_id, since):
+        """Whether any worker invalidated product_id, or every product, at or after since (a time.time())"""
+        if not self.shared_dir:
+            return False
+        for path in (self._marker(product_id), self._marker(None)):
+            try:
+                if os.stat(path).st_mtime >= since:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "max_size": self.max_size,
+            "shared": bool(self.shared_dir),
+            "cached_products": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "skipped_puts": self.skipped_puts
+        }
+
+
+def product_cache_from_env():
+    return ProductCache(
+        ttl=float(os.environ.get('PRODUCT_CACHE_TTL', 30)),
+        max_size=int(os.environ.get('PRODUCT_CACHE_SIZE', 10000)),
+        shared_dir=os.environ.get('PRODUCT_CACHE_DIR') or None,
+        check_interval=float(os.environ.get('PRODUCT_CACHE_CHECK_MS', 100)) / 1000
+    )
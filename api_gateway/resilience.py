@@ -0,0 +1,295 @@
+"""
+Circuit breakers and bulkheads for the downstream services.
+
+Every upstream client guards its calls with one CircuitBreaker and one
+Bulkhead (per worker process):
+
+- The breaker keeps the outcome of the last BREAKER_WINDOW calls. Once at
+  least BREAKER_MIN_CALLS are recorded and either the failure rate
+  (connection errors, timeouts, 5xx responses) or the slow-call rate (calls
+  taking BREAKER_SLOW_CALL_SECONDS or more) reaches its threshold, the
+  breaker opens and calls fail immediately with UpstreamUnavailable. After
+  BREAKER_OPEN_SECONDS it lets BREAKER_HALF_OPEN_CALLS probe calls through:
+  if they all succeed it closes again, and a failed or slow probe reopens it.
+- The bulkhead caps the calls in flight to the service. A call that cannot
+  get a slot within BULKHEAD_MAX_WAIT seconds is rejected, so a slow
+  dependency ties up at most that many gateway threads/greenlets.
+
+4xx responses are answers, not failures: a declined payment or missing
+stock does not count against the breaker.
+
+Configuration (environment), each with a per-service override such as
+PAYMENT_SERVICE_BREAKER_OPEN_SECONDS:
+    BREAKER_ENABLED             false disables breakers and bulkheads (default true)
+    BREAKER_WINDOW              calls in the sliding window (default 20)
+    BREAKER_MIN_CALLS           calls recorded before the rates apply (default 10)
+    BREAKER_FAILURE_RATE        failure percentage that opens the breaker (default 50)
+    BREAKER_SLOW_CALL_RATE      slow-call percentage that opens the breaker (default 80)
+    BREAKER_SLOW_CALL_SECONDS   duration from which a call counts as slow (default 2)
+    BREAKER_OPEN_SECONDS        time spent open before probing (default 15)
+    BREAKER_HALF_OPEN_CALLS     probe calls while half-open (default 3)
+    BULKHEAD_MAX_CONCURRENT     calls in flight per service (default 20)
+    BULKHEAD_MAX_WAIT           seconds to wait for a free slot (default 0.05)
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import (
+    METRICS_ENABLED, breaker_state, breaker_transitions, bulkhead_in_flight, upstream_rejections
+)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# circuit_breaker_state gauge values
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """A call was rejected without reaching the service."""
+
+    def __init__(self, service, reason, retry_after=None):
+        self.service = service
+        self.reason = reason
+        self.retry_after = retry_after
+        if reason == 'bulkhead_full':
+            message = f"{service} is unavailable: too many calls in flight"
+        else:
+            message = f"{service} is unavailable: circuit breaker is open"
+        super().__init__(message)
+
+
+def _reject(service, reason, retry_after=None):
+    if METRICS_ENABLED:
+        upstream_rejections.inc(service, reason)
+    raise UpstreamUnavailable(service, reason, retry_after)
+
+
+class CircuitBreaker:
+    """Count-based sliding window breaker with half-open probing."""
+
+    def __init__(self, service, window=20, min_calls=10, failure_rate=50, slow_call_rate=80,
+                 slow_call_duration=2.0, open_duration=15.0, half_open_calls=3, clock=time.monotonic):
+        self.service = service
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_duration = slow_call_duration
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.state = CLOSED
+        self.counters = {"opened": 0, "rejected": 0}
+        self._outcomes = deque()
+        self._failures = 0
+        self._slow_calls = 0
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._lock = threading.Lock()
+        if METRICS_ENABLED:
+            breaker_state.set(STATE_VALUES[CLOSED], service)
+
+    def before_call(self):
+        """Raises UpstreamUnavailable unless the call may go ahead"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_duration - self.clock()
+                if remaining > 0:
+                    self.counters['rejected'] += 1
+                    _reject(self.service, 'circuit_open', remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes_started >= self.half_open_calls:
+                    self.counters['rejected'] += 1
+                    _reject(self.service, 'circuit_open', self.open_duration)
+                self._probes_started += 1
+
+    def record(self, duration, failed):
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                # Started before the breaker opened
+                return
+
+            self._outcomes.append((failed, slow))
+            self._failures += failed
+            self._slow_calls += slow
+            if len(self._outcomes) > self.window:
+                old_failed, old_slow = self._outcomes.popleft()
+                self._failures -= old_failed
+                self._slow_calls -= old_slow
+
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and (
+                self._failures * 100 >= self.failure_rate * calls
+                or self._slow_calls * 100 >= self.slow_call_rate * calls
+            ):
+                self._transition(OPEN)
+
+    def _transition(self, state):
+        self.state = state
+        self._outcomes.clear()
+        self._failures = 0
+        self._slow_calls = 0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        if state == OPEN:
+            self._opened_at = self.clock()
+            self.counters['opened'] += 1
+        if METRICS_ENABLED:
+            breaker_state.set(STATE_VALUES[state], self.service)
+            breaker_transitions.inc(self.service, state)
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            return dict(
+                self.counters,
+                state=self.state,
+                window_calls=calls,
+                failure_rate=round(self._failures * 100 / calls, 1) if calls else 0.0,
+                slow_call_rate=round(self._slow_calls * 100 / calls, 1) if calls else 0.0
+            )
+
+
+class Bulkhead:
+    """Caps the calls in flight to one service."""
+
+    def __init__(self, service, max_concurrent=20, max_wait=0.05):
+        self.service = service
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        # Created on first use so it belongs to the running event loop
+        self._async_slots = None
+        self._lock = threading.Lock()
+
+    def _entered(self, delta):
+        with self._lock:
+            self.in_flight += delta
+            if METRICS_ENABLED:
+                bulkhead_in_flight.set(self.in_flight, self.service)
+
+    def _full(self):
+        with self._lock:
+            self.rejected += 1
+        _reject(self.service, 'bulkhead_full')
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.max_wait):
+            self._full()
+        self._entered(1)
+
+    def release(self):
+        self._entered(-1)
+        self._slots.release()
+
+    async def acquire_async(self):
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrent)
+        if not self._async_slots.locked():
+            await self._async_slots.acquire()
+        elif self.max_wait <= 0:
+            self._full()
+        else:
+            try:
+                await asyncio.wait_for(self._async_slots.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self._full()
+        self._entered(1)
+
+    def release_async(self):
+        self._entered(-1)
+        self._async_slots.release()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected
+        }
+
+
+class Guard:
+    """Runs upstream calls through a bulkhead and a circuit breaker."""
+
+    def __init__(self, breaker, bulkhead):
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+
+    def call(self, send):
+        self.bulkhead.acquire()
+        try:
+            self.breaker.before_call()
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = send()
+                failed = response.status_code >= 500
+                return response
+            finally:
+                self.breaker.record(time.perf_counter() - started, failed)
+        finally:
+            self.bulkhead.release()
+
+    async def call_async(self, send):
+        await self.bulkhead.acquire_async()
+        try:
+            self.breaker.before_call()
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = await send()
+                failed = response.status_code >= 500
+                return response
+            finally:
+                self.breaker.record(time.perf_counter() - started, failed)
+        finally:
+            self.bulkhead.release_async()
+
+    def stats(self):
+        return {"circuit_breaker": self.breaker.stats(), "bulkhead": self.bulkhead.stats()}
+
+
+def _setting(service, name, default, cast=float):
+    value = os.environ.get(f'{service.upper()}_{name}', os.environ.get(name))
+    return default if value is None else cast(value)
+
+
+def guard_from_env(service):
+    """Breaker and bulkhead for one service, or None when BREAKER_ENABLED=false"""
+    if _setting(service, 'BREAKER_ENABLED', 'true', str).strip().lower() == 'false':
+        return None
+
+    breaker = CircuitBreaker(
+        service,
+        window=_setting(service, 'BREAKER_WINDOW', 20, int),
+        min_calls=_setting(service, 'BREAKER_MIN_CALLS', 10, int),
+        failure_rate=_setting(service, 'BREAKER_FAILURE_RATE', 50),
+        slow_call_rate=_setting(service, 'BREAKER_SLOW_CALL_RATE', 80),
+        slow_call_duration=_setting(service, 'BREAKER_SLOW_CALL_SECONDS', 2.0),
+        open_duration=_setting(service, 'BREAKER_OPEN_SECONDS', 15.0),
+        half_open_calls=_setting(service, 'BREAKER_HALF_OPEN_CALLS', 3, int)
+    )
+    bulkhead = Bulkhead(
+        service,
+        max_concurrent=_setting(service, 'BULKHEAD_MAX_CONCURRENT', 20, int),
+        max_wait=_setting(service, 'BULKHEAD_MAX_WAIT', 0.05)
+    )
+    return Guard(breaker, bulkhead)
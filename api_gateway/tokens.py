@@ -0,0 +1,118 @@
+"""
+In-process verification of the JWTs issued by auth_service.
+
+auth_service signs tokens with a shared HS256 secret, so the gateway can
+check them itself instead of calling POST /verify on every order. Decoded
+claims go into a bounded LRU cache, and each entry is only served until the
+token's own `exp`, and for at most TOKEN_CACHE_TTL seconds, so a token
+without `exp` is decoded again from time to time rather than cached for
+good.
+
+Configuration (environment):
+    AUTH_VERIFY_MODE    remote | local | local_then_remote
+                        (default: local_then_remote when a secret is set, else remote)
+    JWT_SECRETS         comma-separated key set, tried in order (for key rotation)
+    JWT_SECRET          single secret, used when JWT_SECRETS is not set
+    JWT_ALGORITHMS      comma-separated allowed algorithms (default HS256)
+    TOKEN_CACHE_SIZE    max cached tokens (default 10000)
+    TOKEN_CACHE_TTL     longest time a token's claims are cached, in seconds (default 300)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+VERIFY_MODES = ('remote', 'local', 'local_then_remote')
+
+
+class TokenVerifier:
+    """Verifies tokens against a key set and caches the decoded claims."""
+
+    def __init__(self, secrets, algorithms=('HS256',), cache_size=10000, max_ttl=300, clock=time.time):
+        if not secrets:
+            raise ValueError("at least one JWT secret is required for local verification")
+        self.secrets = list(secrets)
+        self.algorithms = list(algorithms)
+        self.cache_size = cache_size
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        """
+        Return the claims of a valid token.
+        Raises jwt.ExpiredSignatureError or jwt.InvalidTokenError otherwise.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at > now:
+                    self._cache.move_to_end(token)
+                    self.hits += 1
+                    return claims
+                del self._cache[token]
+            self.misses += 1
+
+        claims = self._decode(token)
+        expires_at = now + self.max_ttl
+        if isinstance(claims.get('exp'), (int, float)):
+            expires_at = min(expires_at, claims['exp'])
+
+        with self._lock:
+            self._cache[token] = (claims, expires_at)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return claims
+
+    def _decode(self, token):
+        error = jwt.InvalidTokenError("Invalid token")
+        for secret in self.secrets:
+            try:
+                return jwt.decode(token, secret, algorithms=self.algorithms)
+            except jwt.ExpiredSignatureError:
+                raise
+            except jwt.InvalidSignatureError as e:
+                error = e
+        raise error
+
+    def stats(self):
+        return {
+            "cached_tokens": len(self._cache),
+            "cache_size": self.cache_size,
+            "max_ttl": self.max_ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def load_jwt_secrets():
+    secrets = os.environ.get('JWT_SECRETS')
+    if secrets:
+        return [secret.strip() for secret in secrets.split(',') if secret.strip()]
+    secret = os.environ.get('JWT_SECRET')
+    return [secret] if secret else []
+
+
+def token_verifier_from_env():
+    """Return (mode, verifier) for the configured AUTH_VERIFY_MODE; verifier is None in remote mode"""
+    secrets = load_jwt_secrets()
+    mode = os.environ.get('AUTH_VERIFY_MODE') or ('local_then_remote' if secrets else 'remote')
+    if mode not in VERIFY_MODES:
+        raise ValueError(f"AUTH_VERIFY_MODE must be one of {VERIFY_MODES}, got {mode!r}")
+
+    if mode == 'remote':
+        return mode, None
+
+    algorithms = [a.strip() for a in os.environ.get('JWT_ALGORITHMS', 'HS256').split(',') if a.strip()]
+    cache_size = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+    max_ttl = float(os.environ.get('TOKEN_CACHE_TTL', 300))
+    return mode, TokenVerifier(secrets, algorithms=algorithms, cache_size=cache_size, max_ttl=max_ttl)
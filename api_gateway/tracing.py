@@ -0,0 +1,137 @@
+"""
+Request IDs and per-hop timing for the gateway.
+
+Every request gets an X-Request-ID: the caller's, when it sends a well-formed
+one, otherwise a new one. The upstream clients forward it on each downstream
+call and record how long the call took. The response echoes the ID and carries
+a Server-Timing header with one entry per hop plus the gateway's total, e.g.
+
+    Server-Timing: customer_service;desc="GET /customers/<customer_id>/validate";dur=3.1,
+                   inventory_service;desc="POST /reservations/batch";dur=6.4, ..., total;dur=24.9
+
+Reads name their endpoint template, so IDs from the request do not end up in
+the header. Other hops show the path, with quotes and backslashes escaped and
+characters a header cannot carry replaced by "?".
+
+Each request is logged with its ID, status and handling time, so a slow
+response can be matched with the downstream services' log lines for the same ID.
+
+Configuration (environment):
+    REQUEST_LOG   false turns off the per-request log line (default true)
+"""
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+
+from flask import g, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', 'true').lower() != 'false'
+# Bounds the header size when individual reservations make one hop per line item
+MAX_TIMING_ENTRIES = 50
+
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+_UNSAFE_HEADER_CHARS = re.compile(r'[^\x20-\x7e]')
+
+logger = logging.getLogger('api_gateway.requests')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class RequestTrace:
+    """Request ID and downstream hop timings of one gateway request."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.hops = []
+
+    def record(self, service, method, path, duration, endpoint=None):
+        if len(self.hops) < MAX_TIMING_ENTRIES:
+            self.hops.append((service, method, endpoint or path, duration))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        entries = [
+            f'{service};desc={quoted_string(f"{method} {path}")};dur={duration * 1000:.1f}'
+            for service, method, path, duration in self.hops
+        ]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+
+def quoted_string(text):
+    """text as an HTTP quoted-string, with anything but printable ASCII replaced by a question mark"""
+    text = _UNSAFE_HEADER_CHARS.sub('?', text)
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# The trace of the request being handled; read by the upstream clients.
+# asyncio tasks started by a request (asyncio.gather, background confirmation)
+# inherit it, so their hops land in the same trace.
+current_trace = ContextVar('current_trace', default=None)
+
+
+def request_id_from(headers):
+    request_id = headers.get(REQUEST_ID_HEADER)
+    if request_id and _VALID_REQUEST_ID.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+def log_request(trace, method, path, status):
+    if REQUEST_LOG:
+        logger.info(
+            f"request_id={trace.request_id} method={method} path={path} status={status} "
+            f"duration_ms={trace.elapsed() * 1000:.1f} hops={len(trace.hops)}"
+        )
+
+
+def init_tracing(app):
+    """Assign request IDs and add X-Request-ID/Server-Timing to every Flask response"""
+    @app.before_request
+    def start_trace():
+        g.trace_token = current_trace.set(RequestTrace(request_id_from(request.headers)))
+
+    @app.after_request
+    def finish_trace(response):
+        trace = current_trace.get()
+        if trace is not None:
+            response.headers[REQUEST_ID_HEADER] = trace.request_id
+            response.headers['Server-Timing'] = trace.server_timing()
+            log_request(trace, request.method, request.path, response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_trace(exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            current_trace.reset(token)
+
+
+def init_async_tracing(app):
+    """Quart counterpart of init_tracing"""
+    from quart import request as quart_request
+
+    @app.before_request
+    async def start_trace():
+        current_trace.set(RequestTrace(request_id_from(quart_request.headers)))
+
+    @app.after_request
+    async def finish_trace(response):
+        trace = current_trace.get()
+        if trace is not None:
+            response.headers[REQUEST_ID_HEADER] = trace.request_id
+            response.headers['Server-Timing'] = trace.server_timing()
+            log_request(trace, quart_request.method, quart_request.path, response.status_code)
+        return response
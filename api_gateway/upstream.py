@@ -0,0 +1,277 @@
+"""
+Pooled, keep-alive HTTP clients for the downstream services.
+
+Each downstream service gets one UpstreamClient that owns a requests.Session
+with its own connection pool, so a gateway worker opens a connection to a
+service once and reuses it for every later hop instead of paying the TCP
+setup cost on each call.
+
+Configuration (environment):
+    UPSTREAM_POOL_SIZE      max pooled connections per service (default 10)
+    UPSTREAM_KEEP_ALIVE     reuse connections between calls (default true)
+    UPSTREAM_TIMEOUT        default timeout in seconds (default 5)
+    <SERVICE>_TIMEOUT       per-service override, e.g. PAYMENT_SERVICE_TIMEOUT
+
+While a gateway request is being handled, every call forwards its
+X-Request-ID and is recorded as a hop for the Server-Timing header (see
+tracing.py).
+
+Calls go through the service's circuit breaker and bulkhead (see
+resilience.py). A rejected call raises UpstreamUnavailable without
+touching the network.
+
+Idempotent GETs go through read(endpoint, path), which adapts the timeout
+to the endpoint's observed latency and can hedge slow reads (see
+hedging.py). Writes use post() with the fixed timeout and are never hedged.
+
+AsyncUpstreamClient is the non-blocking counterpart used by async_app.py.
+It applies the same settings to an httpx.AsyncClient. httpx is only
+imported when an async client is created, so the sync gateway does not need it.
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from hedging import HedgeBudget, ReadPolicy, hedged, hedged_async
+from resilience import UpstreamUnavailable, guard_from_env
+from tracing import REQUEST_ID_HEADER, current_trace
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 10))
+KEEP_ALIVE = env_bool('UPSTREAM_KEEP_ALIVE', True)
+DEFAULT_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 5))
+
+
+def service_timeout(env_prefix, default=DEFAULT_TIMEOUT):
+    return float(os.environ.get(f'{env_prefix}_TIMEOUT', default))
+
+
+class UpstreamClient:
+    """Connection-pooled client for a single downstream service."""
+
+    def __init__(self, name, base_url, timeout=DEFAULT_TIMEOUT, pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.guard = guard_from_env(name)
+        self.hedge_budget = HedgeBudget()
+        self._read_policies = {}
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Sessions are created lazily and rebuilt after a fork so that
+        # pre-forking servers never share sockets between workers.
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._build_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def request(self, method, path, endpoint=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.guard is None:
+            return self._send(method, path, kwargs, endpoint)
+        return self.guard.call(lambda: self._send(method, path, kwargs, endpoint))
+
+    def _send(self, method, path, kwargs, endpoint=None):
+        trace = current_trace.get()
+        if trace is None:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{REQUEST_ID_HEADER: trace.request_id})
+        started = time.perf_counter()
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        finally:
+            trace.record(self.name, method, path, time.perf_counter() - started, endpoint)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def read(self, endpoint, path, **kwargs):
+        """Idempotent GET with an adaptive timeout, hedged when HEDGE_ENABLED (see hedging.py)"""
+        policy = self._read_policy(endpoint)
+        kwargs.setdefault('timeout', policy.timeout())
+        self.hedge_budget.earn()
+
+        def attempt():
+            started = time.perf_counter()
+            try:
+                response = self.get(path, endpoint=endpoint, **kwargs)
+            except UpstreamUnavailable:
+                raise
+            except Exception:
+                policy.observe(time.perf_counter() - started)
+                raise
+            policy.observe(time.perf_counter() - started)
+            return response
+
+        delay = policy.hedge_delay()
+        if delay is None:
+            return attempt()
+        return hedged(policy, self.hedge_budget, attempt, delay)
+
+    def _read_policy(self, endpoint):
+        policy = self._read_policies.get(endpoint)
+        if policy is None:
+            policy = self._read_policies.setdefault(endpoint, ReadPolicy(self.name, endpoint, self.timeout))
+        return policy
+
+    def stats(self):
+        requests_sent = 0
+        connections_opened = 0
+        if self._session is not None and self._pid == os.getpid():
+            pools = self._session.get_adapter(self.base_url).poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+
+        stats = {
+            "service": self.name,
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "keep_alive": self.keep_alive,
+            "timeout": self.timeout,
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "connections_reused": max(requests_sent - connections_opened, 0)
+        }
+        if self.guard is not None:
+            stats.update(self.guard.stats())
+        if self._read_policies:
+            stats['reads'] = [policy.stats() for policy in list(self._read_policies.values())]
+            stats['hedging'] = self.hedge_budget.stats()
+        return stats
+
+
+class AsyncUpstreamClient:
+    """Non-blocking, connection-pooled client for a single downstream service."""
+
+    def __init__(self, name, base_url, timeout=DEFAULT_TIMEOUT, pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.requests_sent = 0
+        self.guard = guard_from_env(name)
+        self.hedge_budget = HedgeBudget()
+        self._read_policies = {}
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            limits = httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size if self.keep_alive else 0
+            )
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits)
+        return self._client
+
+    async def request(self, method, path, endpoint=None, **kwargs):
+        if self.guard is None:
+            return await self._send(method, path, kwargs, endpoint)
+        return await self.guard.call_async(lambda: self._send(method, path, kwargs, endpoint))
+
+    async def _send(self, method, path, kwargs, endpoint=None):
+        self.requests_sent += 1
+        trace = current_trace.get()
+        if trace is None:
+            return await self.client.request(method, path, **kwargs)
+
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{REQUEST_ID_HEADER: trace.request_id})
+        started = time.perf_counter()
+        try:
+            return await self.client.request(method, path, **kwargs)
+        finally:
+            trace.record(self.name, method, path, time.perf_counter() - started, endpoint)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def read(self, endpoint, path, **kwargs):
+        """Idempotent GET with an adaptive timeout, hedged when HEDGE_ENABLED (see hedging.py)"""
+        policy = self._read_policy(endpoint)
+        kwargs.setdefault('timeout', policy.timeout())
+        self.hedge_budget.earn()
+
+        async def attempt():
+            started = time.perf_counter()
+            try:
+                response = await self.get(path, endpoint=endpoint, **kwargs)
+            except UpstreamUnavailable:
+                raise
+            except Exception:
+                policy.observe(time.perf_counter() - started)
+                raise
+            policy.observe(time.perf_counter() - started)
+            return response
+
+        delay = policy.hedge_delay()
+        if delay is None:
+            return await attempt()
+        return await hedged_async(policy, self.hedge_budget, attempt, delay)
+
+    def _read_policy(self, endpoint):
+        policy = self._read_policies.get(endpoint)
+        if policy is None:
+            policy = self._read_policies.setdefault(endpoint, ReadPolicy(self.name, endpoint, self.timeout))
+        return policy
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        stats = {
+            "service": self.name,
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "keep_alive": self.keep_alive,
+            "timeout": self.timeout,
+            "requests": self.requests_sent
+        }
+        if self.guard is not None:
+            stats.update(self.guard.stats())
+        if self._read_policies:
+            stats['reads'] = [policy.stats() for policy in list(self._read_policies.values())]
+            stats['hedging'] = self.hedge_budget.stats()
+        return stats
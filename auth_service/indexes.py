@@ -0,0 +1,46 @@
+"""
+Declarative index specification for auth_service.
+
+The indexes are applied idempotently when the service starts (set
+MONGO_ENSURE_INDEXES=false to skip) and can be checked from the command line:
+
+    python indexes.py check      # list missing indexes, exit 1 if any
+    python indexes.py apply      # create missing indexes
+    python indexes.py explain    # explain() every hot query, exit 1 if any scans the collection
+"""
+import os
+import sys
+
+from pymongo import ASCENDING
+
+import mongo_indexes
+
+INDEXES = {
+    "users": [
+        {"keys": [("username", ASCENDING)], "name": "username_unique", "unique": True},
+        {"keys": [("email", ASCENDING)], "name": "email_unique", "unique": True}
+    ]
+}
+
+# (collection, description, filter, sort) for the queries on the request path
+HOT_QUERIES = [
+    ("users", "login by username", {"username": "klea"}, None),
+    ("users", "register duplicate check", {"$or": [{"username": "klea"}, {"email": "klea@example.com"}]}, None)
+]
+
+
+def ensure_indexes(db):
+    """Create every index in INDEXES; indexes that already exist are left alone"""
+    mongo_indexes.ensure_indexes(db, INDEXES)
+
+
+def explain_hot_queries(db):
+    """Return (collection, description, stages, uses_index) for every hot query"""
+    return mongo_indexes.explain_queries(db, HOT_QUERIES)
+
+
+if __name__ == '__main__':
+    os.environ['MONGO_ENSURE_INDEXES'] = 'false'
+    from app import db
+
+    sys.exit(mongo_indexes.main(db, sys.argv[1] if len(sys.argv) > 1 else 'check', INDEXES, HOT_QUERIES, __doc__))
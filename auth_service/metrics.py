@@ -0,0 +1,89 @@
+"""
+In-process metrics, served in the Prometheus text format at GET /metrics:
+
+    http_requests_total{method, route, status}
+    http_request_duration_seconds{method, route}            histogram
+    mongo_command_duration_seconds{command, collection}     histogram
+    mongo_command_failures_total{command, collection}
+    password_hash_duration_seconds{scheme}                  histogram
+
+Mongo timings come from a pymongo CommandListener, using the durations the
+driver already measures. Recording is a dict lookup and a few additions
+under a lock, cheap enough to leave on under full load (see
+benchmarks/metrics_overhead.py). With several gunicorn workers,
+/metrics merges the numbers of all of them (see metrics_registry.py).
+
+Configuration (environment):
+    METRICS_ENABLED   false turns off recording and the /metrics route (default true)
+"""
+import os
+import time
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+from metrics_registry import Registry
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+registry = Registry()
+http_requests = registry.counter('http_requests_total', "Requests handled", ('method', 'route', 'status'))
+http_duration = registry.histogram('http_request_duration_seconds', "Request handling time", ('method', 'route'))
+
+
+mongo_duration = registry.histogram('mongo_command_duration_seconds', "MongoDB command time", ('command', 'collection'))
+mongo_failures = registry.counter('mongo_command_failures_total', "Failed MongoDB commands", ('command', 'collection'))
+password_hash_duration = registry.histogram('password_hash_duration_seconds', "Password key derivation time, including the wait for a hashing process", ('scheme',))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command the service's MongoClient sends."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        # Succeeded/failed events carry no command document, so remember the collection here
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get('collection', '')
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        mongo_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        mongo_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+        mongo_failures.inc(event.command_name, collection)
+
+
+def mongo_listeners():
+    """event_listeners for the service's MongoClient"""
+    return [MongoCommandMetrics()] if METRICS_ENABLED else []
+
+
+def init_metrics(app):
+    """Time every request and serve GET /metrics"""
+    if not METRICS_ENABLED:
+        return
+
+    registry.start_flusher()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            http_duration.observe(time.perf_counter() - started, request.method, route)
+            http_requests.inc(request.method, route, response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
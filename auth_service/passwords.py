@@ -0,0 +1,161 @@
+"""
+Password hashing for auth_service.
+
+A user's "password" field holds one of:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>            hashlib.scrypt (default for new passwords)
+    pbkdf2_sha256$<iterations>$<salt>$<hash>    hashlib.pbkdf2_hmac with SHA-256
+    <64 hex digits>                             legacy: unsalted SHA-256
+
+salt and hash are unpadded base64. New passwords are hashed with
+PASSWORD_SCHEME. When a login succeeds against a hash in another scheme, or
+with other cost parameters than configured, the password is hashed again
+and stored (rehash on login), so legacy hashes go away as users log in.
+
+A login for an unknown username is verified against dummy_hash, a hash in
+the configured scheme and parameters that matches no password, so it takes
+as long as a login with a wrong password and does not reveal which
+usernames exist.
+
+Key derivation is slow on purpose and CPU-bound. It runs in a pool of
+PASSWORD_HASH_WORKERS processes, so concurrent logins use every core instead
+of queuing on one process's GIL; the request thread only waits for the
+result. The pool is started on first use in each gunicorn worker, so the
+processes add up across workers: keep WORKERS x PASSWORD_HASH_WORKERS close
+to the number of cores. With WORKER_CLASS=gevent, set PASSWORD_HASH_WORKERS=0
+(hash in the request thread) because the pool's threads do not mix with
+gevent's monkey-patching.
+
+Configuration (environment):
+    PASSWORD_SCHEME         scrypt | pbkdf2_sha256 | sha256 (default scrypt; sha256 only for comparison)
+    SCRYPT_N                scrypt CPU/memory cost, a power of two (default 16384, 16 MiB per hash)
+    SCRYPT_R                scrypt block size (default 8)
+    SCRYPT_P                scrypt parallelism (default 1)
+    PBKDF2_ITERATIONS       PBKDF2 iterations (default 600000)
+    PASSWORD_HASH_WORKERS   hashing processes per worker, 0 to hash in the request thread (default CPU count)
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import METRICS_ENABLED, password_hash_duration
+
+SCHEMES = ('scrypt', 'pbkdf2_sha256', 'sha256')
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def derive(scheme, password, salt, params):
+    """Raw key for password; runs in the pool's processes, so it must stay a plain module function"""
+    if scheme == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=max(32 * 1024 * 1024, 256 * n * r), dklen=KEY_BYTES)
+    if scheme == 'pbkdf2_sha256':
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=KEY_BYTES)
+    return hashlib.sha256(password.encode()).digest()
+
+
+def encode(scheme, params, salt, key):
+    if scheme == 'sha256':
+        return key.hex()
+    return '$'.join([scheme, *(str(value) for value in params), _b64encode(salt), _b64encode(key)])
+
+
+def decode(encoded):
+    """(scheme, params, salt, key) of a stored hash"""
+    parts = encoded.split('$')
+    if len(parts) == 1 and len(encoded) == 64:
+        return 'sha256', (), b'', bytes.fromhex(encoded)
+    if parts[0] == 'scrypt' and len(parts) == 6:
+        return 'scrypt', tuple(int(value) for value in parts[1:4]), _b64decode(parts[4]), _b64decode(parts[5])
+    if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        return 'pbkdf2_sha256', (int(parts[1]),), _b64decode(parts[2]), _b64decode(parts[3])
+    raise ValueError("Unrecognised password hash format")
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords, deriving keys in a process pool."""
+
+    def __init__(self, scheme='scrypt', scrypt_params=(16384, 8, 1), pbkdf2_iterations=600000, workers=None):
+        if scheme not in SCHEMES:
+            raise ValueError(f"PASSWORD_SCHEME must be one of {SCHEMES}, got {scheme!r}")
+        self.scheme = scheme
+        self.params = {'scrypt': tuple(scrypt_params), 'pbkdf2_sha256': (pbkdf2_iterations,), 'sha256': ()}[scheme]
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        # Same cost as a real hash; an all-zero key is never derived from a password in practice
+        self.dummy_hash = encode(scheme, self.params, bytes(SALT_BYTES) if scheme != 'sha256' else b'', bytes(KEY_BYTES))
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # One pool per worker process, started after gunicorn's fork. Children are
+        # spawned rather than forked, so they never inherit the request threads' locks.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _derive(self, scheme, password, salt, params):
+        started = time.perf_counter()
+        if self.workers and scheme != 'sha256':
+            try:
+                key = self._pool().submit(derive, scheme, password, salt, params).result()
+            except BrokenProcessPool:
+                # A hashing process died; shut the broken pool down and start a fresh one for the next call
+                with self._lock:
+                    if self._executor is not None and self._executor_pid == os.getpid():
+                        self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+                raise
+        else:
+            key = derive(scheme, password, salt, params)
+        if METRICS_ENABLED:
+            password_hash_duration.observe(time.perf_counter() - started, scheme)
+        return key
+
+    def hash(self, password):
+        salt = os.urandom(SALT_BYTES) if self.scheme != 'sha256' else b''
+        return encode(self.scheme, self.params, salt, self._derive(self.scheme, password, salt, self.params))
+
+    def verify(self, password, encoded):
+        """(matches, needs_rehash): needs_rehash when the hash is not in the configured scheme and parameters"""
+        scheme, params, salt, key = decode(encoded)
+        matches = hmac.compare_digest(self._derive(scheme, password, salt, params), key)
+        return matches, matches and (scheme != self.scheme or params != self.params)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+
+def password_hasher_from_env():
+    workers = os.environ.get('PASSWORD_HASH_WORKERS')
+    return PasswordHasher(
+        scheme=os.environ.get('PASSWORD_SCHEME', 'scrypt'),
+        scrypt_params=(
+            int(os.environ.get('SCRYPT_N', 16384)),
+            int(os.environ.get('SCRYPT_R', 8)),
+            int(os.environ.get('SCRYPT_P', 1))
+        ),
+        pbkdf2_iterations=int(os.environ.get('PBKDF2_ITERATIONS', 600000)),
+        workers=int(workers) if workers else None
+    )
@@ -0,0 +1,108 @@
+"""
+Reserve throughput on a single product as a function of its stock shard
+count (inventory_service/stock_shards.py).
+
+For each shard count, a fresh product is created (and split, for counts
+above 1). Then --threads threads reserve one unit at a time through
+POST /products/<id>/reserve for --seconds, and the reservations are
+confirmed in batches, as the gateway does. The benchmark products and
+their reservations are deleted afterwards.
+
+The contention that sharding removes is inside mongod (concurrent updates
+of one document), so only a real MongoDB gives meaningful numbers. With
+--memory this only checks that the code paths run.
+
+    MONGO_URI=mongodb://localhost:27017/bench python benchmarks/hot_sku.py --shards 1,4,16 --threads 32
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from bson import ObjectId
+
+import service_endpoints
+
+
+def run(module, shard_count, threads, seconds):
+    client = module.app.test_client()
+    product_id = client.post('/products', json={"name": "hot sku benchmark", "price": 1.0, "stock_quantity": 10 ** 9}).get_json()['product_id']
+    if shard_count > 1:
+        client.post(f'/products/{product_id}/shards', json={"shards": shard_count})
+
+    latencies = []
+    reservation_ids = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        worker_client = module.app.test_client()
+        own_latencies = []
+        own_ids = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = worker_client.post(f'/products/{product_id}/reserve', json={"quantity": 1, "customer_id": "bench"})
+            own_latencies.append(time.perf_counter() - started)
+            if response.status_code == 200:
+                own_ids.append(response.get_json()['reservation_id'])
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(own_latencies)
+            reservation_ids.extend(own_ids)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    for index in range(0, len(reservation_ids), 500):
+        client.post('/reservations/confirm_batch', json={"reservation_ids": reservation_ids[index:index + 500]})
+    totals = client.get(f'/products/{product_id}').get_json()
+
+    module.products_collection.delete_one({"_id": ObjectId(product_id)})
+    module.stock_shards_collection.delete_many({"product_id": ObjectId(product_id)})
+    module.reservations_collection.delete_many({"product_id": ObjectId(product_id)})
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "shards": shard_count,
+        "threads": threads,
+        "reservations": len(reservation_ids),
+        "errors": sum(errors),
+        "rps": round(count / elapsed, 1),
+        "p50_ms": round(latencies[int(count * 0.50)] * 1000, 3),
+        "p99_ms": round(latencies[min(count - 1, int(count * 0.99))] * 1000, 3),
+        # Every confirmed unit must have left the stock exactly once
+        "consistent": totals['stock_quantity'] == 10 ** 9 - len(reservation_ids) and totals['reserved_quantity'] == 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', default='1,4,16', help="comma-separated shard counts; 1 means unsharded")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--memory', action='store_true', help="use the in-memory Mongo stand-in instead of MONGO_URI")
+    args = parser.parse_args()
+
+    module = service_endpoints.load_service('inventory_service', args.memory)
+    results = []
+    for shard_count in (int(value) for value in args.shards.split(',')):
+        result = run(module, shard_count, args.threads, args.seconds)
+        results.append(result)
+        print(f"shards {shard_count:>3}  {result['rps']:>9} req/s  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms"
+              f"  consistent={result['consistent']}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Response encoding throughput on a 10k-order payload.
+
+Compares the previous path (convert every `_id` to str, then Flask's default
+JSON provider) with the shared encoder in common/encoding.py, with orjson
+and with its standard-library fallback. Needs no database.
+
+    python benchmarks/json_encoding.py --orders 10000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import encoding  # noqa: E402
+
+
+def make_orders(count):
+    created_at = datetime(2024, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "customer_id": str(ObjectId()),
+            "products": [
+                {"product_id": str(ObjectId()), "quantity": 1 + i % 3, "price": 19.99},
+                {"product_id": str(ObjectId()), "quantity": 1, "price": 5.5}
+            ],
+            "total_amount": 45.48,
+            "currency": "USD",
+            "status": "confirmed",
+            "payment_id": str(ObjectId()),
+            "reservation_ids": [str(ObjectId()), str(ObjectId())],
+            "shipping_address": "123 Main St, City, State 12345",
+            "billing_address": "123 Main St, City, State 12345",
+            "order_notes": "",
+            "created_at": created_at + timedelta(seconds=i),
+            "updated_at": created_at + timedelta(seconds=i)
+        }
+        for i in range(count)
+    ]
+
+
+def flask_default(provider):
+    def encode(orders):
+        orders = [dict(order) for order in orders]
+        for order in orders:
+            order['_id'] = str(order['_id'])
+        return provider.dumps({"orders": orders}).encode()
+    return encode
+
+
+def fast(orjson_module):
+    def encode(orders):
+        encoding.orjson = orjson_module
+        return encoding.dumps_bytes({"orders": orders})
+    return encode
+
+
+def measure(name, encode, orders, repeat):
+    encode(orders)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(orders)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    return {
+        "encoder": name,
+        "orders": len(orders),
+        "best_ms": round(best * 1000, 2),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 2),
+        "orders_per_sec": round(len(orders) / best),
+        "mb_per_sec": round(len(body) / best / 1e6, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    orders = make_orders(args.orders)
+    encoders = [("flask_default", flask_default(DefaultJSONProvider(Flask(__name__))))]
+    if encoding.orjson is not None:
+        encoders.append(("encoding_orjson", fast(encoding.orjson)))
+    encoders.append(("encoding_stdlib", fast(None)))
+
+    print(json.dumps([measure(name, encode, orders, args.repeat) for name, encode in encoders], indent=2))
+
+
+if __name__ == '__main__':
+    main()
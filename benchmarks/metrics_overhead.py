@@ -0,0 +1,141 @@
+"""
+Cost of the /metrics instrumentation (<service>/metrics.py).
+
+1. Per operation: Histogram.observe, Counter.inc, and one MongoDB command
+   going through the CommandListener (started + succeeded).
+2. Per request, isolated: a no-op Flask route with and without the request
+   hooks, which is everything the instrumentation adds to a request.
+3. Per request, end to end: each hot endpoint from service_endpoints.py,
+   served with METRICS_ENABLED=false and =true in alternating rounds; the
+   overhead is the difference between the best median latencies. On a busy
+   machine this is dominated by run-to-run noise.
+
+mongomock does not emit command events, so with --memory the per-request
+numbers leave out the Mongo listener; part 1 covers it.
+
+    python benchmarks/metrics_overhead.py --memory --requests 2000 --rounds 3
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+
+import service_endpoints
+from worker_models import JWT_SECRET, ROOT, start_stub
+
+
+def per_operation(iterations):
+    sys.path.insert(0, os.path.join(ROOT, 'order_service'))
+    try:
+        sys.modules.pop('metrics', None)
+        import metrics
+        from pymongo import monitoring
+    finally:
+        sys.path.pop(0)
+
+    histogram = metrics.Registry().histogram('bench_seconds', "benchmark", ('route',))
+    counter = metrics.Registry().counter('bench_total', "benchmark", ('route', 'status'))
+    listener = metrics.MongoCommandMetrics()
+    started_event = monitoring.CommandStartedEvent({"insert": "orders", "documents": []}, "db", 1, ("localhost", 27017), 1)
+    succeeded_event = monitoring.CommandSucceededEvent(timedelta(microseconds=800), {"ok": 1}, "insert", 1, ("localhost", 27017), 1)
+
+    def observe():
+        histogram.observe(0.0042, '/orders')
+
+    def inc():
+        counter.inc('/orders', 201)
+
+    def mongo_command():
+        listener.started(started_event)
+        listener.succeeded(succeeded_event)
+
+    results = {}
+    for name, operation in (("histogram_observe", observe), ("counter_inc", inc), ("mongo_listener_command", mongo_command)):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        results[f"{name}_ns"] = round((time.perf_counter() - started) / iterations * 1e9)
+    return results
+
+
+def noop_route(count, rounds):
+    from flask import Flask
+
+    sys.path.insert(0, os.path.join(ROOT, 'order_service'))
+    try:
+        sys.modules.pop('metrics', None)
+        import metrics
+    finally:
+        sys.path.pop(0)
+
+    timings = {}
+    for _ in range(rounds):
+        for enabled in (False, True):
+            app = Flask(__name__)
+            app.add_url_rule('/noop', 'noop', lambda: ('', 204))
+            if enabled:
+                metrics.init_metrics(app)
+            client = app.test_client()
+            client.get('/noop')
+            started = time.perf_counter()
+            for _ in range(count):
+                client.get('/noop')
+            timings.setdefault(enabled, []).append((time.perf_counter() - started) / count)
+
+    off, on = min(timings[False]), min(timings[True])
+    return {"us_disabled": round(off * 1e6, 1), "us_enabled": round(on * 1e6, 1), "overhead_us": round((on - off) * 1e6, 1)}
+
+
+def per_request(services, count, rounds, memory):
+    medians = {}
+    for _ in range(rounds):
+        for enabled in ('false', 'true'):
+            os.environ['METRICS_ENABLED'] = enabled
+            for service in services:
+                module = service_endpoints.load_service(service, memory)
+                method, path, body = service_endpoints.CASES[service](module)
+                client = module.app.test_client()
+                service_endpoints.measure(client, method, path, body, max(1, count // 10))
+                result = service_endpoints.measure(client, method, path, body, count)
+                medians.setdefault((service, enabled), []).append(result['p50_ms'])
+
+    results = []
+    for service in services:
+        off = min(medians[(service, 'false')])
+        on = min(medians[(service, 'true')])
+        results.append({
+            "service": service,
+            "p50_ms_disabled": off,
+            "p50_ms_enabled": on,
+            "overhead_us": round((on - off) * 1000, 1),
+            "overhead_pct": round((on - off) / off * 100, 1)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', default=','.join(service_endpoints.SERVICES))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--memory', action='store_true', help="use the in-memory Mongo stand-in instead of MONGO_URI")
+    args = parser.parse_args()
+
+    stub = start_stub(0)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    for name in ('AUTH', 'CUSTOMER', 'INVENTORY', 'PAYMENT', 'ORDER'):
+        os.environ[f"{name}_SERVICE_URL"] = stub_url
+    os.environ.update(JWT_SECRET=JWT_SECRET, AUTH_VERIFY_MODE='local')
+
+    print(json.dumps({
+        "per_operation": per_operation(args.iterations),
+        "noop_route": noop_route(args.requests * 5, args.rounds),
+        "per_request": per_request(args.services.split(','), args.requests, args.rounds, args.memory)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Logins/sec of auth_service for each password scheme and hashing pool size.
+
+For every --schemes entry and --pools size it loads auth_service with
+PASSWORD_SCHEME and PASSWORD_HASH_WORKERS set accordingly, registers --users
+users and has --clients threads POST /login for --seconds through the Flask
+test client, as gthread request threads would. Pool size 0 hashes in the
+request thread; sha256 never uses the pool, so it runs once.
+
+Reported per run: logins/sec, p50/p99 login latency and the status counts.
+Key derivation holds a core for its whole duration, so logins/sec can only
+grow with the pool up to the number of cores.
+
+    python benchmarks/password_hashing.py --memory
+    python benchmarks/password_hashing.py --memory --schemes scrypt --pools 0,1,2,4,8 --clients 32
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import service_endpoints
+from worker_models import ROOT
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1) if values else None
+
+
+def run(scheme, pool, args):
+    os.environ.update({
+        'PASSWORD_SCHEME': scheme,
+        'PASSWORD_HASH_WORKERS': str(pool),
+        'REQUEST_LOG': 'false'
+    })
+    module = service_endpoints.load_service('auth_service', args.memory)
+    test_client = module.app.test_client()
+    users = [f"bench-{scheme}-{pool}-{i}" for i in range(args.users)]
+    for username in users:
+        test_client.post('/register', json={"username": username, "password": "bench-password", "email": f"{username}@example.com"})
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client(offset):
+        own_client = module.app.test_client()
+        own = []
+        own_statuses = {}
+        i = offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = own_client.post('/login', json={"username": users[i % len(users)], "password": "bench-password"})
+            own.append(time.perf_counter() - started)
+            own_statuses[response.status_code] = own_statuses.get(response.status_code, 0) + 1
+            i += 1
+        with lock:
+            latencies.extend(own)
+            for status, count in own_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    module.users_collection.delete_many({"username": {"$in": users}})
+    module.password_hasher.close()
+    return {
+        "scheme": scheme,
+        "pool": pool,
+        "logins_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schemes', default='sha256,pbkdf2_sha256,scrypt')
+    parser.add_argument('--pools', default=f"0,1,{os.cpu_count() or 1}", help="PASSWORD_HASH_WORKERS values")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent login threads")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--memory', action='store_true', help="use the in-memory Mongo stand-in instead of MONGO_URI")
+    args = parser.parse_args()
+
+    # Hashing processes are spawned and import passwords.py by name
+    sys.path.insert(0, os.path.join(ROOT, 'auth_service'))
+
+    pools = sorted({int(pool) for pool in args.pools.split(',')})
+    results = []
+    for scheme in args.schemes.split(','):
+        for pool in pools if scheme != 'sha256' else [0]:
+            result = run(scheme, pool, args)
+            results.append(result)
+            print(f"{scheme:>13}  pool {pool:>2}  {result['logins_per_second']:>8} logins/s  p50 {result['p50_ms']} ms"
+                  f"  p99 {result['p99_ms']} ms  statuses {result['statuses']}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+payment_service under a slow or rate-limited card provider.
+
+Starts payment_service/fake_provider.py with the given latency distribution,
+rate limit and error rate. Then, for each --modes entry, it loads
+payment_service with PAYMENT_PROVIDER=http pointed at the fake and has
+--clients threads post /payments/process for --seconds. Each client thread
+pays one payment at a time and, in async mode, long-polls /payments/<id>/wait
+for the outcome as the gateway does.
+
+Reported per mode: finished payments/sec, p50/p99 time until the outcome is
+known, p50/p99 of the POST alone (the time a request thread is held by the
+charge), the final status counts (200 completed, 400 declined or failed,
+503 provider busy or queue full) and the provider's answers, including how
+many 429s it sent.
+
+    python benchmarks/payment_provider.py --memory --latency lognormal:150,0.5 --provider-rate-limit 40
+    python benchmarks/payment_provider.py --memory --provider-rate-limit 40 --rate-limit 40   # limiter on our side
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import service_endpoints
+from worker_models import ROOT
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_provider(args):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'payment_service', 'fake_provider.py'),
+        '--port', str(port),
+        '--latency', args.latency,
+        '--rate-limit', str(args.provider_rate_limit),
+        '--max-concurrent', str(args.provider_max_concurrent),
+        '--error-rate', str(args.error_rate)
+    ], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/stats", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("fake provider did not start")
+
+
+def provider_counts(url):
+    return json.loads(urllib.request.urlopen(f"{url}/stats", timeout=1).read())
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1) if values else None
+
+
+def run(mode, provider_url, args):
+    os.environ.update({
+        'PAYMENT_MODE': mode,
+        'PAYMENT_PROVIDER': 'http',
+        'PROVIDER_URL': provider_url,
+        'PROVIDER_POOL_SIZE': str(max(args.clients, args.workers)),
+        'PROVIDER_RATE_LIMIT': str(args.rate_limit),
+        'PROVIDER_RATE_BURST': str(args.rate_burst),
+        'PROVIDER_MAX_CONCURRENT': str(args.max_concurrent),
+        'PAYMENT_WORKERS': str(args.workers),
+        'PAYMENT_QUEUE_SIZE': str(args.queue_size),
+        'REQUEST_LOG': 'false'
+    })
+    module = service_endpoints.load_service('payment_service', args.memory)
+    counts_before = provider_counts(provider_url)
+
+    latencies = []
+    post_latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client():
+        test_client = module.app.test_client()
+        own = []
+        own_posts = []
+        own_statuses = {}
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = test_client.post('/payments/process', json={"customer_id": "bench", "amount": 10.0, "payment_method": "card"})
+            own_posts.append(time.perf_counter() - started)
+            while response.status_code == 202:
+                # Wait for the outcome the way the gateway does
+                response = test_client.get(f"/payments/{response.get_json()['payment_id']}/wait", query_string={"timeout": 1})
+            own.append(time.perf_counter() - started)
+            own_statuses[response.status_code] = own_statuses.get(response.status_code, 0) + 1
+        with lock:
+            latencies.extend(own)
+            post_latencies.extend(own_posts)
+            for status, count in own_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "mode": mode,
+        "payments_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "post_p50_ms": percentile(post_latencies, 0.50),
+        "post_p99_ms": percentile(post_latencies, 0.99),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+    counts_after = provider_counts(provider_url)
+    result['provider'] = {status: count - counts_before.get(status, 0) for status, count in counts_after.items()}
+    module.payments_collection.delete_many({"customer_id": "bench"})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--clients', type=int, default=16, help="concurrent callers, each paying one payment at a time")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--latency', default='lognormal:150,0.5', help="fake provider latency, see fake_provider.py")
+    parser.add_argument('--provider-rate-limit', type=float, default=0, help="fake provider: charges/sec before it answers 429")
+    parser.add_argument('--provider-max-concurrent', type=int, default=0, help="fake provider: charges at once before 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fake provider: share of 500s")
+    parser.add_argument('--rate-limit', type=float, default=0, help="PROVIDER_RATE_LIMIT of payment_service")
+    parser.add_argument('--rate-burst', type=float, default=0, help="PROVIDER_RATE_BURST of payment_service (0: the rate)")
+    parser.add_argument('--max-concurrent', type=int, default=0, help="PROVIDER_MAX_CONCURRENT of payment_service")
+    parser.add_argument('--workers', type=int, default=8, help="PAYMENT_WORKERS (async mode)")
+    parser.add_argument('--queue-size', type=int, default=100, help="PAYMENT_QUEUE_SIZE (async mode)")
+    parser.add_argument('--memory', action='store_true', help="use the in-memory Mongo stand-in instead of MONGO_URI")
+    args = parser.parse_args()
+
+    process, provider_url = start_fake_provider(args)
+    try:
+        results = []
+        for mode in args.modes.split(','):
+            result = run(mode, provider_url, args)
+            results.append(result)
+            print(f"{mode:>5}  {result['payments_per_second']:>6} payments/s  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms"
+                  f"  (POST p50 {result['post_p50_ms']} ms)  statuses {result['statuses']}  provider {result['provider']}", file=sys.stderr)
+        print(json.dumps(results, indent=2))
+    finally:
+        process.kill()
+
+
+if __name__ == '__main__':
+    main()
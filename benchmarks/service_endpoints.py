@@ -0,0 +1,213 @@
+"""
+Requests/sec and p50/p99 latency of each service's hot endpoint, measured
+in-process through the Flask test client:
+
+    auth_service       POST /verify
+    customer_service   GET  /customers/<id>/validate
+    inventory_service  POST /products/<id>/reserve
+    payment_service    POST /payments/process
+    order_service      POST /orders
+    api_gateway        POST /api/create_order (downstream services stubbed)
+
+The services use the MongoDB in MONGO_URI, or with --memory an in-memory
+stand-in (mongomock, `pip install mongomock`). They write to their own
+databases, so point MONGO_URI at a local throwaway mongod, never a shared one.
+The gateway's downstreams are the zero-latency stubs from worker_models.py.
+
+Results are written as JSON together with the git commit, so runs can be
+compared between commits:
+
+    python benchmarks/service_endpoints.py --memory --requests 2000 --output before.json
+    python benchmarks/service_endpoints.py --memory --requests 2000 --compare before.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from unittest import mock
+
+import jwt
+
+from worker_models import JWT_SECRET, ROOT, start_stub
+
+SERVICES = ('auth_service', 'customer_service', 'inventory_service', 'payment_service', 'order_service', 'api_gateway')
+
+
+def load_service(service, memory):
+    """
+    Import <service>/app.py. The services share module names (app, encoding,
+    indexes, ...), so the previous service's modules are dropped first.
+    """
+    service_dir = os.path.join(ROOT, service)
+    local_modules = {name[:-3] for name in os.listdir(service_dir) if name.endswith('.py')}
+    for name in local_modules:
+        sys.modules.pop(name, None)
+
+    sys.path.insert(0, service_dir)
+    try:
+        if memory:
+            import mongomock
+            with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+                return importlib.import_module('app')
+        return importlib.import_module('app')
+    finally:
+        sys.path.remove(service_dir)
+
+
+def verify_case(module):
+    token = jwt.encode(
+        {"user_id": "bench-user", "username": "bench", "exp": datetime.utcnow().timestamp() + 3600},
+        module.JWT_SECRET, algorithm='HS256'
+    )
+    return 'POST', '/verify', {"token": token}
+
+
+def validate_case(module):
+    customer_id = module.customers_collection.insert_one({
+        "name": "Bench Customer", "email": f"bench-{time.time_ns()}@example.com", "created_at": datetime.utcnow()
+    }).inserted_id
+    return 'GET', f"/customers/{customer_id}/validate", None
+
+
+def reserve_case(module):
+    product_id = module.products_collection.insert_one({
+        "name": "Bench Product", "price": 9.99, "available_quantity": 10 ** 9, "reserved_quantity": 0,
+        "created_at": datetime.utcnow()
+    }).inserted_id
+    return 'POST', f"/products/{product_id}/reserve", {"quantity": 1, "customer_id": "bench-customer"}
+
+
+def payment_case(module):
+    return 'POST', '/payments/process', {"customer_id": "bench-customer", "amount": 29.97, "payment_method": "credit_card"}
+
+
+def order_case(module):
+    return 'POST', '/orders', {
+        "customer_id": "bench-customer",
+        "products": [{"product_id": "a", "quantity": 1, "price": 9.99}, {"product_id": "b", "quantity": 2, "price": 9.99}],
+        "total_amount": 29.97,
+        "status": "confirmed"
+    }
+
+
+def create_order_case(module):
+    token = jwt.encode(
+        {"user_id": "bench-user", "username": "bench", "exp": datetime.utcnow().timestamp() + 3600},
+        JWT_SECRET, algorithm='HS256'
+    )
+    return 'POST', '/api/create_order', {
+        "token": token,
+        "customer_id": "bench-customer",
+        "products": [{"product_id": "a", "quantity": 1}, {"product_id": "b", "quantity": 2}],
+        "payment_method": "credit_card"
+    }
+
+
+CASES = {
+    'auth_service': verify_case,
+    'customer_service': validate_case,
+    'inventory_service': reserve_case,
+    'payment_service': payment_case,
+    'order_service': order_case,
+    'api_gateway': create_order_case
+}
+
+
+def measure(client, method, path, body, count):
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1),
+        "p50_ms": round(latencies[int(count * 0.50)] * 1000, 3),
+        "p99_ms": round(latencies[min(count - 1, int(count * 0.99))] * 1000, 3)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Print the change in throughput and p99 against an earlier result file"""
+    before = {(result['service'], result['endpoint']): result for result in previous['results']}
+    print(f"compared with {previous.get('commit')} ({previous.get('mongo')})", file=sys.stderr)
+    for result in current['results']:
+        old = before.get((result['service'], result['endpoint']))
+        if old is None:
+            continue
+        rps_change = (result['rps'] - old['rps']) / old['rps'] * 100
+        p99_change = (result['p99_ms'] - old['p99_ms']) / old['p99_ms'] * 100
+        print(
+            f"  {result['endpoint']:<40} rps {old['rps']:>9} -> {result['rps']:>9} ({rps_change:+.1f}%)"
+            f"  p99 {old['p99_ms']:>8} -> {result['p99_ms']:>8} ms ({p99_change:+.1f}%)",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', default=','.join(SERVICES))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--memory', action='store_true', help="use the in-memory Mongo stand-in instead of MONGO_URI")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    stub = start_stub(0)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    for name in ('AUTH', 'CUSTOMER', 'INVENTORY', 'PAYMENT', 'ORDER'):
+        os.environ[f"{name}_SERVICE_URL"] = stub_url
+    os.environ.update(JWT_SECRET=JWT_SECRET, AUTH_VERIFY_MODE='local')
+
+    results = []
+    for service in args.services.split(','):
+        module = load_service(service, args.memory)
+        method, path, body = CASES[service](module)
+        client = module.app.test_client()
+        measure(client, method, path, body, max(1, args.requests // 10))
+        result = measure(client, method, path, body, args.requests)
+        rule, _ = module.app.url_map.bind('').match(path, method=method, return_rule=True)
+        endpoint = f"{method} {rule.rule}"
+        results.append(dict(result, service=service, endpoint=endpoint))
+        print(f"{endpoint:<40} {result['rps']:>9} req/s  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "mongo": "mongomock" if args.memory else "mongodb",
+        "created_at": datetime.utcnow().isoformat(),
+        "results": results
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Throughput and latency of a service under each gunicorn worker model.
+
+Serves the service with its gunicorn.conf.py once per WORKER_CLASS and drives
+it with --concurrency keep-alive clients for --duration seconds.
+
+For api_gateway the script starts a stub for every downstream service (each
+call sleeps --latency seconds, standing in for a service doing one Mongo round
+trip) and posts /api/create_order. Other services need a reachable database
+(MONGO_URI in the environment) and a --path to GET, e.g.
+
+    python benchmarks/worker_models.py --workers 2 --concurrency 32 --latency 0.02
+    MONGO_URI=... python benchmarks/worker_models.py --service inventory_service --path /products
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+JWT_SECRET = 'benchmark-secret'
+
+
+class DownstreamStub(BaseHTTPRequestHandler):
+    """Answers every call the gateway makes while creating an order"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits on the client's delayed ACK and every call gains ~40 ms
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.latency)
+
+        path = self.path.split('?')[0]
+        if path == '/reservations/batch':
+            status, payload = 200, {"reserved": True, "reservations": [
+                {"product_id": item['product_id'], "quantity": item['quantity'], "reservation_id": f"r-{item['product_id']}",
+                 "name": "Product", "price": 9.99}
+                for item in body['items']
+            ]}
+        elif path in ('/reservations/confirm_batch', '/reservations/cancel_batch'):
+            status, payload = 200, {"settled": body['reservation_ids'], "skipped": []}
+        elif path == '/payments/process':
+            status, payload = 200, {"success": True, "payment_id": "p-1", "transaction_id": "t-1"}
+        elif path == '/orders':
+            status, payload = 201, {"order_id": "o-1"}
+        else:
+            status, payload = 404, {"error": "Not found"}
+        self._send(status, payload)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path.endswith('/validate'):
+            self._send(200, {"valid": True, "customer_id": "c-1", "name": "Bench", "email": "bench@example.com"})
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency):
+    DownstreamStub.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DownstreamStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def gateway_request():
+    token = jwt.encode({"user_id": "u-1", "username": "bench", "exp": int(time.time()) + 3600}, JWT_SECRET, algorithm='HS256')
+    body = json.dumps({
+        "token": token,
+        "customer_id": "c-1",
+        "products": [{"product_id": "a", "quantity": 1}, {"product_id": "b", "quantity": 2}],
+        "payment_method": "credit_card"
+    })
+    return 'POST', '/api/create_order', body
+
+
+def drive(port, request, concurrency, duration):
+    method, path, body = request
+    headers = {"Content-Type": "application/json"} if body else {}
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        own = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            if ok:
+                own.append(time.perf_counter() - started)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(own)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99)
+    }
+
+
+def run(service, worker_class, args, env):
+    port = free_port()
+    env = dict(env, PORT=str(port), WORKER_CLASS=worker_class, WORKERS=str(args.workers), THREADS=str(args.threads))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--log-level', 'warning'],
+        cwd=os.path.join(ROOT, service), env=env
+    )
+    try:
+        wait_for_port(port)
+        request = gateway_request() if service == 'api_gateway' else ('GET', args.path, None)
+        drive(port, request, args.concurrency, 1)
+        result = drive(port, request, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+    return dict(result, service=service, worker_class=worker_class, workers=args.workers, concurrency=args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service', default='api_gateway')
+    parser.add_argument('--path', help="GET path for services other than api_gateway")
+    parser.add_argument('--worker-classes', default=None, help="comma-separated (default: all supported by the service)")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds each stubbed downstream call takes")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.service == 'api_gateway':
+        stub = start_stub(args.latency)
+        stub_url = f"http://127.0.0.1:{stub.server_port}"
+        for name in ('AUTH', 'CUSTOMER', 'INVENTORY', 'PAYMENT', 'ORDER'):
+            env[f"{name}_SERVICE_URL"] = stub_url
+        env.update(JWT_SECRET=JWT_SECRET, AUTH_VERIFY_MODE='local', CONFIRM_MODE='background')
+        default_classes = 'sync,gthread,gevent,asgi'
+    elif not args.path:
+        parser.error("--path is required for services other than api_gateway")
+    else:
+        default_classes = 'sync,gthread,gevent'
+
+    results = [run(args.service, worker_class, args, env) for worker_class in (args.worker_classes or default_classes).split(',')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Shared JSON encoding for responses.
+
+BSON types are encoded natively wherever they appear in a document: ObjectId
+as its hex string, datetimes in Flask's HTTP date format (what the API has
+always returned) or, with JSON_DATETIME_FORMAT=iso, as ISO-8601. Handlers
+can pass Mongo documents straight to jsonify without converting `_id` first.
+orjson is used when it is installed, otherwise the standard library encoder.
+
+    app.json = FastJSONProvider(app)
+"""
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from bson import ObjectId
+except ImportError:
+    ObjectId = None
+
+DATETIME_FORMAT = os.environ.get('JSON_DATETIME_FORMAT', 'http')
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    """Same output as werkzeug.http.http_date, without the email.utils round trip"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        hour, minute, second = value.hour, value.minute, value.second
+    else:
+        hour = minute = second = 0
+    return (
+        f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} "
+        f"{value.year:04d} {hour:02d}:{minute:02d}:{second:02d} GMT"
+    )
+
+
+def _default_http(value):
+    if ObjectId is not None and isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _default_iso(value):
+    if ObjectId is not None and isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj, datetime_format=None):
+    """Encode obj as UTF-8 JSON bytes"""
+    iso = (datetime_format or DATETIME_FORMAT) == 'iso'
+    if orjson is not None:
+        if iso:
+            return orjson.dumps(obj, default=_default_iso, option=orjson.OPT_NON_STR_KEYS)
+        return orjson.dumps(
+            obj,
+            default=_default_http,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(
+        obj,
+        default=_default_iso if iso else _default_http,
+        separators=(',', ':'),
+        ensure_ascii=False
+    ).encode()
+
+
+def dumps(obj, datetime_format=None):
+    return dumps_bytes(obj, datetime_format).decode()
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by dumps_bytes"""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,82 @@
+"""
+Streaming NDJSON export straight from a Mongo cursor.
+
+Documents are written one JSON object per line while the cursor is being
+read, one cursor batch at a time, so peak memory stays constant however many
+documents are exported.
+
+Query parameters accepted by the /export routes:
+    from, to       ISO-8601 bounds on created_at (from inclusive, to exclusive)
+    batch_size     cursor batch size (default EXPORT_BATCH_SIZE, max MAX_EXPORT_BATCH_SIZE)
+"""
+import os
+from datetime import datetime
+
+from flask import Response, stream_with_context
+
+from encoding import dumps
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+MAX_EXPORT_BATCH_SIZE = int(os.environ.get('MAX_EXPORT_BATCH_SIZE', 10000))
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"{name} must be an ISO-8601 date")
+
+
+def export_query(args, query=None):
+    """Add the optional created_at range from the request args to query"""
+    query = dict(query or {})
+    created_at = {}
+
+    start = _parse_date(args, 'from')
+    if start:
+        created_at["$gte"] = start
+    end = _parse_date(args, 'to')
+    if end:
+        created_at["$lt"] = end
+
+    if created_at:
+        query["created_at"] = created_at
+    return query
+
+
+def export_batch_size(args):
+    try:
+        batch_size = int(args.get('batch_size', EXPORT_BATCH_SIZE))
+    except ValueError:
+        raise ExportError("batch_size must be an integer")
+    if batch_size <= 0:
+        raise ExportError("batch_size must be greater than 0")
+    return min(batch_size, MAX_EXPORT_BATCH_SIZE)
+
+
+def ndjson_response(collection, query, args):
+    """Stream every document matching query as NDJSON"""
+    batch_size = export_batch_size(args)
+    cursor = collection.find(export_query(args, query), batch_size=batch_size)
+
+    def generate():
+        try:
+            lines = []
+            for document in cursor:
+                lines.append(dumps(document, datetime_format='iso'))
+                if len(lines) >= batch_size:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,274 @@
+"""
+Counters, gauges and histograms, rendered in the Prometheus text format.
+
+Every process records into its own registry. Under gunicorn each worker is a
+process, so a scrape that reaches one worker would see only that worker's
+share. With METRICS_DIR set, every worker also writes its numbers to
+METRICS_DIR/<pid>.json: every METRICS_FLUSH_INTERVAL seconds from a
+background thread, on every render and on exit. render() merges the files
+of all workers:
+
+- counters and histograms are added up over every file, including workers
+  that have exited, so totals never go backwards when a worker is replaced;
+- gauges come from live workers only, added up (merge='sum', e.g. calls in
+  flight) or the largest value (merge='max', e.g. a breaker state).
+
+The scraped worker uses its current numbers; the others are at most
+METRICS_FLUSH_INTERVAL seconds old. Recording itself never touches the
+files. gunicorn.conf.py points METRICS_DIR at a fresh directory whenever
+more than one worker runs.
+
+Configuration (environment):
+    METRICS_DIR              directory shared by a service's workers (default unset: this process only)
+    METRICS_FLUSH_INTERVAL   seconds between writes of a worker's file (default 5)
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Seconds; spans sub-millisecond cache hits up to the slowest upstream timeouts
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, le=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, snapshots, live):
+        merged = {}
+        for values in snapshots:
+            for labels, value in values.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def render(self, values=None):
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, labelnames=(), merge='sum'):
+        if merge not in ('sum', 'max'):
+            raise ValueError(f"merge must be 'sum' or 'max', got {merge!r}")
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.merge_mode = merge
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, snapshots, live):
+        merged = {}
+        for values, alive in zip(snapshots, live):
+            if not alive:
+                continue
+            for labels, value in values.items():
+                if labels not in merged:
+                    merged[labels] = value
+                elif self.merge_mode == 'sum':
+                    merged[labels] += value
+                else:
+                    merged[labels] = max(merged[labels], value)
+        return merged
+
+    def render(self, values=None):
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; an observation is one bisect and three additions."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [list(counts), total, count] for labels, (counts, total, count) in self._series.items()}
+
+    def merge(self, snapshots, live):
+        merged = {}
+        for values in snapshots:
+            for labels, (counts, total, count) in values.items():
+                series = merged.get(labels)
+                if series is None:
+                    merged[labels] = [list(counts), total, count]
+                    continue
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+        return merged
+
+    def render(self, values=None):
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, '+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, labelnames=(), merge='sum'):
+        metric = Gauge(name, help_text, labelnames, merge)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def start_flusher(self):
+        """Write this process's file every flush_interval seconds and on exit; once per process"""
+        if not self.directory:
+            return
+        with self._flusher_lock:
+            # A forked child inherits the flag but not the thread
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def flush():
+            while True:
+                time.sleep(self.flush_interval)
+                self.write()
+
+        threading.Thread(target=flush, name='metrics-flush', daemon=True).start()
+        atexit.register(self.write)
+
+    def write(self, snapshots=None):
+        """Replace this process's file with its current numbers"""
+        snapshots = self._snapshots() if snapshots is None else snapshots
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        data = {name: [[list(labels), value] for labels, value in values.items()] for name, values in snapshots.items()}
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary, path)
+
+    def _snapshots(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def _read_others(self):
+        """(snapshots, alive) of every other process's file"""
+        others = []
+        for name in os.listdir(self.directory):
+            pid = name[:-len('.json')]
+            if not name.endswith('.json') or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                # Removed or replaced while being read; its numbers come back next scrape
+                continue
+            snapshots = {
+                metric: {tuple(labels): value for labels, value in series}
+                for metric, series in data.items()
+            }
+            others.append((snapshots, _alive(int(pid))))
+        return others
+
+    def render(self):
+        snapshots = self._snapshots()
+        if self.directory:
+            self.write(snapshots)
+            others = self._read_others()
+            snapshots = {
+                metric.name: metric.merge(
+                    [snapshots[metric.name]] + [other.get(metric.name, {}) for other, _ in others],
+                    [True] + [alive for _, alive in others]
+                )
+                for metric in self._metrics
+            }
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(snapshots[metric.name]))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,69 @@
+"""
+Keyset pagination over (created_at, _id), newest first.
+
+List endpoints accept `limit` (capped at MAX_PAGE_SIZE) and an opaque
+`after` cursor taken from the previous page. Each page is one indexed range
+scan, so memory and latency stay flat however large the collection grows.
+
+Configuration (environment):
+    DEFAULT_PAGE_SIZE    page size when `limit` is not given (default 50)
+    MAX_PAGE_SIZE        hard upper bound for `limit` (default 200)
+"""
+import base64
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DESCENDING
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+PAGE_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(document):
+    raw = f"{document['created_at'].isoformat()}|{document['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, document_id = raw.split('|')
+        return datetime.fromisoformat(created_at), ObjectId(document_id)
+    except Exception:
+        raise PaginationError("Invalid cursor")
+
+
+def page_limit(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit <= 0:
+        raise PaginationError("limit must be greater than 0")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def paginate(collection, query, args):
+    """Return (documents, next_cursor) for the page described by args; next_cursor is None on the last page"""
+    limit = page_limit(args)
+
+    cursor = args.get('after')
+    if cursor:
+        created_at, document_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": document_id}}
+        ]}]}
+
+    documents = list(collection.find(query).sort(PAGE_SORT).limit(limit + 1))
+    if len(documents) > limit:
+        documents = documents[:limit]
+        return documents, encode_cursor(documents[-1])
+    return documents, None
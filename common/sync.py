@@ -0,0 +1,72 @@
+"""
+Copies the shared modules in common/ into the services that use them.
+
+Each service is its own Docker build context, so it cannot import from
+common/ at run time. It gets a generated copy instead, marked with a header
+naming its source. Edit the file in common/, then run:
+
+    python common/sync.py           # rewrite every copy
+    python common/sync.py --check   # list stale copies and exit 1 (tests/test_common_copies.py runs this)
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Shared module -> services that get a copy of it
+SERVICES = ('auth_service', 'customer_service', 'inventory_service', 'payment_service', 'order_service', 'api_gateway')
+COPIES = {
+    'encoding.py': SERVICES,
+    'export.py': ('customer_service', 'inventory_service', 'payment_service', 'order_service'),
+    'metrics_registry.py': SERVICES,
+    'mongo_indexes.py': ('auth_service', 'customer_service', 'inventory_service', 'payment_service', 'order_service'),
+    'pagination.py': ('customer_service', 'inventory_service', 'payment_service', 'order_service'),
+    # api_gateway has its own tracing.py, which also times the downstream hops
+    'tracing.py': ('auth_service', 'customer_service', 'inventory_service', 'payment_service', 'order_service'),
+}
+
+HEADER = "# Generated from common/{name} by common/sync.py. Edit that file, not this copy.\n"
+
+
+def expected(name):
+    with open(os.path.join(ROOT, 'common', name)) as file:
+        return HEADER.format(name=name) + file.read()
+
+
+def stale_copies():
+    """(path, expected content) of every copy that differs from its source"""
+    stale = []
+    for name, services in COPIES.items():
+        content = expected(name)
+        for service in services:
+            path = os.path.join(ROOT, service, name)
+            try:
+                with open(path) as file:
+                    current = file.read()
+            except FileNotFoundError:
+                current = None
+            if current != content:
+                stale.append((path, content))
+    return stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help="only report stale copies")
+    args = parser.parse_args()
+
+    stale = stale_copies()
+    for path, content in stale:
+        if args.check:
+            print(f"stale: {os.path.relpath(path, ROOT)}")
+            continue
+        with open(path, 'w') as file:
+            file.write(content)
+        print(f"wrote {os.path.relpath(path, ROOT)}")
+    if args.check and stale:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
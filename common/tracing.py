@@ -0,0 +1,68 @@
+"""
+Request IDs and handling-time logging.
+
+The gateway sends an X-Request-ID with every call it makes. This service logs
+each request with that ID and its own handling time, and echoes the ID in the
+response together with `Server-Timing: app;dur=<ms>`. Requests without a
+well-formed ID get a new one.
+
+Configuration (environment):
+    REQUEST_LOG   false turns off the per-request log line (default true)
+"""
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+
+from flask import g, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', 'true').lower() != 'false'
+
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+
+def request_logger(service):
+    """The '<service>.requests' logger, writing bare lines to stdout"""
+    logger = logging.getLogger(f'{service}.requests')
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def current_request_id():
+    """ID of the request being handled, for forwarding on outgoing calls"""
+    return g.get('request_id')
+
+
+def init_tracing(app, service):
+    """Assign request IDs and log every request of app under the '<service>.requests' logger"""
+    logger = request_logger(service)
+
+    @app.before_request
+    def start_request():
+        request_id = request.headers.get(REQUEST_ID_HEADER)
+        g.request_id = request_id if request_id and _VALID_REQUEST_ID.match(request_id) else uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+        response.headers['Server-Timing'] = f"app;dur={duration_ms:.1f}"
+        if REQUEST_LOG:
+            logger.info(
+                f"request_id={g.request_id} method={request.method} path={request.path} "
+                f"status={response.status_code} duration_ms={duration_ms:.1f}"
+            )
+        return response
@@ -0,0 +1,79 @@
+# Generated from common/mongo_indexes.py by common/sync.py. Edit that file, not this copy.
+"""
+Applying and checking a service's declarative index specification.
+
+Each service lists its indexes and the queries on its request path in its
+own indexes.py:
+
+    INDEXES = {"collection": [{"keys": [...], "name": ..., <create_index options>}, ...]}
+    HOT_QUERIES = [(collection, description, filter, sort), ...]
+
+and hands them to the functions below, which are the same for every service.
+"""
+INDEX_STAGES = {'IXSCAN', 'IDHACK', 'EXPRESS_IXSCAN', 'COUNT_SCAN', 'DISTINCT_SCAN'}
+
+
+def ensure_indexes(db, indexes):
+    """Create every index in indexes; indexes that already exist are left alone"""
+    for collection_name, specs in indexes.items():
+        for spec in specs:
+            options = {key: value for key, value in spec.items() if key != 'keys'}
+            try:
+                db[collection_name].create_index(spec['keys'], **options)
+            except Exception as e:
+                print(f"Failed to create index {spec['name']} on {collection_name}: {str(e)}")
+
+
+def missing_indexes(db, indexes):
+    missing = []
+    for collection_name, specs in indexes.items():
+        existing = {index['name'] for index in db[collection_name].list_indexes()}
+        missing.extend((collection_name, spec['name']) for spec in specs if spec['name'] not in existing)
+    return missing
+
+
+def plan_stages(plan):
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def explain_queries(db, queries):
+    """Return (collection, description, stages, uses_index) for every query"""
+    results = []
+    for collection_name, description, query, sort in queries:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        uses_index = 'COLLSCAN' not in stages and bool(INDEX_STAGES.intersection(stages))
+        results.append((collection_name, description, stages, uses_index))
+    return results
+
+
+def main(db, command, indexes, queries, usage):
+    """The `python indexes.py check|apply|explain` command; returns the exit status"""
+    if command == 'apply':
+        ensure_indexes(db, indexes)
+        command = 'check'
+
+    if command == 'check':
+        missing = missing_indexes(db, indexes)
+        for collection_name, index_name in missing:
+            print(f"missing: {collection_name}.{index_name}")
+        print("all indexes present" if not missing else f"{len(missing)} index(es) missing")
+        return 1 if missing else 0
+
+    if command == 'explain':
+        failed = 0
+        for collection_name, description, stages, uses_index in explain_queries(db, queries):
+            failed += not uses_index
+            print(f"{'ok  ' if uses_index else 'SCAN'} {collection_name}: {description} -> {' > '.join(filter(None, stages))}")
+        return 1 if failed else 0
+
+    print(usage)
+    return 2
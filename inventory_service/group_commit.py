@@ -0,0 +1,211 @@
+"""
+Group commit for POST /products/<id>/reserve.
+
+Without it, every reservation is its own guarded update of the product
+followed by its own reservation insert. With RESERVE_GROUP_COMMIT=true the
+first request to arrive opens a batch and waits up to RESERVE_BATCH_WINDOW_MS
+for others (or until RESERVE_BATCH_MAX_SIZE are waiting), then writes the
+whole batch at once:
+
+    1. one guarded update per product in the batch, taking the stock of all
+       its requests at once (available_quantity >= their total, and not
+       sharded)
+    2. one insert_many of the reservation documents
+
+Each waiting request then gets its own result. When a product cannot cover
+all its requests at once, its requests are tried one by one, in arrival
+order, so the ones that fit still get their stock. A request whose guard did
+not match gets None and takes the normal path (404, sharded stock or
+"Insufficient stock"), so responses are the same as without group commit.
+No update upserts, so a product deleted or sharded meanwhile is never
+written to.
+
+This trades up to one window of latency per request for far fewer round
+trips when many reservations of the same products are in flight: a flash
+sale on one product costs two writes per batch. Batches are per worker process.
+
+Configuration (environment):
+    RESERVE_GROUP_COMMIT        true enables batching (default false)
+    RESERVE_BATCH_WINDOW_MS     how long a batch stays open (default 2)
+    RESERVE_BATCH_MAX_SIZE      write as soon as this many requests wait (default 64)
+"""
+import os
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from metrics import METRICS_ENABLED, group_commit_batch_size
+
+
+class _Request:
+    __slots__ = ('product_id', 'quantity', 'customer_id', 'reservation_id', 'error', 'done')
+
+    def __init__(self, product_id, quantity, customer_id):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.customer_id = customer_id
+        self.reservation_id = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Batch:
+    def __init__(self):
+        self.requests = []
+        self.full = threading.Event()
+
+
+class GroupCommitWriter:
+    """Collects concurrent single-product reservations and writes them together."""
+
+    def __init__(self, products, reservations, window=0.002, max_size=64):
+        self.products = products
+        self.reservations = reservations
+        self.window = window
+        self.max_size = max_size
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def reserve(self, product_id, quantity, customer_id):
+        """
+        Take quantity of the product and record a reservation. Returns the
+        reservation's ObjectId, or None when the stock guard did not match.
+        Raises if the batch could not be written.
+        """
+        request = _Request(product_id, quantity, customer_id)
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.requests.append(request)
+            if len(batch.requests) >= self.max_size:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._flush(batch.requests)
+        else:
+            request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.reservation_id
+
+    def _flush(self, requests):
+        if METRICS_ENABLED:
+            group_commit_batch_size.observe(len(requests))
+        try:
+            self._write(requests)
+        except Exception as e:
+            for request in requests:
+                if request.reservation_id is None and request.error is None:
+                    request.error = e
+        finally:
+            for request in requests:
+                request.done.set()
+
+    def _write(self, requests):
+        now = datetime.utcnow()
+
+        by_product = {}
+        for request in requests:
+            by_product.setdefault(request.product_id, []).append(request)
+
+        reserved = []
+        for product_id, product_requests in by_product.items():
+            taken = []
+            try:
+                if self._take(product_id, sum(request.quantity for request in product_requests), now):
+                    taken = product_requests
+                elif len(product_requests) > 1:
+                    # Not enough for all of them: serve the ones that still fit
+                    for request in product_requests:
+                        if self._take(product_id, request.quantity, now):
+                            taken.append(request)
+            except Exception as e:
+                # The other products' requests go ahead
+                for request in product_requests:
+                    if request not in taken:
+                        request.error = e
+            reserved.extend(taken)
+        if not reserved:
+            return
+
+        documents = [
+            {
+                "_id": ObjectId(),
+                "product_id": request.product_id,
+                "customer_id": request.customer_id,
+                "quantity": request.quantity,
+                "status": "reserved",
+                "created_at": now,
+                "reserved_at": now
+            }
+            for request in reserved
+        ]
+        try:
+            self.reservations.insert_many(documents, ordered=True)
+            inserted = len(documents)
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            self._release(reserved[inserted:], now)
+            for request in reserved[inserted:]:
+                request.error = RuntimeError("Failed to record reservation")
+        except Exception as e:
+            inserted = 0
+            self._release(reserved, now)
+            for request in reserved:
+                request.error = e
+
+        for request, document in zip(reserved[:inserted], documents):
+            request.reservation_id = document['_id']
+
+    def _take(self, product_id, quantity, now):
+        """The guarded stock update of the single reserve path; False if it did not match"""
+        return self.products.update_one(
+            {"_id": product_id, "shard_count": {"$exists": False}, "available_quantity": {"$gte": quantity}},
+            {
+                "$inc": {
+                    "reserved_quantity": quantity,
+                    "available_quantity": -quantity
+                },
+                "$set": {"updated_at": now}
+            }
+        ).matched_count == 1
+
+    def _release(self, requests, now):
+        """Give back the stock of reservations whose documents could not be inserted"""
+        if requests:
+            self.products.bulk_write([
+                UpdateOne(
+                    {"_id": request.product_id},
+                    {
+                        "$inc": {
+                            "reserved_quantity": -request.quantity,
+                            "available_quantity": request.quantity
+                        },
+                        "$set": {"updated_at": now}
+                    }
+                )
+                for request in requests
+            ], ordered=False)
+
+
+def group_commit_writer_from_env(products, reservations):
+    """GroupCommitWriter configured from the environment, or None when group commit is off"""
+    if os.environ.get('RESERVE_GROUP_COMMIT', 'false').lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+    return GroupCommitWriter(
+        products,
+        reservations,
+        window=float(os.environ.get('RESERVE_BATCH_WINDOW_MS', 2)) / 1000,
+        max_size=int(os.environ.get('RESERVE_BATCH_MAX_SIZE', 64))
+    )
@@ -0,0 +1,65 @@
+"""
+Declarative index specification for inventory_service.
+
+The indexes are applied idempotently when the service starts (set
+MONGO_ENSURE_INDEXES=false to skip) and can be checked from the command line:
+
+    python indexes.py check      # list missing indexes, exit 1 if any
+    python indexes.py apply      # create missing indexes
+    python indexes.py explain    # explain() every hot query, exit 1 if any scans the collection
+"""
+import os
+import sys
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+import mongo_indexes
+from pagination import PAGE_SORT
+
+INDEXES = {
+    "products": [
+        {"keys": [("created_at", DESCENDING), ("_id", DESCENDING)], "name": "created_at"},
+        {"keys": [("shard_count", ASCENDING)], "name": "shard_count", "sparse": True}
+    ],
+    "reservations": [
+        {"keys": [("status", ASCENDING), ("created_at", ASCENDING)], "name": "status_created_at"},
+        {"keys": [("product_id", ASCENDING), ("status", ASCENDING)], "name": "product_id_status"},
+        {"keys": [("batch_id", ASCENDING)], "name": "batch_id", "sparse": True},
+        # Settlements a crash left unapplied, for settlement_reaper.py
+        {"keys": [("stock_applied", ASCENDING)], "name": "stock_unapplied", "partialFilterExpression": {"stock_applied": False}}
+    ],
+    "stock_shards": [
+        {"keys": [("product_id", ASCENDING), ("shard", ASCENDING)], "name": "product_id_shard", "unique": True}
+    ]
+}
+
+# (collection, description, filter, sort) for the queries on the request path
+HOT_QUERIES = [
+    ("products", "product by id", {"_id": ObjectId()}, None),
+    ("products", "batch pricing", {"_id": {"$in": [ObjectId(), ObjectId()]}}, None),
+    ("products", "products page", {}, PAGE_SORT),
+    ("reservations", "reservation claim", {"_id": ObjectId(), "status": "reserved"}, None),
+    ("reservations", "reservations by status", {"status": "reserved"}, [("created_at", ASCENDING)]),
+    ("reservations", "open reservations of a product", {"product_id": ObjectId(), "status": "reserved"}, None),
+    ("reservations", "reservations of a settlement batch", {"batch_id": ObjectId()}, None),
+    ("stock_shards", "shard of a product", {"product_id": ObjectId(), "shard": 0}, None),
+    ("stock_shards", "shards of a product", {"product_id": ObjectId()}, [("shard", ASCENDING)])
+]
+
+
+def ensure_indexes(db):
+    """Create every index in INDEXES; indexes that already exist are left alone"""
+    mongo_indexes.ensure_indexes(db, INDEXES)
+
+
+def explain_hot_queries(db):
+    """Return (collection, description, stages, uses_index) for every hot query"""
+    return mongo_indexes.explain_queries(db, HOT_QUERIES)
+
+
+if __name__ == '__main__':
+    os.environ['MONGO_ENSURE_INDEXES'] = 'false'
+    from app import db
+
+    sys.exit(mongo_indexes.main(db, sys.argv[1] if len(sys.argv) > 1 else 'check', INDEXES, HOT_QUERIES, __doc__))
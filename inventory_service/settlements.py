@@ -0,0 +1,124 @@
+"""
+Settling reservations: moving them out of "reserved" (to confirmed or
+cancelled) and applying the matching stock change to their products.
+
+A settlement is three writes:
+
+1. Claim: one status-guarded update moves the reservations to the new
+   status and tags them with a new batch_id and stock_applied: false, so
+   concurrent confirms and cancels never settle the same reservation twice.
+   A single reservation is claimed and read back in one find_one_and_update.
+2. Mark: the batch's reservations are set to stock_applied: true. Only the
+   caller whose update flips them goes on to step 3, so a batch's stock
+   change is applied at most once. The marker lives on the reservations;
+   the products and shards, which every settlement of a hot product
+   updates, carry nothing but their counters.
+3. Apply: the quantities are added up per product (and per stock shard, see
+   stock_shards.py) and applied in one bulk write.
+
+A process that dies between steps 1 and 2 leaves reservations with
+stock_applied: false. finish_settlements() applies their batches once they
+are older than SETTLE_REAP_AGE; settlement_reaper.py runs it periodically.
+The mark stays exclusive as long as no settlement stalls for longer than
+SETTLE_REAP_AGE between its claim and its mark. A process that dies between steps 2 and 3 loses the batch's stock change:
+the units stay counted as reserved (never sold twice), and the reaper
+cannot tell such a batch from an applied one.
+
+Configuration (environment):
+    SETTLE_REAP_AGE   seconds before an unapplied settlement is finished by the reaper (default 60)
+"""
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+from stock_shards import cached_shard_count, sweep_product_stock
+
+SETTLE_REAP_AGE = float(os.environ.get('SETTLE_REAP_AGE', 60))
+
+TIMESTAMP_FIELDS = {'confirmed': 'confirmed_at', 'cancelled': 'cancelled_at'}
+CLAIMED_FIELDS = {"product_id": 1, "quantity": 1, "shard": 1}
+
+
+def stock_change(status, quantity):
+    """Counter changes for settling quantity reserved units"""
+    if status == 'confirmed':
+        return {"stock_quantity": -quantity, "reserved_quantity": -quantity}
+    return {"reserved_quantity": -quantity, "available_quantity": quantity}
+
+
+def claim_reservations(reservations, reservation_ids, status):
+    """
+    Move the reserved ones among reservation_ids (ObjectIds) to status under
+    a new batch ID; returns the batch ID and the claimed reservations
+    """
+    batch_id = ObjectId()
+    claim = {"$set": {"status": status, TIMESTAMP_FIELDS[status]: datetime.utcnow(), "batch_id": batch_id, "stock_applied": False}}
+    if len(reservation_ids) == 1:
+        reservation = reservations.find_one_and_update(
+            {"_id": reservation_ids[0], "status": "reserved"}, claim,
+            projection=CLAIMED_FIELDS, return_document=ReturnDocument.AFTER
+        )
+        return batch_id, [reservation] if reservation else []
+    reservations.update_many({"_id": {"$in": reservation_ids}, "status": "reserved"}, claim)
+    return batch_id, list(reservations.find({"batch_id": batch_id}, CLAIMED_FIELDS))
+
+
+def apply_settlement(products, shards, reservations, batch_id, status, claimed=None):
+    """
+    Apply the stock change of the reservations claimed under batch_id, at
+    most once; claimed defaults to reading them back. Returns those
+    reservations.
+    """
+    if claimed is None:
+        claimed = list(reservations.find({"batch_id": batch_id}, CLAIMED_FIELDS))
+    if not claimed:
+        return claimed
+    if not reservations.update_many({"batch_id": batch_id, "stock_applied": False}, {"$set": {"stock_applied": True}}).modified_count:
+        # Applied already, by the claimer or the reaper
+        return claimed
+
+    # (product_id, shard) -> quantity; shard is None for stock held on the product document
+    quantities = {}
+    for reservation in claimed:
+        key = (reservation['product_id'], reservation.get('shard'))
+        quantities[key] = quantities.get(key, 0) + reservation['quantity']
+
+    now = datetime.utcnow()
+    product_updates = [
+        UpdateOne({"_id": product_id}, {"$inc": stock_change(status, quantity), "$set": {"updated_at": now}})
+        for (product_id, shard), quantity in quantities.items() if shard is None
+    ]
+    shard_updates = [
+        UpdateOne({"product_id": product_id, "shard": shard}, {"$inc": stock_change(status, quantity), "$set": {"updated_at": now}})
+        for (product_id, shard), quantity in quantities.items() if shard is not None
+    ]
+    if product_updates:
+        products.bulk_write(product_updates, ordered=False)
+    if shard_updates:
+        shards.bulk_write(shard_updates, ordered=False)
+
+    if status == 'cancelled':
+        # Stock given back to a sharded product's own document, from reservations made
+        # before the split, is moved on into its shards, which reservations read. A
+        # process that has not seen the split leaves it to shard_rebalancer.py's sweep.
+        for product_id in {product_id for product_id, shard in quantities if shard is None}:
+            if cached_shard_count(product_id):
+                sweep_product_stock(products, shards, product_id)
+    return claimed
+
+
+def finish_settlements(products, shards, reservations, min_age=SETTLE_REAP_AGE):
+    """Apply every batch claimed more than min_age seconds ago and not yet applied; returns the batches finished"""
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+    batches = {}
+    for status, timestamp_field in TIMESTAMP_FIELDS.items():
+        for reservation in reservations.find(
+            {"status": status, "stock_applied": False, timestamp_field: {"$lte": cutoff}},
+            {"batch_id": 1}
+        ):
+            batches[reservation['batch_id']] = status
+    for batch_id, status in batches.items():
+        apply_settlement(products, shards, reservations, batch_id, status)
+    return len(batches)
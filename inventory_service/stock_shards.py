@@ -0,0 +1,371 @@
+"""
+Sharded stock counters for hot products.
+
+Normally a product keeps its counters (stock_quantity, reserved_quantity,
+available_quantity) on its own document, so every reservation, confirmation
+and cancellation of that product updates the same document, one after the
+other. For a product under a flash sale, POST /products/<id>/shards
+{"shards": N} moves its available stock into N documents of the stock_shards
+collection:
+
+    {"product_id": ..., "shard": 0..N-1, "stock_quantity": ..., "reserved_quantity": ..., "available_quantity": ...}
+
+A reservation takes its stock from a single shard with enough available
+stock (trying a random shard first) and records that shard, so confirming or
+cancelling it updates the same shard. The product document keeps the stock
+held by reservations made before the split. Cancelling one of those gives
+its stock back to the product document, and sweep_product_stock() then
+moves it on into the shards, where reservations can find it; the same sweep
+runs when the shard count grows and on every shard_rebalancer.py pass. The
+product's totals are its own counters plus the sum over its shards.
+GET /products, /products/<id> and /availability return these totals. The
+NDJSON export shows the product document as stored.
+
+Stock leaves the product document (on the split and on every sweep) in one
+compare-and-set that also records the transfer on the document
+(stock_transfer: its ID and the quantity for each shard). The shards are
+then credited, each at most once per transfer ID, and the record is
+removed. A process that dies in between leaves the record behind, and the
+next sweep of that product finishes the transfer, so the stock is never
+lost; until then it is missing from the product's totals.
+
+Reservations drain shards unevenly. rebalance_shards() moves available
+stock from the fullest shards to the emptiest ones; it runs on
+POST /products/<id>/shards/rebalance and periodically in shard_rebalancer.py.
+When no single shard can cover a reservation but the product as a whole can,
+stock is first gathered into one shard.
+
+Moving stock between shards follows the same pattern: the guarded update
+that takes the units off the source shard also records the move on it
+(moves: its ID, target shard, quantity and time). The target is credited at
+most once per move ID and the record is removed. A move whose record is
+older than STOCK_MOVE_RECOVERY_SECONDS belongs to a process that died
+between the two writes; the next sweep of the product finishes it. Until
+then its units are missing from the product's totals.
+
+Sharding is one-way: the shard count can grow but not shrink.
+
+Configuration (environment):
+    STOCK_SHARDS_MAX               largest accepted shard count (default 64)
+    STOCK_MOVE_RECOVERY_SECONDS    age at which an unfinished move between shards is finished by a sweep (default 60)
+"""
+import os
+import random
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+STOCK_SHARDS_MAX = int(os.environ.get('STOCK_SHARDS_MAX', 64))
+STOCK_MOVE_RECOVERY_SECONDS = float(os.environ.get('STOCK_MOVE_RECOVERY_SECONDS', 60))
+COUNTERS = ('stock_quantity', 'reserved_quantity', 'available_quantity')
+
+# Attempts at splitting a product whose stock keeps changing underneath
+SPLIT_ATTEMPTS = 5
+
+# product ObjectId -> shard count. Sharding is one-way and the count only
+# grows, so a cached count is never wrong, at worst smaller than the current one.
+_shard_counts = {}
+
+
+class ShardingError(Exception):
+    """Invalid or conflicting shard request"""
+
+
+def cached_shard_count(product_id):
+    return _shard_counts.get(product_id, 0)
+
+
+def remember_shard_count(product_id, shard_count):
+    if shard_count and shard_count > _shard_counts.get(product_id, 0):
+        _shard_counts[product_id] = shard_count
+
+
+def shard_counters(shards, product_id):
+    return list(shards.find(
+        {"product_id": product_id},
+        {"_id": 0, "shard": 1, "stock_quantity": 1, "reserved_quantity": 1, "available_quantity": 1}
+    ).sort("shard", 1))
+
+
+def with_shard_totals(shards, products):
+    """Add each sharded product's shard counters to its own; products are updated in place"""
+    sharded = {product['_id']: product for product in products if product.get('shard_count')}
+    if sharded:
+        for product in sharded.values():
+            remember_shard_count(product['_id'], product['shard_count'])
+        for counters in shards.find({"product_id": {"$in": list(sharded)}}, {"_id": 0, "product_id": 1, **{name: 1 for name in COUNTERS}}):
+            product = sharded[counters['product_id']]
+            for name in COUNTERS:
+                product[name] = product.get(name, 0) + counters[name]
+    return products
+
+
+def enable_sharding(products, shards, product_id, shard_count):
+    """
+    Split the product's available stock across shard_count shards, or add
+    shards to an already sharded product. Returns the product's shard count,
+    or None if the product does not exist.
+    """
+    if not isinstance(shard_count, int) or not 2 <= shard_count <= STOCK_SHARDS_MAX:
+        raise ShardingError(f"shards must be an integer between 2 and {STOCK_SHARDS_MAX}")
+
+    for _ in range(SPLIT_ATTEMPTS):
+        product = products.find_one({"_id": product_id}, {"available_quantity": 1, "shard_count": 1})
+        if not product:
+            return None
+
+        current = product.get('shard_count', 0)
+        if shard_count < current:
+            raise ShardingError(f"product already has {current} shards; the shard count cannot shrink")
+
+        # Empty shards first, so no reservation can pick a shard that is not there yet
+        now = datetime.utcnow()
+        if shard_count > current:
+            shards.bulk_write([
+                UpdateOne(
+                    {"product_id": product_id, "shard": shard},
+                    {"$setOnInsert": {**{name: 0 for name in COUNTERS}, "created_at": now}},
+                    upsert=True
+                )
+                for shard in range(current, shard_count)
+            ], ordered=False)
+
+        if current:
+            products.update_one(
+                {"_id": product_id, "shard_count": {"$lt": shard_count}},
+                {"$set": {"shard_count": shard_count, "updated_at": now}}
+            )
+            remember_shard_count(product_id, shard_count)
+            sweep_product_stock(products, shards, product_id)
+            rebalance_shards(shards, product_id)
+            return shard_count
+
+        # Move the available stock off the product document in one compare-and-set;
+        # a reservation in between changes available_quantity and the split is retried
+        available = product['available_quantity']
+        if transfer_to_shards(
+            products, shards, product_id,
+            {"shard_count": {"$exists": False}, "available_quantity": available},
+            available, shard_count, {"shard_count": shard_count}
+        ):
+            remember_shard_count(product_id, shard_count)
+            return shard_count
+
+    raise ShardingError("product stock kept changing during the split; try again")
+
+
+def transfer_to_shards(products, shards, product_id, guard, available, shard_count, changes=None):
+    """
+    Take available units off the product document, if it still matches
+    guard, and spread them over its first shard_count shards. False if the
+    guard no longer matched.
+    """
+    transfer = {"id": ObjectId(), "quantities": even_split(available, shard_count)}
+    taken = products.update_one(
+        {"_id": product_id, "stock_transfer": {"$exists": False}, **guard},
+        {
+            "$set": {**(changes or {}), "available_quantity": 0, "stock_transfer": transfer, "updated_at": datetime.utcnow()},
+            "$inc": {"stock_quantity": -available}
+        }
+    ).modified_count
+    if taken:
+        apply_transfer(products, shards, product_id, transfer)
+    return bool(taken)
+
+
+def apply_transfer(products, shards, product_id, transfer):
+    """Credit a transfer recorded on the product document to its shards; safe to repeat"""
+    now = datetime.utcnow()
+    credits = [
+        UpdateOne(
+            {"product_id": product_id, "shard": shard, "transfers": {"$ne": transfer['id']}},
+            {
+                "$inc": {"stock_quantity": quantity, "available_quantity": quantity},
+                "$push": {"transfers": transfer['id']},
+                "$set": {"updated_at": now}
+            }
+        )
+        for shard, quantity in enumerate(transfer['quantities'])
+        if quantity
+    ]
+    if credits:
+        shards.bulk_write(credits, ordered=False)
+    products.update_one({"_id": product_id, "stock_transfer.id": transfer['id']}, {"$unset": {"stock_transfer": ""}})
+    if credits:
+        shards.update_many({"product_id": product_id, "transfers": transfer['id']}, {"$pull": {"transfers": transfer['id']}})
+
+
+def sweep_product_stock(products, shards, product_id):
+    """
+    Move the available stock on a sharded product's own document (given back
+    by cancelled reservations from before the split) into its shards, after
+    finishing any transfer or move between shards a crashed process left
+    behind. Returns the units moved.
+    """
+    product = products.find_one({"_id": product_id, "stock_transfer": {"$exists": True}}, {"stock_transfer": 1})
+    if product:
+        apply_transfer(products, shards, product_id, product['stock_transfer'])
+    finish_stale_moves(shards, product_id)
+
+    for _ in range(SPLIT_ATTEMPTS):
+        product = products.find_one({"_id": product_id}, {"available_quantity": 1, "shard_count": 1})
+        if not product or not product.get('shard_count') or product.get('available_quantity', 0) <= 0:
+            return 0
+        available = product['available_quantity']
+        if transfer_to_shards(
+            products, shards, product_id,
+            {"shard_count": product['shard_count'], "available_quantity": available},
+            available, product['shard_count']
+        ):
+            return available
+    return 0
+
+
+def even_split(total, parts):
+    return [total // parts + (1 if part < total % parts else 0) for part in range(parts)]
+
+
+def take(shards, product_id, shard, quantity):
+    """Reserve quantity on one shard if it has enough available stock"""
+    return shards.update_one(
+        {"product_id": product_id, "shard": shard, "available_quantity": {"$gte": quantity}},
+        {
+            "$inc": {"reserved_quantity": quantity, "available_quantity": -quantity},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    ).modified_count == 1
+
+
+def adjust_shard(shards, product_id, shard, changes):
+    """Apply counter changes, e.g. {"reserved_quantity": -2, "available_quantity": 2}, to one shard"""
+    shards.update_one(
+        {"product_id": product_id, "shard": shard},
+        {"$inc": changes, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+def reserve_from_shards(shards, product_id, shard_count, quantity):
+    """
+    Reserve quantity on one shard of the product. Returns the shard, or None
+    if the product as a whole does not have enough available stock.
+    """
+    first = random.randrange(shard_count)
+    if take(shards, product_id, first, quantity):
+        return first
+
+    counters = shard_counters(shards, product_id)
+    candidates = sorted(
+        (shard for shard in counters if shard['shard'] != first and shard['available_quantity'] >= quantity),
+        key=lambda shard: -shard['available_quantity']
+    )
+    for shard in candidates:
+        if take(shards, product_id, shard['shard'], quantity):
+            return shard['shard']
+
+    if counters and sum(shard['available_quantity'] for shard in counters) >= quantity:
+        target = max(counters, key=lambda shard: shard['available_quantity'])
+        gather(shards, product_id, counters, target, quantity)
+        if take(shards, product_id, target['shard'], quantity):
+            return target['shard']
+    return None
+
+
+def move(shards, product_id, source, target, quantity):
+    """Move available stock between two shards; False if source no longer has it"""
+    now = datetime.utcnow()
+    record = {"id": ObjectId(), "target": target, "quantity": quantity, "at": now}
+    taken = shards.update_one(
+        {"product_id": product_id, "shard": source, "available_quantity": {"$gte": quantity}},
+        {
+            "$inc": {"stock_quantity": -quantity, "available_quantity": -quantity},
+            "$push": {"moves": record},
+            "$set": {"updated_at": now}
+        }
+    ).modified_count
+    if not taken:
+        return False
+    finish_move(shards, product_id, source, record)
+    return True
+
+
+def finish_move(shards, product_id, source, record):
+    """Credit a move recorded on its source shard to the target shard; safe to repeat"""
+    shards.update_one(
+        {"product_id": product_id, "shard": record['target'], "transfers": {"$ne": record['id']}},
+        {
+            "$inc": {"stock_quantity": record['quantity'], "available_quantity": record['quantity']},
+            "$push": {"transfers": record['id']},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+    shards.update_one({"product_id": product_id, "shard": source}, {"$pull": {"moves": {"id": record['id']}}})
+    shards.update_one({"product_id": product_id, "shard": record['target']}, {"$pull": {"transfers": record['id']}})
+
+
+def finish_stale_moves(shards, product_id):
+    """
+    Finish the moves between the product's shards that were recorded more
+    than STOCK_MOVE_RECOVERY_SECONDS ago. Younger ones may still be finished
+    by the process that started them: once it has removed the target's
+    marker, crediting the move again here would count it twice.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=STOCK_MOVE_RECOVERY_SECONDS)
+    finished = 0
+    for shard in shards.find({"product_id": product_id, "moves.at": {"$lt": cutoff}}, {"shard": 1, "moves": 1}):
+        for record in shard['moves']:
+            if record['at'] < cutoff:
+                finish_move(shards, product_id, shard['shard'], record)
+                finished += 1
+    return finished
+
+
+def gather(shards, product_id, counters, target, quantity):
+    """Top up the target shard from the others until it holds quantity"""
+    needed = quantity - target['available_quantity']
+    for shard in sorted(counters, key=lambda shard: -shard['available_quantity']):
+        if needed <= 0:
+            break
+        if shard['shard'] == target['shard'] or shard['available_quantity'] <= 0:
+            continue
+        amount = min(needed, shard['available_quantity'])
+        if move(shards, product_id, shard['shard'], target['shard'], amount):
+            needed -= amount
+
+
+def rebalance_shards(shards, product_id, threshold=1.0):
+    """
+    Even out the available stock across the product's shards. Nothing moves
+    while the emptiest shard holds at least threshold x its fair share.
+    Returns the number of units moved.
+    """
+    counters = shard_counters(shards, product_id)
+    if len(counters) < 2:
+        return 0
+
+    total = sum(shard['available_quantity'] for shard in counters)
+    if min(shard['available_quantity'] for shard in counters) >= threshold * total / len(counters):
+        return 0
+
+    # The fullest shards keep the larger targets, which keeps the moves few
+    counters.sort(key=lambda shard: -shard['available_quantity'])
+    targets = even_split(total, len(counters))
+    surplus = [[shard['shard'], shard['available_quantity'] - target] for shard, target in zip(counters, targets) if shard['available_quantity'] > target]
+    deficit = [[shard['shard'], target - shard['available_quantity']] for shard, target in zip(counters, targets) if shard['available_quantity'] < target]
+
+    moved = 0
+    while surplus and deficit:
+        source, target = surplus[-1], deficit[-1]
+        amount = min(source[1], target[1])
+        if move(shards, product_id, source[0], target[0], amount):
+            moved += amount
+            source[1] -= amount
+            target[1] -= amount
+        else:
+            # The source was reserved from in the meantime; leave it be
+            source[1] = 0
+        if source[1] == 0:
+            surplus.pop()
+        if target[1] == 0:
+            deficit.pop()
+    return moved
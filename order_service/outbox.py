@@ -0,0 +1,72 @@
+"""
+Transactional outbox for order follow-ups.
+
+When OUTBOX_ENABLED is set, POST /orders writes the order and its follow-up
+events (e.g. confirming the order's stock reservations) in one Mongo
+transaction, so an event exists exactly when its order does. outbox_worker.py
+drains the collection in batches with at-least-once delivery: an event is
+leased to one worker, and if that worker dies the lease expires and another
+worker picks the event up. Handlers must therefore be idempotent.
+
+Transactions need a replica set (Atlas or a single-node replica set in
+development).
+"""
+import os
+from datetime import datetime, timedelta
+
+OUTBOX_ENABLED = os.environ.get('OUTBOX_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+CONFIRM_RESERVATIONS = 'reservations.confirm'
+
+
+def order_events(order_data):
+    """Follow-up events to record together with a new order"""
+    events = []
+    if order_data.get('reservation_ids') and order_data.get('status') == 'confirmed':
+        events.append({
+            "type": CONFIRM_RESERVATIONS,
+            "payload": {"reservation_ids": order_data['reservation_ids']}
+        })
+    return events
+
+
+def insert_with_outbox(client, orders_collection, outbox_collection, order_data):
+    """Insert the order and its outbox events atomically; returns the order ID"""
+    now = datetime.utcnow()
+    order_data = dict(order_data)
+    events = [
+        dict(event, status="pending", attempts=0, available_at=now, created_at=now)
+        for event in order_events(order_data)
+    ]
+
+    def write(session):
+        result = orders_collection.insert_one(order_data, session=session)
+        if events:
+            outbox_collection.insert_many(
+                [dict(event, order_id=result.inserted_id) for event in events],
+                session=session
+            )
+        return result.inserted_id
+
+    with client.start_session() as session:
+        return session.with_transaction(write)
+
+
+def claim_events(outbox_collection, worker_id, batch_size, lease_seconds):
+    """Lease up to batch_size due events to worker_id and return them"""
+    now = datetime.utcnow()
+    due = {
+        "status": "pending",
+        "available_at": {"$lte": now},
+        "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]
+    }
+
+    candidate_ids = [event['_id'] for event in outbox_collection.find(due, {"_id": 1}).sort("available_at", 1).limit(batch_size)]
+    if not candidate_ids:
+        return []
+
+    outbox_collection.update_many(
+        dict(due, _id={"$in": candidate_ids}),
+        {"$set": {"locked_by": worker_id, "locked_until": now + timedelta(seconds=lease_seconds)}}
+    )
+    return list(outbox_collection.find({"_id": {"$in": candidate_ids}, "locked_by": worker_id, "status": "pending"}))
@@ -0,0 +1,276 @@
+"""
+Asynchronous payment processing.
+
+With PAYMENT_MODE=async, POST /payments/process records the payment as
+"pending", answers 202 with its ID and leaves the charge to a bounded pool
+of worker threads, so a slow provider no longer holds a request thread.
+A worker first claims the payment (pending -> processing), so a payment
+cancelled while it waited for a worker is never charged, then charges the
+provider and stores the outcome (completed or failed). When the provider
+is busy (see providers.py), the worker waits as long as it asks and tries
+again, so the queue absorbs bursts above the provider's rate limit.
+
+A provider error or timeout does not say whether the card was charged.
+The charge is asked again under the same reference (the payment's
+transaction_id), which the provider deduplicates on, up to
+PROVIDER_UNKNOWN_RETRIES times. If the outcome is still unknown after that,
+the payment is stored as "unknown", never "failed", and
+POST /payments/<id>/reconcile asks the provider again later (order_service's
+payment reconciler does this for the orders waiting on it).
+
+A sync charge has a caller waiting on it: api_gateway gives payment_service
+10 seconds. The whole charge, retries included, therefore has to finish
+within PAYMENT_SYNC_TIMEOUT; when it cannot, the answer is "unknown" (202)
+while the caller is still listening, rather than a charge that completes
+after the gateway has given up on the order.
+
+The outcome can be read with
+
+    GET /payments/<id>                    the payment as stored
+    GET /payments/<id>/wait?timeout=S     long poll: the /payments/process response
+                                          once the payment is finished, or 202 after S seconds
+
+or pushed: when the request names a callback_url (or PAYMENT_CALLBACK_URL is
+set), the worker POSTs {"payment_id", "status", "success", "transaction_id",
+"order_id"} to it once the payment is finished. POST /payments/<id>/cancel
+cancels a payment that no worker has claimed yet.
+
+The pool and its waiters live in each worker process. A long poll that
+lands on another process sees the outcome by re-reading the payment every
+PAYMENT_POLL_INTERVAL seconds. The payments of a process that dies stay
+pending or processing: the provider may already have charged them, so they
+are left for reconciliation instead of being retried.
+
+Configuration (environment):
+    PAYMENT_MODE               sync | async (default sync)
+    PAYMENT_WORKERS            threads charging the provider, per process (default 8)
+    PAYMENT_QUEUE_SIZE         payments waiting for a worker before new ones get 503 (default 100)
+    PAYMENT_CALLBACK_URL       callback for payments that do not name one
+    PAYMENT_CALLBACK_TIMEOUT   seconds (default 2)
+    PAYMENT_POLL_INTERVAL      seconds between re-reads during a long poll (default 0.05)
+    PAYMENT_LONG_POLL_MAX      longest accepted ?timeout= in seconds (default 10)
+    PAYMENT_REJECTED_RETRIES   retries of a charge the provider rejected as busy (default 3)
+    PROVIDER_UNKNOWN_RETRIES   retries under the same reference when the outcome is unknown (default 2)
+    PROVIDER_RETRY_BACKOFF     seconds before the first of those retries, doubled for each one (default 0.5)
+    PAYMENT_SYNC_TIMEOUT       seconds a sync charge may take, retries included (default 8)
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from metrics import METRICS_ENABLED, payments_in_flight, provider_duration, provider_rejections
+from providers import ProviderRejected
+
+PAYMENT_MODES = ('sync', 'async')
+PAYMENT_POLL_INTERVAL = float(os.environ.get('PAYMENT_POLL_INTERVAL', 0.05))
+PAYMENT_LONG_POLL_MAX = float(os.environ.get('PAYMENT_LONG_POLL_MAX', 10))
+PROVIDER_UNKNOWN_RETRIES = int(os.environ.get('PROVIDER_UNKNOWN_RETRIES', 2))
+PROVIDER_RETRY_BACKOFF = float(os.environ.get('PROVIDER_RETRY_BACKOFF', 0.5))
+PAYMENT_SYNC_TIMEOUT = float(os.environ.get('PAYMENT_SYNC_TIMEOUT', 8))
+
+UNFINISHED = ('pending', 'processing')
+
+# payment ObjectId -> [Event set when a worker of this process finishes it, waiter count]
+_waiters = {}
+_waiters_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """Every worker is busy and the queue is full"""
+
+
+def _in_time(deadline, wait):
+    """Whether another attempt after waiting wait seconds still starts before deadline"""
+    return deadline is None or time.monotonic() + wait < deadline
+
+
+def charge(provider, payment, mode, retries=0, unknown_retries=None, deadline=None):
+    """
+    Charge the provider for a payment document. A rejected charge (see
+    providers.py) is retried up to retries times after the delay the provider
+    asked for, then re-raised. Any other provider error leaves the outcome
+    unknown: the charge is asked again under the same reference up to
+    unknown_retries times (default PROVIDER_UNKNOWN_RETRIES), and if it stays
+    unknown the outcome says so with "unknown": True.
+
+    With deadline (a time.monotonic() value) set, every attempt gets only the
+    time left before it, and no retry starts whose wait would pass it: the
+    outcome is then unknown, or the rejection is re-raised.
+    """
+    if unknown_retries is None:
+        unknown_retries = PROVIDER_UNKNOWN_RETRIES
+    rejections = 0
+    errors = 0
+    while True:
+        timeout = None if deadline is None else deadline - time.monotonic()
+        started = time.perf_counter()
+        try:
+            outcome = provider.charge(payment['payment_method'], payment['amount'], payment['currency'], payment['transaction_id'], timeout)
+        except ProviderRejected as e:
+            if METRICS_ENABLED:
+                provider_duration.observe(time.perf_counter() - started, mode, 'rejected')
+                provider_rejections.inc(e.reason)
+            if rejections == retries or not _in_time(deadline, e.retry_after):
+                raise
+            rejections += 1
+            time.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            if METRICS_ENABLED:
+                provider_duration.observe(time.perf_counter() - started, mode, 'unknown')
+            backoff = PROVIDER_RETRY_BACKOFF * (2 ** errors)
+            if errors == unknown_retries or not _in_time(deadline, backoff):
+                return {"success": False, "unknown": True, "message": f"Provider outcome unknown: {str(e)}"}
+            # The card may have been charged; the provider deduplicates a repeated reference
+            time.sleep(backoff)
+            errors += 1
+            continue
+        if METRICS_ENABLED:
+            provider_duration.observe(time.perf_counter() - started, mode, 'success' if outcome['success'] else 'failure')
+        return outcome
+
+
+def outcome_status(outcome):
+    """Payment status for a charge outcome"""
+    if outcome['success']:
+        return "completed"
+    return "unknown" if outcome.get('unknown') else "failed"
+
+
+class PaymentProcessor:
+    """Bounded worker pool that charges pending payments in the background."""
+
+    def __init__(self, payments, provider, workers=8, queue_size=100, callback_url=None, callback_timeout=2, rejected_retries=3):
+        self.payments = payments
+        self.provider = provider
+        self.rejected_retries = rejected_retries
+        self.callback_url = callback_url
+        self.callback_timeout = callback_timeout
+        self.capacity = workers + queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment')
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, payment_data, callback_url=None, request_id=None):
+        """
+        Insert payment_data as a pending payment and queue its charge.
+        Returns the payment's ObjectId; raises QueueFull without inserting
+        anything when the pool has no room.
+        """
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                raise QueueFull("Payment queue is full")
+            self._in_flight += 1
+        self._report()
+
+        try:
+            payment_id = self.payments.insert_one(dict(payment_data, status="pending")).inserted_id
+            self._executor.submit(self._process, payment_id, callback_url or self.callback_url, request_id)
+        except Exception:
+            self._done()
+            raise
+        return payment_id
+
+    def _process(self, payment_id, callback_url, request_id):
+        try:
+            payment = self.payments.find_one_and_update(
+                {"_id": payment_id, "status": "pending"},
+                {"$set": {"status": "processing", "processing_at": datetime.utcnow()}}
+            )
+            if payment is None:
+                # Cancelled before a worker got to it
+                return
+
+            try:
+                outcome = charge(self.provider, payment, 'async', retries=self.rejected_retries)
+            except ProviderRejected as e:
+                outcome = {"success": False, "message": str(e)}
+            status = outcome_status(outcome)
+            self.payments.update_one(
+                {"_id": payment_id, "status": "processing"},
+                {"$set": {"status": status, "gateway_response": outcome, "completed_at": datetime.utcnow()}}
+            )
+            _notify_finished(payment_id)
+
+            if callback_url:
+                self._callback(callback_url, request_id, {
+                    "payment_id": str(payment_id),
+                    "status": status,
+                    "success": outcome['success'],
+                    "transaction_id": payment['transaction_id'],
+                    "order_id": payment.get('order_id')
+                })
+        except Exception as e:
+            print(f"Failed to process payment {payment_id}: {str(e)}")
+        finally:
+            self._done()
+
+    def _callback(self, url, request_id, body):
+        """Best-effort push of the outcome; the payment can always be read back"""
+        headers = {"X-Request-ID": request_id} if request_id else {}
+        try:
+            requests.post(url, json=body, headers=headers, timeout=self.callback_timeout)
+        except Exception as e:
+            print(f"Payment callback to {url} failed: {str(e)}")
+
+    def _done(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._report()
+
+    def stats(self):
+        return {"mode": "async", "in_flight": self._in_flight, "capacity": self.capacity}
+
+    def _report(self):
+        if METRICS_ENABLED:
+            payments_in_flight.set(self._in_flight)
+
+
+def _notify_finished(payment_id):
+    with _waiters_lock:
+        waiter = _waiters.get(payment_id)
+    if waiter is not None:
+        waiter[0].set()
+
+
+def wait_for_payment(payments, payment_id, timeout):
+    """The payment once it is finished, or as it stands after timeout seconds; None if it does not exist"""
+    # Registered before the first read, so a payment finishing in between still wakes this waiter
+    with _waiters_lock:
+        waiter = _waiters.setdefault(payment_id, [threading.Event(), 0])
+        waiter[1] += 1
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            payment = payments.find_one({"_id": payment_id})
+            remaining = deadline - time.monotonic()
+            if payment is None or payment['status'] not in UNFINISHED or remaining <= 0:
+                return payment
+            waiter[0].wait(min(PAYMENT_POLL_INTERVAL, remaining))
+    finally:
+        with _waiters_lock:
+            waiter[1] -= 1
+            if not waiter[1]:
+                del _waiters[payment_id]
+
+
+def payment_processor_from_env(payments, provider):
+    """PaymentProcessor for PAYMENT_MODE=async, or None when payments are charged in the request"""
+    mode = os.environ.get('PAYMENT_MODE', 'sync')
+    if mode not in PAYMENT_MODES:
+        raise ValueError(f"PAYMENT_MODE must be one of {PAYMENT_MODES}, got {mode!r}")
+    if mode == 'sync':
+        return None
+    return PaymentProcessor(
+        payments,
+        provider,
+        workers=int(os.environ.get('PAYMENT_WORKERS', 8)),
+        queue_size=int(os.environ.get('PAYMENT_QUEUE_SIZE', 100)),
+        callback_url=os.environ.get('PAYMENT_CALLBACK_URL') or None,
+        callback_timeout=float(os.environ.get('PAYMENT_CALLBACK_TIMEOUT', 2)),
+        rejected_retries=int(os.environ.get('PAYMENT_REJECTED_RETRIES', 3))
+    )
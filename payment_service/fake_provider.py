@@ -0,0 +1,194 @@
+"""
+Local fake of a card provider, for load-testing payment_service against
+realistic provider behaviour (PAYMENT_PROVIDER=http, PROVIDER_URL pointing here).
+
+It serves the API HttpProvider expects (see providers.py):
+
+    POST /charges   200 approved, 402 declined, 429 rate limited, 500 failed
+    GET  /stats     counts of every answer so far
+
+A charge sleeps for a latency drawn from --latency (milliseconds):
+
+    fixed:200              always 200 ms
+    uniform:50,400         between 50 and 400 ms
+    exponential:150        mean 150 ms
+    lognormal:120,0.6      median 120 ms, sigma 0.6 (a long right tail, like real providers)
+
+Charges above --rate-limit per second or --max-concurrent at a time get 429
+with Retry-After, without the latency. Of the rest, --error-rate fail with
+500 before anything is charged and --decline-rate are declined;
+"invalid_card" and amounts above 10000 are always declined, as with the
+simulated provider. --lost-rate charges are made but answered with 500, as
+when the provider's response is lost.
+
+A charge repeating the reference of an earlier charge that was made gets
+the same answer back without being charged again, as real providers do with
+idempotency keys.
+
+    python fake_provider.py --port 6104 --latency lognormal:150,0.5 --rate-limit 50 --error-rate 0.01 --lost-rate 0.01
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_AMOUNT = 10000
+
+
+def latency_sampler(spec):
+    """Function returning a latency in seconds for a --latency spec"""
+    kind, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',') if value]
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'exponential' and len(values) == 1 and values[0] > 0:
+        return lambda: random.expovariate(1000 / values[0])
+    if kind == 'lognormal' and len(values) == 2 and values[0] > 0:
+        return lambda: random.lognormvariate(math.log(values[0] / 1000), values[1])
+    raise ValueError(f"unknown latency spec {spec!r}; use fixed:MS, uniform:LOW,HIGH, exponential:MEAN or lognormal:MEDIAN,SIGMA")
+
+
+class Throttle:
+    """Admits at most rate charges per second (fixed one-second windows) and max_concurrent at once."""
+
+    def __init__(self, rate=0, max_concurrent=0):
+        self.rate = rate
+        self.max_concurrent = max_concurrent
+        self._window = 0
+        self._window_count = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        """None if admitted, otherwise the seconds the caller should wait"""
+        with self._lock:
+            now = time.monotonic()
+            if int(now) != self._window:
+                self._window, self._window_count = int(now), 0
+            if self.rate and self._window_count >= self.rate:
+                return self._window + 1 - now
+            if self.max_concurrent and self._in_flight >= self.max_concurrent:
+                return 0.1
+            self._window_count += 1
+            self._in_flight += 1
+            return None
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+
+class FakeProvider(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; see benchmarks/worker_models.py
+    disable_nagle_algorithm = True
+
+    latency = staticmethod(lambda: 0.0)
+    throttle = Throttle()
+    error_rate = 0.0
+    decline_rate = 0.0
+    lost_rate = 0.0
+    counts = {}
+    counts_lock = threading.Lock()
+    # reference -> (status, body) of the charges made
+    charges = {}
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.split('?')[0] != '/charges':
+            return self._send(404, {"error": "Not found"})
+
+        retry_after = self.throttle.enter()
+        if retry_after is not None:
+            return self._send(429, {"error": "Too many requests"}, {"Retry-After": f"{max(retry_after, 0.01):.2f}"})
+
+        try:
+            time.sleep(self.latency())
+            reference = body.get('reference')
+            with self.counts_lock:
+                made = self.charges.get(reference) if reference else None
+            if made is not None:
+                self._count('replayed')
+                return self._send(*made)
+            if random.random() < self.error_rate:
+                return self._send(500, {"error": "Provider error"})
+
+            if body.get('payment_method') == "invalid_card" or float(body.get('amount', 0)) > MAX_AMOUNT or random.random() < self.decline_rate:
+                made = (402, {"id": uuid.uuid4().hex, "approved": False, "message": "Card declined"})
+            else:
+                made = (200, {"id": uuid.uuid4().hex, "approved": True, "message": "Payment processed successfully"})
+            if reference:
+                with self.counts_lock:
+                    made = self.charges.setdefault(reference, made)
+            if random.random() < self.lost_rate:
+                self._count('lost')
+                return self._send(500, {"error": "Provider error"})
+            return self._send(*made)
+        finally:
+            self.throttle.leave()
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/stats':
+            return self._send(404, {"error": "Not found"})
+        with self.counts_lock:
+            counts = {str(status): count for status, count in self.counts.items()}
+        self._send(200, counts, count=False)
+
+    def _count(self, name):
+        with self.counts_lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _send(self, status, payload, headers=None, count=True):
+        if count:
+            self._count(status)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, latency='fixed:0', rate_limit=0, max_concurrent=0, error_rate=0.0, decline_rate=0.0, lost_rate=0.0):
+    FakeProvider.latency = staticmethod(latency_sampler(latency))
+    FakeProvider.throttle = Throttle(rate_limit, max_concurrent)
+    FakeProvider.error_rate = error_rate
+    FakeProvider.decline_rate = decline_rate
+    FakeProvider.lost_rate = lost_rate
+    server = ThreadingHTTPServer(('0.0.0.0', port), FakeProvider)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=6104)
+    parser.add_argument('--latency', default='fixed:0', help="latency distribution in milliseconds")
+    parser.add_argument('--rate-limit', type=float, default=0, help="charges per second before 429s; 0 for no limit")
+    parser.add_argument('--max-concurrent', type=int, default=0, help="charges at once before 429s; 0 for no limit")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of charges failing with 500")
+    parser.add_argument('--decline-rate', type=float, default=0.0, help="share of charges declined with 402")
+    parser.add_argument('--lost-rate', type=float, default=0.0, help="share of charges made but answered with 500")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.rate_limit, args.max_concurrent, args.error_rate, args.decline_rate, args.lost_rate)
+    print(f"fake provider on :{args.port} latency={args.latency} rate_limit={args.rate_limit} "
+          f"max_concurrent={args.max_concurrent} error_rate={args.error_rate} decline_rate={args.decline_rate} "
+          f"lost_rate={args.lost_rate}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Gunicorn settings for payment_service. gunicorn reads this file from the working
+directory, so the container only runs `gunicorn`.
+
+Configuration (environment):
+    PORT                 listen port (default 6004)
+    WORKER_CLASS         sync | gthread | gevent (default gthread)
+    WORKERS              worker processes (default 2 x CPUs + 1)
+    THREADS              threads per gthread worker (default 8)
+    WORKER_CONNECTIONS   concurrent requests per gevent worker (default 1000)
+    TIMEOUT              seconds before a silent worker is restarted (default 30); must be above
+                         the longest request, PAYMENT_SYNC_TIMEOUT or PAYMENT_LONG_POLL_MAX
+    KEEPALIVE            seconds an idle keep-alive connection is held open (default 5)
+    METRICS_DIR          where workers share their metrics (default a new temporary directory when WORKERS > 1)
+"""
+import multiprocessing
+import os
+import tempfile
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"WORKER_CLASS must be one of {WORKER_CLASSES}, got {worker_class!r}")
+
+wsgi_app = 'app:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 6004)}"
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('TIMEOUT', 30))
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+
+# A sync charge (or reconciliation) and a long poll are the longest requests;
+# a worker restarted inside one loses the charge's outcome
+longest_request = max(
+    float(os.environ.get('PAYMENT_SYNC_TIMEOUT', 8)),
+    float(os.environ.get('PAYMENT_LONG_POLL_MAX', 10))
+)
+if timeout <= longest_request:
+    raise ValueError(f"TIMEOUT must be above the longest request ({longest_request:g} s), got {timeout}")
+
+# Each worker writes its metrics to a file in METRICS_DIR and /metrics merges
+# them (see metrics_registry.py). A new directory per start, so the files of
+# an earlier run are never merged in.
+if workers > 1 and not os.environ.get('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+
+# app.py is imported by each worker after the fork, so every worker opens its
+# own MongoClient (pymongo clients are not fork-safe).
+preload_app = False
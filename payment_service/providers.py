@@ -0,0 +1,270 @@
+"""
+Card providers that payments are charged with.
+
+Every provider implements PaymentProvider.charge(payment_method, amount,
+currency, reference, timeout) and returns {"success": bool, "message": str};
+timeout, when given, caps the seconds the charge may take:
+
+    SimulatedProvider   in-process stand-in: the service's decline rules
+                        (payment_method "invalid_card", amounts above 10000)
+                        with configurable latency and random declines
+    HttpProvider        a provider reached over HTTP (POST <PROVIDER_URL>/charges),
+                        through a pooled keep-alive session; fake_provider.py
+                        serves the same API locally
+
+A provider that refuses a charge without processing it (HTTP 429, or the
+local limiter below has no room) raises ProviderRejected. Nothing was
+charged, so the charge can be retried after retry_after seconds. Any other
+exception (a timeout, a 5xx) leaves the outcome unknown: the card may have
+been charged. Every charge carries the payment's transaction_id as its
+reference, and the provider answers a repeated reference with the original
+outcome instead of charging again, so asking again is safe (see
+async_payments.charge).
+
+Providers cap how fast they may be called. ProviderLimiter keeps this
+service under that cap: at most PROVIDER_MAX_CONCURRENT charges in flight
+and PROVIDER_RATE_LIMIT charges per second (a token bucket holding up to
+PROVIDER_RATE_BURST). A charge waits up to PROVIDER_ACQUIRE_TIMEOUT for
+room and is rejected after that. The limits are per process.
+
+Configuration (environment):
+    PAYMENT_PROVIDER             simulated | http (default simulated)
+    PROVIDER_LATENCY_MS          simulated: mean time a charge takes (default 0)
+    PROVIDER_LATENCY_JITTER_MS   simulated: charges take mean +- up to this much, uniformly (default 0)
+    PROVIDER_FAILURE_RATE        simulated: share of otherwise valid charges declined, 0..1 (default 0)
+    PROVIDER_URL                 http: base URL, e.g. http://localhost:6104
+    PROVIDER_TIMEOUT             http: seconds per charge (default 10)
+    PROVIDER_POOL_SIZE           http: pooled connections (default 20)
+    PROVIDER_MAX_CONCURRENT      charges in flight, 0 for no limit (default 0)
+    PROVIDER_RATE_LIMIT          charges per second, 0 for no limit (default 0)
+    PROVIDER_RATE_BURST          charges that may go out at once after a quiet spell (default the rate)
+    PROVIDER_ACQUIRE_TIMEOUT     seconds a charge waits for room under the limits (default 5)
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PROVIDERS = ('simulated', 'http')
+
+# Declined outright, as a real provider would decline an over-limit charge
+MAX_AMOUNT = 10000
+
+
+class ProviderRejected(Exception):
+    """The charge was refused before processing and can be retried"""
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(f"Payment provider is busy ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class PaymentProvider:
+    name = 'provider'
+
+    def charge(self, payment_method, amount, currency, reference=None, timeout=None):
+        """
+        Charge the amount; returns {"success": bool, "message": str}. With
+        timeout set, gives up after that many seconds by raising, which leaves
+        the outcome unknown.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {"provider": self.name}
+
+
+class SimulatedProvider(PaymentProvider):
+    """Stands in for a card provider: fixed decline rules plus configurable latency and failures."""
+
+    name = 'simulated'
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def charge(self, payment_method, amount, currency, reference=None, timeout=None):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if timeout is not None and delay > timeout:
+            time.sleep(max(timeout, 0.0))
+            raise TimeoutError(f"Payment provider did not answer within {timeout:.3f}s")
+        if delay > 0:
+            time.sleep(delay)
+
+        if payment_method == "invalid_card":
+            return {"success": False, "message": "Payment failed"}
+        if amount > MAX_AMOUNT:
+            return {"success": False, "message": "Payment failed"}
+        if self.failure_rate and random.random() < self.failure_rate:
+            return {"success": False, "message": "Payment declined by provider"}
+
+        return {"success": True, "message": "Payment processed successfully"}
+
+
+class HttpProvider(PaymentProvider):
+    """
+    Provider behind an HTTP API:
+
+        POST /charges {"payment_method", "amount", "currency", "reference"}
+            200 {"approved": true, "message"}    402 {"approved": false, "message"}
+            429 with Retry-After                 anything else is an error
+
+    A charge repeating an earlier reference gets that charge's answer back.
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url, timeout=10.0, pool_size=20):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Built lazily and again after a fork, so worker processes never share sockets
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def charge(self, payment_method, amount, currency, reference=None, timeout=None):
+        response = self.session.post(
+            f"{self.base_url}/charges",
+            json={"payment_method": payment_method, "amount": amount, "currency": currency, "reference": reference},
+            timeout=self.timeout if timeout is None else min(self.timeout, timeout)
+        )
+        if response.status_code == 429:
+            raise ProviderRejected('rate_limited', _retry_after(response.headers.get('Retry-After')))
+        if response.status_code not in (200, 402):
+            raise RuntimeError(f"Payment provider answered {response.status_code}")
+
+        data = response.json()
+        approved = bool(data.get('approved'))
+        return {
+            "success": approved,
+            "message": data.get('message') or ("Payment processed successfully" if approved else "Payment failed")
+        }
+
+    def stats(self):
+        return {"provider": self.name, "base_url": self.base_url, "timeout": self.timeout, "pool_size": self.pool_size}
+
+
+def _retry_after(value):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class ProviderLimiter:
+    """Concurrency cap and token bucket in front of a provider."""
+
+    def __init__(self, max_concurrent=0, rate=0.0, burst=None, acquire_timeout=5.0):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take_token(self, timeout):
+        """Seconds to wait before the reserved token may be used, or None if that is longer than timeout"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if wait > timeout:
+                return None
+            # Tokens may go negative: later callers queue behind the ones already waiting
+            self._tokens -= 1
+            return wait
+
+    def acquire(self, timeout=None):
+        acquire_timeout = self.acquire_timeout if timeout is None else min(self.acquire_timeout, max(timeout, 0.0))
+        deadline = time.monotonic() + acquire_timeout
+        if self._slots is not None and not self._slots.acquire(timeout=acquire_timeout):
+            raise ProviderRejected('concurrency_limit')
+
+        if self.rate:
+            wait = self._take_token(max(deadline - time.monotonic(), 0.0))
+            if wait is None:
+                self.release()
+                raise ProviderRejected('rate_limit', 1 / self.rate)
+            if wait:
+                time.sleep(wait)
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def stats(self):
+        return {"max_concurrent": self.max_concurrent, "rate_limit": self.rate, "rate_burst": self.burst}
+
+
+class LimitedProvider(PaymentProvider):
+    """Charges go through a ProviderLimiter before reaching the wrapped provider."""
+
+    def __init__(self, provider, limiter):
+        self.provider = provider
+        self.limiter = limiter
+        self.name = provider.name
+
+    def charge(self, payment_method, amount, currency, reference=None, timeout=None):
+        started = time.monotonic()
+        self.limiter.acquire(timeout)
+        try:
+            if timeout is not None:
+                timeout -= time.monotonic() - started
+            return self.provider.charge(payment_method, amount, currency, reference, timeout)
+        finally:
+            self.limiter.release()
+
+    def stats(self):
+        return dict(self.provider.stats(), **self.limiter.stats())
+
+
+def provider_from_env():
+    name = os.environ.get('PAYMENT_PROVIDER', 'simulated')
+    if name not in PROVIDERS:
+        raise ValueError(f"PAYMENT_PROVIDER must be one of {PROVIDERS}, got {name!r}")
+
+    if name == 'http':
+        provider = HttpProvider(
+            os.environ['PROVIDER_URL'],
+            timeout=float(os.environ.get('PROVIDER_TIMEOUT', 10)),
+            pool_size=int(os.environ.get('PROVIDER_POOL_SIZE', 20))
+        )
+    else:
+        provider = SimulatedProvider(
+            latency=float(os.environ.get('PROVIDER_LATENCY_MS', 0)) / 1000,
+            jitter=float(os.environ.get('PROVIDER_LATENCY_JITTER_MS', 0)) / 1000,
+            failure_rate=float(os.environ.get('PROVIDER_FAILURE_RATE', 0))
+        )
+
+    max_concurrent = int(os.environ.get('PROVIDER_MAX_CONCURRENT', 0))
+    rate = float(os.environ.get('PROVIDER_RATE_LIMIT', 0))
+    if not max_concurrent and not rate:
+        return provider
+    return LimitedProvider(provider, ProviderLimiter(
+        max_concurrent=max_concurrent,
+        rate=rate,
+        burst=float(os.environ.get('PROVIDER_RATE_BURST', 0)) or None,
+        acquire_timeout=float(os.environ.get('PROVIDER_ACQUIRE_TIMEOUT', 5))
+    ))
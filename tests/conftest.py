@@ -0,0 +1,49 @@
+"""
+Shared fixtures for the service tests.
+
+The services are separate apps whose modules share names (app, metrics,
+indexes, ...), so tests import them through the `load` fixture: it drops
+whatever service modules an earlier test imported, puts the service's
+directory first on sys.path and imports app modules against mongomock, so
+no MongoDB is needed.
+
+    def test_something(load):
+        app = load('inventory_service')                    # inventory_service/app.py
+        resilience = load('api_gateway', 'resilience')     # any module of a service
+"""
+import importlib
+import os
+import sys
+from unittest import mock
+
+import mongomock
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ('auth_service', 'customer_service', 'inventory_service', 'payment_service', 'order_service', 'api_gateway')
+
+SERVICE_MODULES = {
+    name[:-3]
+    for service in SERVICES
+    for name in os.listdir(os.path.join(ROOT, service))
+    if name.endswith('.py')
+}
+
+
+@pytest.fixture
+def load(monkeypatch):
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    monkeypatch.delenv('MONGO_URI', raising=False)
+
+    def load(service, module='app', **env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        for name in SERVICE_MODULES:
+            sys.modules.pop(name, None)
+        monkeypatch.syspath_prepend(os.path.join(ROOT, service))
+        with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+            return importlib.import_module(module)
+
+    yield load
+    for name in SERVICE_MODULES:
+        sys.modules.pop(name, None)
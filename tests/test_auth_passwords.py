@@ -0,0 +1,120 @@
+import hashlib
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+# Cheap cost parameters; the formats and the rehash logic do not depend on them
+FAST = {"PASSWORD_HASH_WORKERS": 0, "SCRYPT_N": 16, "SCRYPT_R": 1, "SCRYPT_P": 1, "PBKDF2_ITERATIONS": 10}
+
+
+@pytest.fixture
+def passwords(load):
+    return load('auth_service', 'passwords')
+
+
+@pytest.fixture
+def auth(load):
+    return load('auth_service', **FAST)
+
+
+def test_decodes_each_format(passwords):
+    hashes = {
+        'scrypt': passwords.PasswordHasher('scrypt', scrypt_params=(16, 1, 1), workers=0).hash("secret"),
+        'pbkdf2_sha256': passwords.PasswordHasher('pbkdf2_sha256', pbkdf2_iterations=10, workers=0).hash("secret"),
+        'sha256': hashlib.sha256(b"secret").hexdigest()
+    }
+
+    assert hashes['scrypt'].startswith('scrypt$16$1$1$')
+    assert hashes['pbkdf2_sha256'].startswith('pbkdf2_sha256$10$')
+    decoded = {scheme: passwords.decode(encoded) for scheme, encoded in hashes.items()}
+    assert decoded['scrypt'][:2] == ('scrypt', (16, 1, 1))
+    assert decoded['pbkdf2_sha256'][:2] == ('pbkdf2_sha256', (10,))
+    assert decoded['sha256'] == ('sha256', (), b'', hashlib.sha256(b"secret").digest())
+    for scheme, params, salt, key in decoded.values():
+        assert len(key) == passwords.KEY_BYTES and len(salt) == (0 if scheme == 'sha256' else passwords.SALT_BYTES)
+        assert passwords.encode(scheme, params, salt, key) == hashes[scheme]
+
+
+@pytest.mark.parametrize('encoded', ['', 'plain-text-password', 'scrypt$16$1$salt$key', 'bcrypt$2b$12$abc'])
+def test_rejects_unknown_formats(passwords, encoded):
+    with pytest.raises(ValueError):
+        passwords.decode(encoded)
+
+
+def test_verify_asks_for_rehash_only_outside_configured_scheme(passwords):
+    hasher = passwords.PasswordHasher('scrypt', scrypt_params=(16, 1, 1), workers=0)
+    stronger = passwords.PasswordHasher('scrypt', scrypt_params=(32, 1, 1), workers=0)
+    pbkdf2 = passwords.PasswordHasher('pbkdf2_sha256', pbkdf2_iterations=10, workers=0)
+
+    assert hasher.verify("secret", hasher.hash("secret")) == (True, False)
+    assert hasher.verify("wrong", hasher.hash("secret")) == (False, False)
+    assert hasher.verify("secret", stronger.hash("secret")) == (True, True)
+    assert hasher.verify("secret", pbkdf2.hash("secret")) == (True, True)
+    assert hasher.verify("secret", hashlib.sha256(b"secret").hexdigest()) == (True, True)
+    assert hasher.verify("wrong", hashlib.sha256(b"secret").hexdigest()) == (False, False)
+
+
+def test_dummy_hash_matches_nothing_at_configured_cost(passwords):
+    hasher = passwords.PasswordHasher('scrypt', scrypt_params=(16, 1, 1), workers=0)
+
+    assert passwords.decode(hasher.dummy_hash)[:2] == ('scrypt', (16, 1, 1))
+    assert hasher.verify("", hasher.dummy_hash) == (False, False)
+
+
+def test_broken_pool_is_shut_down_and_replaced(passwords):
+    class BrokenPool:
+        shut_down = False
+
+        def submit(self, *args):
+            future = Future()
+            future.set_exception(BrokenProcessPool("a hashing process died"))
+            return future
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.shut_down = True
+
+    hasher = passwords.PasswordHasher('scrypt', scrypt_params=(16, 1, 1), workers=1)
+    broken = hasher._executor = BrokenPool()
+    hasher._executor_pid = os.getpid()
+
+    with pytest.raises(BrokenProcessPool):
+        hasher.hash("secret")
+
+    assert broken.shut_down
+    assert hasher._executor is None
+
+
+def test_login_rehashes_legacy_password(auth):
+    client = auth.app.test_client()
+    legacy = hashlib.sha256(b"secret").hexdigest()
+    auth.users_collection.insert_one({"username": "klea", "password": legacy})
+
+    assert client.post('/login', json={"username": "klea", "password": "secret"}).status_code == 200
+    rehashed = auth.users_collection.find_one({"username": "klea"})['password']
+    assert rehashed.startswith('scrypt$16$1$1$')
+
+    assert client.post('/login', json={"username": "klea", "password": "secret"}).status_code == 200
+    assert auth.users_collection.find_one({"username": "klea"})['password'] == rehashed
+
+
+def test_failed_login_keeps_stored_hash(auth):
+    legacy = hashlib.sha256(b"secret").hexdigest()
+    auth.users_collection.insert_one({"username": "klea", "password": legacy})
+
+    response = auth.app.test_client().post('/login', json={"username": "klea", "password": "wrong"})
+
+    assert response.status_code == 401
+    assert auth.users_collection.find_one({"username": "klea"})['password'] == legacy
+
+
+def test_unknown_username_still_derives_a_key(auth, monkeypatch):
+    verified = []
+    verify = auth.password_hasher.verify
+    monkeypatch.setattr(auth.password_hasher, 'verify', lambda password, encoded: verified.append(encoded) or verify(password, encoded))
+
+    response = auth.app.test_client().post('/login', json={"username": "nobody", "password": "secret"})
+
+    assert response.status_code == 401
+    assert verified == [auth.password_hasher.dummy_hash]
@@ -0,0 +1,10 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_service_copies_match_common():
+    result = subprocess.run([sys.executable, 'common/sync.py', '--check'], cwd=ROOT, capture_output=True, text=True)
+
+    assert result.returncode == 0, f"run python common/sync.py:\n{result.stdout}"
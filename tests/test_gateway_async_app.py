@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('quart')
+pytest.importorskip('httpx')
+
+ORDER = {"token": "t", "customer_id": "c1", "products": [{"product_id": "x", "quantity": 2}], "payment_method": "card"}
+
+
+@pytest.fixture
+def gateway(load):
+    return load('api_gateway', 'async_app', CONFIRM_MODE='background')
+
+
+def returning(result, delay=0, calls=None):
+    """async stand-in for a step: records its arguments, waits delay seconds, returns result"""
+    async def step(*args):
+        if calls is not None:
+            calls.append(args)
+        await asyncio.sleep(delay)
+        return result
+    return step
+
+
+def post_order(gateway, order=ORDER):
+    async def post():
+        response = await gateway.app.test_client().post('/api/create_order', json=order)
+        return response.status_code, await response.get_json()
+    return asyncio.run(post())
+
+
+def stub_order_steps(gateway, monkeypatch, payment, calls):
+    monkeypatch.setattr(gateway, 'authenticate_token', returning({"success": True, "user_id": "u1"}))
+    monkeypatch.setattr(gateway, 'validate_customer', returning({"success": True, "data": {"name": "Klea"}}))
+    monkeypatch.setattr(gateway, 'reserve_products_batch', returning({
+        "success": True, "lines": [{"reservation_id": "r1", "price": 5.0}]
+    }))
+    monkeypatch.setattr(gateway, 'process_payment', returning(payment, calls=calls.setdefault('payment', [])))
+    monkeypatch.setattr(gateway, 'cancel_reservations', returning(None, calls=calls.setdefault('cancelled', [])))
+    monkeypatch.setattr(gateway, 'create_order_record', returning({"success": True, "order_id": "o1"}, calls=calls.setdefault('recorded', [])))
+    monkeypatch.setattr(gateway.confirmations, 'submit', returning(None, calls=calls.setdefault('confirmed', [])))
+
+
+def test_create_order_succeeds(gateway, monkeypatch):
+    calls = {}
+    stub_order_steps(gateway, monkeypatch, {"success": True, "payment_id": "p1", "transaction_id": "t1"}, calls)
+
+    status, body = post_order(gateway)
+
+    assert status == 201 and body['order_confirmation']['order_id'] == "o1"
+    assert body['order_confirmation']['total_amount'] == 10.0 and body['order_confirmation']['status'] == "confirmed"
+    assert calls['payment'] == [("c1", 10.0, "card")]
+    assert calls['recorded'][0][0]['reservation_ids'] == ["r1"]
+    assert calls['confirmed'] == [(gateway.confirm_reservations, ["r1"])]
+    assert calls['cancelled'] == []
+
+
+def test_failed_payment_releases_the_reservations(gateway, monkeypatch):
+    calls = {}
+    stub_order_steps(gateway, monkeypatch, {"success": False, "error": "Payment failed"}, calls)
+
+    status, body = post_order(gateway)
+
+    assert status == 400 and body['error'] == "Payment processing failed"
+    assert calls['cancelled'] == [(["r1"], 'payment_failed')]
+    assert calls['recorded'] == [] and calls['confirmed'] == []
+
+
+def test_line_items_and_checks_fan_out_concurrently(gateway, monkeypatch):
+    calls = {}
+    stub_order_steps(gateway, monkeypatch, {"success": True, "payment_id": "p1", "transaction_id": "t1"}, calls)
+    monkeypatch.setattr(gateway, 'INVENTORY_BATCH_RESERVE', False)
+    # Every downstream call takes 0.1 s: sequentially, auth, customer and three lines of
+    # lookup, availability and reservation would take 1.1 s
+    monkeypatch.setattr(gateway, 'authenticate_token', returning({"success": True, "user_id": "u1"}, 0.1))
+    monkeypatch.setattr(gateway, 'validate_customer', returning({"success": True, "data": {"name": "Klea"}}, 0.1))
+    monkeypatch.setattr(gateway, 'get_product_details', returning({"success": True, "data": {"price": 5.0}}, 0.1))
+    monkeypatch.setattr(gateway, 'check_product_availability', returning({"success": True}, 0.1))
+    monkeypatch.setattr(gateway, 'reserve_product_stock', returning({"success": True, "reservation_id": "r"}, 0.1))
+    order = dict(ORDER, products=[{"product_id": product_id, "quantity": 1} for product_id in ("a", "b", "c")])
+
+    started = time.monotonic()
+    status, body = post_order(gateway, order)
+
+    assert status == 201 and body['order_confirmation']['total_amount'] == 15.0
+    assert time.monotonic() - started < 0.6
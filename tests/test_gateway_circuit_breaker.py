@@ -0,0 +1,116 @@
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def resilience(load):
+    return load('api_gateway', 'resilience')
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def breaker(resilience, clock, **options):
+    settings = dict(window=10, min_calls=4, failure_rate=50, slow_call_rate=75, slow_call_duration=1.0, open_duration=15.0, half_open_calls=2)
+    return resilience.CircuitBreaker('inventory_service', **dict(settings, **options), clock=clock)
+
+
+def call(breaker, duration=0.01, failed=False):
+    breaker.before_call()
+    breaker.record(duration, failed)
+
+
+def test_opens_at_the_failure_rate_once_min_calls_are_seen(resilience, clock):
+    circuit = breaker(resilience, clock)
+    for _ in range(3):
+        call(circuit, failed=True)
+    # 3 of 3 failed, but below min_calls
+    assert circuit.state == resilience.CLOSED
+
+    call(circuit, failed=True)
+    assert circuit.state == resilience.OPEN
+
+
+def test_stays_closed_below_the_failure_rate(resilience, clock):
+    circuit = breaker(resilience, clock)
+    for failed in (True, False, False, False, False, True, False, False):
+        call(circuit, failed=failed)
+
+    assert circuit.state == resilience.CLOSED and circuit.stats()['failure_rate'] == 25.0
+
+
+def test_opens_at_the_slow_call_rate(resilience, clock):
+    circuit = breaker(resilience, clock)
+    for duration in (1.0, 2.0, 0.1, 1.5):
+        call(circuit, duration=duration)
+
+    assert circuit.state == resilience.OPEN
+
+
+def test_open_breaker_rejects_until_open_duration_passes(resilience, clock):
+    circuit = breaker(resilience, clock)
+    for _ in range(4):
+        call(circuit, failed=True)
+
+    clock.now += 14.9
+    with pytest.raises(resilience.UpstreamUnavailable) as rejected:
+        circuit.before_call()
+    assert rejected.value.reason == 'circuit_open' and rejected.value.retry_after == pytest.approx(0.1)
+
+    clock.now += 0.1
+    circuit.before_call()
+    assert circuit.state == resilience.HALF_OPEN
+
+
+def test_half_open_admits_only_the_probe_calls_and_closes_when_they_succeed(resilience, clock):
+    circuit = breaker(resilience, clock)
+    for _ in range(4):
+        call(circuit, failed=True)
+    clock.now += 15
+
+    circuit.before_call()
+    circuit.before_call()
+    with pytest.raises(resilience.UpstreamUnavailable):
+        circuit.before_call()
+
+    circuit.record(0.01, False)
+    assert circuit.state == resilience.HALF_OPEN
+    circuit.record(0.01, False)
+    assert circuit.state == resilience.CLOSED and circuit.stats()['window_calls'] == 0
+
+
+@pytest.mark.parametrize('probe', [{"duration": 1.0, "failed": False}, {"duration": 0.01, "failed": True}], ids=['slow', 'failed'])
+def test_slow_or_failed_probe_reopens(resilience, clock, probe):
+    circuit = breaker(resilience, clock)
+    for _ in range(4):
+        call(circuit, failed=True)
+    clock.now += 15
+
+    circuit.before_call()
+    circuit.record(probe['duration'], probe['failed'])
+
+    assert circuit.state == resilience.OPEN and circuit.counters['opened'] == 2
+    # The open period starts again from the probe
+    clock.now += 14
+    with pytest.raises(resilience.UpstreamUnavailable):
+        circuit.before_call()
+
+
+def test_calls_started_before_opening_are_ignored(resilience, clock):
+    circuit = breaker(resilience, clock)
+    circuit.before_call()
+    for _ in range(4):
+        call(circuit, failed=True)
+
+    circuit.record(0.01, False)
+
+    assert circuit.state == resilience.OPEN
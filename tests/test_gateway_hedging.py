@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def hedging(load):
+    return load('api_gateway', 'hedging', HEDGE_WORKERS=2)
+
+
+def attempt_recording(threads, delays):
+    """An attempt that records its thread and sleeps the next of delays"""
+    delays = iter(delays)
+
+    def attempt():
+        threads.append(threading.current_thread())
+        time.sleep(next(delays))
+        return len(threads)
+
+    return attempt
+
+
+def test_fast_read_is_not_hedged(hedging):
+    policy, budget, threads = hedging.ReadPolicy('inventory_service', 'product', 1.0), hedging.HedgeBudget(), []
+
+    assert hedging.hedged(policy, budget, attempt_recording(threads, [0]), 0.5) == 1
+    assert len(threads) == 1 and budget.stats()['hedged'] == 0
+
+
+def test_slow_read_is_hedged_and_hedge_wins(hedging):
+    policy, budget, threads = hedging.ReadPolicy('inventory_service', 'product', 1.0), hedging.HedgeBudget(), []
+
+    assert hedging.hedged(policy, budget, attempt_recording(threads, [0.5, 0]), 0.02) == 2
+    assert budget.stats()['hedged'] == 1 and budget.stats()['hedge_won'] == 1
+
+
+def test_read_runs_in_caller_thread_without_budget(hedging):
+    policy, budget, threads = hedging.ReadPolicy('inventory_service', 'product', 1.0), hedging.HedgeBudget(burst=0), []
+
+    hedging.hedged(policy, budget, attempt_recording(threads, [0]), 0.01)
+
+    assert threads == [threading.current_thread()]
+
+
+def test_read_runs_in_caller_thread_when_pool_is_busy(hedging):
+    policy, budget = hedging.ReadPolicy('inventory_service', 'product', 1.0), hedging.HedgeBudget()
+    release = threading.Event()
+    busy = [hedging._try_submit(release.wait) for _ in range(hedging.HEDGE_WORKERS)]
+    threads = []
+    try:
+        assert hedging._try_submit(release.wait) is None
+        started = time.monotonic()
+        hedging.hedged(policy, budget, attempt_recording(threads, [0.05]), 0.01)
+    finally:
+        release.set()
+
+    # Ran at once, never hedged: no thread was free to hedge on
+    assert threads == [threading.current_thread()]
+    assert time.monotonic() - started < 0.5 and budget.stats()['hedged'] == 0
+    for future in busy:
+        future.result()
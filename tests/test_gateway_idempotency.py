@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from flask import Flask, jsonify
+
+
+@pytest.fixture
+def idempotency(load):
+    return load('api_gateway', 'idempotency')
+
+
+def make_app(idempotency, store, outcome):
+    """App with one idempotent route; outcome(calls) decides what the view does"""
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/orders', methods=['POST'])
+    @idempotency.idempotent(store)
+    def create():
+        calls.append(1)
+        return outcome(len(calls))
+
+    return app.test_client(), calls
+
+
+def post(client, key='key-1', body=None):
+    return client.post('/orders', json=body or {"amount": 10}, headers={'Idempotency-Key': key})
+
+
+def stores(idempotency):
+    collection = mongomock.MongoClient().db.gateway_idempotency
+    return [
+        idempotency.IdempotencyStore(max_size=10, wait_timeout=0.2),
+        idempotency.MongoIdempotencyStore(collection, wait_timeout=0.2, poll_interval=0.01)
+    ]
+
+
+@pytest.mark.parametrize('backend', [0, 1], ids=['memory', 'mongo'])
+def test_replays_completed_response(idempotency, backend):
+    client, calls = make_app(idempotency, stores(idempotency)[backend], lambda n: (jsonify({"order": n}), 201))
+
+    first = post(client)
+    second = post(client)
+
+    assert len(calls) == 1
+    assert second.status_code == 201 and second.get_json() == first.get_json() == {"order": 1}
+    assert second.headers['Idempotent-Replayed'] == 'true'
+
+
+@pytest.mark.parametrize('backend', [0, 1], ids=['memory', 'mongo'])
+def test_rejects_key_reused_with_other_body(idempotency, backend):
+    client, calls = make_app(idempotency, stores(idempotency)[backend], lambda n: (jsonify({"order": n}), 201))
+
+    post(client, body={"amount": 10})
+    assert post(client, body={"amount": 99}).status_code == 422
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('backend', [0, 1], ids=['memory', 'mongo'])
+def test_failure_before_commit_releases_key(idempotency, backend):
+    client, calls = make_app(idempotency, stores(idempotency)[backend], lambda n: (jsonify({"n": n}), 500 if n == 1 else 201))
+
+    assert post(client).status_code == 500
+    assert post(client).status_code == 201
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('backend', [0, 1], ids=['memory', 'mongo'])
+def test_failure_after_commit_is_stored(idempotency, backend):
+    def outcome(n):
+        idempotency.mark_committed()
+        return jsonify({"error": "Order creation failed"}), 500
+
+    client, calls = make_app(idempotency, stores(idempotency)[backend], outcome)
+
+    assert post(client).status_code == 500
+    replay = post(client)
+    assert replay.status_code == 500 and replay.headers['Idempotent-Replayed'] == 'true'
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('backend', [0, 1], ids=['memory', 'mongo'])
+def test_exception_after_commit_is_stored(idempotency, backend):
+    def outcome(n):
+        idempotency.mark_committed()
+        raise RuntimeError("order_service went away")
+
+    client, calls = make_app(idempotency, stores(idempotency)[backend], outcome)
+
+    assert post(client).status_code == 500
+    assert post(client).status_code == 500
+    assert len(calls) == 1
+
+
+def test_memory_store_refuses_new_keys_when_full_of_in_flight_requests(idempotency):
+    store = idempotency.IdempotencyStore(max_size=2)
+    assert store.begin('a', 'x')[0] == 'new'
+    assert store.begin('b', 'x')[0] == 'new'
+    assert store.begin('c', 'x') == ('full', None)
+
+    _, entry = store.begin('a', 'x')
+    store.complete('a', entry, (b'{}', 201, {"Content-Type": "application/json"}))
+    assert store.begin('c', 'x')[0] == 'new'
+    assert store.stats()['stored_keys'] == 2
+
+
+def test_mongo_store_is_shared_between_processes(idempotency):
+    collection = mongomock.MongoClient().db.gateway_idempotency
+    worker_a = idempotency.MongoIdempotencyStore(collection, wait_timeout=0.2, poll_interval=0.01)
+    worker_b = idempotency.MongoIdempotencyStore(collection, wait_timeout=0.2, poll_interval=0.01)
+    client_a, calls_a = make_app(idempotency, worker_a, lambda n: (jsonify({"worker": "a"}), 201))
+    client_b, calls_b = make_app(idempotency, worker_b, lambda n: (jsonify({"worker": "b"}), 201))
+
+    post(client_a)
+    replay = post(client_b)
+
+    assert (len(calls_a), len(calls_b)) == (1, 0)
+    assert replay.get_json() == {"worker": "a"}
+
+
+def test_mongo_store_takes_over_only_uncommitted_expired_leases(idempotency):
+    collection = mongomock.MongoClient().db.gateway_idempotency
+    store = idempotency.MongoIdempotencyStore(collection, lease=60)
+    expired = datetime.utcnow() - timedelta(seconds=1)
+
+    assert store.begin('crashed', 'x')[0] == 'new'
+    collection.update_one({"_id": 'crashed'}, {"$set": {"lease_until": expired}})
+    assert store.begin('crashed', 'x')[0] == 'new'
+
+    _, entry = store.begin('paid', 'x')
+    store.mark_committed('paid', entry)
+    collection.update_one({"_id": 'paid'}, {"$set": {"lease_until": expired}})
+    assert store.begin('paid', 'x')[0] == 'in_flight'
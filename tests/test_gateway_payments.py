@@ -0,0 +1,109 @@
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body or {}
+
+    def json(self):
+        return self._body
+
+
+def finished(status_code, status):
+    return FakeResponse(status_code, {"success": status == "completed", "payment_id": "p1", "transaction_id": "t1", "status": status})
+
+
+@pytest.fixture
+def gateway(load, monkeypatch):
+    app = load('api_gateway')
+    monkeypatch.setattr(app, 'PAYMENT_WAIT_TIMEOUT', 0)
+    monkeypatch.setattr(app, 'PAYMENT_SETTLE_TIMEOUT', 0)
+    return app
+
+
+def script(monkeypatch, gateway, waits, cancel):
+    """payment_service answering 202 to the charge, then the given /wait answers and cancel answer"""
+    calls = []
+    waits = list(waits)
+
+    def request(method, path, **kwargs):
+        calls.append((method, path))
+        if path == '/payments/process':
+            return FakeResponse(202, {"payment_id": "p1", "status": "pending"})
+        if path.endswith('/cancel'):
+            return cancel
+        answer = waits.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(gateway.payment_service, 'request', request)
+    return calls
+
+
+def test_waits_for_payment_a_worker_is_already_charging(gateway, monkeypatch):
+    calls = script(monkeypatch, gateway, [finished(202, "processing"), finished(200, "completed")],
+                   FakeResponse(409, {"error": "Payment is already processing", "status": "processing"}))
+
+    result = gateway.process_payment("c1", 10.0, "card")
+
+    assert result['success'] and result['payment_id'] == "p1"
+    assert ('POST', '/payments/p1/cancel') in calls
+
+
+def test_unsettled_payment_is_pending_not_failed(gateway, monkeypatch):
+    script(monkeypatch, gateway, [finished(202, "processing"), finished(202, "processing")],
+           FakeResponse(409, {"status": "processing"}))
+
+    result = gateway.process_payment("c1", 10.0, "card")
+
+    assert result == {"success": False, "pending": True, "payment_id": "p1", "error": "Payment is still being processed"}
+
+
+def test_poll_error_after_acceptance_is_pending(gateway, monkeypatch):
+    script(monkeypatch, gateway, [ConnectionError("payment_service went away")], None)
+
+    result = gateway.process_payment("c1", 10.0, "card")
+
+    assert result['pending'] and result['payment_id'] == "p1"
+
+
+def test_payment_cancelled_before_processing_fails(gateway, monkeypatch):
+    script(monkeypatch, gateway, [finished(202, "pending")], finished(400, "cancelled"))
+
+    result = gateway.process_payment("c1", 10.0, "card")
+
+    assert not result['success'] and 'pending' not in result
+
+
+def test_create_order_keeps_reservations_while_payment_is_unsettled(gateway, monkeypatch):
+    recorded = []
+    cancelled = []
+    monkeypatch.setattr(gateway, 'authenticate_token', lambda token: {"success": True, "user_id": "u1"})
+    monkeypatch.setattr(gateway, 'validate_customer', lambda customer_id: {"success": True, "data": {"name": "Klea"}})
+    monkeypatch.setattr(gateway, 'reserve_products_batch', lambda products, customer_id: {
+        "success": True, "lines": [{"reservation_id": "r1", "price": 5.0}]
+    })
+    monkeypatch.setattr(gateway, 'process_payment', lambda *args: gateway.unsettled_payment("p1", "Payment is still being processed"))
+    monkeypatch.setattr(gateway, 'cancel_reservations', lambda ids, reason: cancelled.append(ids))
+    monkeypatch.setattr(gateway, 'create_order_record', lambda order: recorded.append(order) or {"success": True, "order_id": "o1"})
+    monkeypatch.setattr(gateway.confirmations, 'submit', lambda *args: pytest.fail("payment_pending orders must not be confirmed"))
+
+    response = gateway.app.test_client().post('/api/create_order', json={
+        "token": "t", "customer_id": "c1", "products": [{"product_id": "x", "quantity": 2}], "payment_method": "card"
+    })
+
+    assert response.status_code == 202
+    assert response.get_json()['order_confirmation']['status'] == "payment_pending"
+    assert recorded[0]['status'] == "payment_pending" and recorded[0]['payment_id'] == "p1"
+    assert cancelled == []
+
+
+def test_unknown_payment_outcome_is_pending(gateway, monkeypatch):
+    calls = script(monkeypatch, gateway, [finished(202, "unknown")], None)
+
+    result = gateway.process_payment("c1", 10.0, "card")
+
+    assert result['pending'] and result['payment_id'] == "p1"
+    assert ('POST', '/payments/p1/cancel') not in calls
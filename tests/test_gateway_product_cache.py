@@ -0,0 +1,89 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def product_cache(load):
+    return load('api_gateway', 'product_cache')
+
+
+def workers(product_cache, directory, count=2, check_interval=0):
+    return [product_cache.ProductCache(ttl=30, shared_dir=str(directory), check_interval=check_interval) for _ in range(count)]
+
+
+def test_invalidation_reaches_every_worker(product_cache, tmp_path):
+    first, second = workers(product_cache, tmp_path)
+    for cache in (first, second):
+        cache.put('p1', {"price": 5.0})
+        cache.put('p2', {"price": 7.0})
+
+    first.invalidate('p1')
+
+    assert second.get('p1') is None and first.get('p1') is None
+    assert second.get('p2') == {"price": 7.0}
+
+
+def test_entry_cached_after_the_invalidation_is_served(product_cache, tmp_path):
+    first, second = workers(product_cache, tmp_path)
+    first.invalidate('p1')
+
+    second.put('p1', {"price": 6.0})
+
+    assert second.get('p1') == {"price": 6.0}
+
+
+@pytest.mark.parametrize('product_id', [None, '../p1'])
+def test_invalidating_everything_reaches_every_worker(product_cache, tmp_path, product_id):
+    first, second = workers(product_cache, tmp_path)
+    second.put('p1', {"price": 5.0})
+
+    first.invalidate(product_id)
+
+    assert second.get('p1') is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == [product_cache.ALL_PRODUCTS]
+
+
+def test_without_shared_dir_invalidation_stays_in_the_worker(product_cache):
+    first, second = product_cache.ProductCache(ttl=30), product_cache.ProductCache(ttl=30)
+    second.put('p1', {"price": 5.0})
+
+    first.invalidate('p1')
+
+    assert second.get('p1') == {"price": 5.0}
+
+
+def test_markers_are_checked_at_most_once_per_interval(product_cache, tmp_path):
+    first, second = workers(product_cache, tmp_path, check_interval=60)
+    second.put('p1', {"price": 5.0})
+
+    with mock.patch.object(product_cache.os, 'stat', wraps=product_cache.os.stat) as stat:
+        for _ in range(10):
+            assert second.get('p1') == {"price": 5.0}
+    assert stat.call_count == 0
+
+    first.invalidate('p1')
+    second._entries['p1'][3] -= 60
+    assert second.get('p1') is None
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_read_that_started_before_an_invalidation_is_not_cached(product_cache, tmp_path, shared):
+    first, second = workers(product_cache, tmp_path) if shared else [product_cache.ProductCache(ttl=30)] * 2
+    read = second.begin_read()
+
+    # The product changes while second is still reading the old version
+    first.invalidate('p1')
+    second.put('p1', {"price": 5.0}, read)
+
+    assert second.get('p1') is None and second.stats()['skipped_puts'] == 1
+
+
+@pytest.mark.parametrize('headers, remote_addr, token, allowed', [
+    ({}, '127.0.0.1', '', True),
+    ({}, '10.0.0.7', '', False),
+    ({"X-Invalidation-Token": "s3cret"}, '10.0.0.7', 's3cret', True),
+    ({"X-Invalidation-Token": "wrong"}, '127.0.0.1', 's3cret', False),
+])
+def test_invalidation_needs_the_token_or_a_local_caller(product_cache, headers, remote_addr, token, allowed):
+    assert product_cache.invalidation_allowed(headers, remote_addr, token) is allowed
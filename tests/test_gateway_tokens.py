@@ -0,0 +1,85 @@
+import time
+
+import jwt
+import pytest
+
+SECRET = 'gateway-test-secret'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def tokens(load):
+    return load('api_gateway', 'tokens')
+
+
+def token(secret=SECRET, **claims):
+    return jwt.encode(dict({"user_id": "u1", "username": "klea"}, **claims), secret, algorithm='HS256')
+
+
+def test_valid_token_is_verified_once_then_served_from_cache(tokens):
+    verifier = tokens.TokenVerifier([SECRET])
+    valid = token(exp=int(time.time()) + 60)
+
+    assert verifier.verify(valid)['user_id'] == "u1"
+    assert verifier.verify(valid)['username'] == "klea"
+    assert verifier.stats()['misses'] == 1 and verifier.stats()['hits'] == 1
+
+
+def test_expired_token_is_rejected(tokens):
+    verifier = tokens.TokenVerifier([SECRET])
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.verify(token(exp=int(time.time()) - 10))
+    assert verifier.stats()['cached_tokens'] == 0
+
+
+def test_cached_claims_are_not_served_past_the_tokens_exp(tokens):
+    now = [time.time()]
+    verifier = tokens.TokenVerifier([SECRET], clock=lambda: now[0])
+    valid = token(exp=int(now[0]) + 30)
+    verifier.verify(valid)
+
+    now[0] += 31
+    verifier.verify(valid)
+
+    # Decoded again (here still valid by the real clock) instead of served from the cache
+    assert verifier.stats()['hits'] == 0 and verifier.stats()['misses'] == 2
+
+
+def test_token_without_exp_is_cached_for_at_most_max_ttl(tokens):
+    now = [time.time()]
+    verifier = tokens.TokenVerifier([SECRET], max_ttl=60, clock=lambda: now[0])
+    forever = token()
+    verifier.verify(forever)
+
+    now[0] += 59
+    verifier.verify(forever)
+    now[0] += 2
+    verifier.verify(forever)
+
+    assert verifier.stats()['hits'] == 1 and verifier.stats()['misses'] == 2
+
+
+def test_bad_signature_falls_back_to_auth_service(load, monkeypatch):
+    gateway = load('api_gateway', JWT_SECRET=SECRET, AUTH_VERIFY_MODE='local_then_remote')
+    calls = []
+
+    def verify_remotely(path, **kwargs):
+        calls.append((path, kwargs['json']))
+        return FakeResponse(200, {"user_id": "u2", "username": "remote"})
+
+    monkeypatch.setattr(gateway.auth_service, 'post', verify_remotely)
+    foreign = token(secret='another-secret')
+
+    assert gateway.authenticate_token(foreign) == {"success": True, "user_id": "u2", "username": "remote"}
+    assert calls == [("/verify", {"token": foreign})]
+    # A locally valid token never reaches auth_service
+    assert gateway.authenticate_token(token())['user_id'] == "u1" and len(calls) == 1
@@ -0,0 +1,57 @@
+import os
+import re
+
+import pytest
+from flask import Flask, jsonify
+
+
+class FakeSession:
+    def __init__(self):
+        self.urls = []
+
+    def request(self, method, url, **kwargs):
+        self.urls.append(url)
+        return jsonify({"valid": True})
+
+
+@pytest.fixture
+def tracing(load):
+    return load('api_gateway', 'tracing')
+
+
+def make_app(tracing, hop):
+    app = Flask(__name__)
+    tracing.init_tracing(app)
+
+    @app.route('/hop')
+    def view():
+        hop()
+        return jsonify({}), 200
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize('customer_id', ['c1\nSet-Cookie: x=1', 'c1";dur=0, evil;desc="', 'c1\\', 'klé'])
+def test_server_timing_survives_any_path(tracing, customer_id):
+    client = make_app(tracing, lambda: tracing.current_trace.get().record('customer_service', 'GET', f'/customers/{customer_id}/validate', 0.003))
+
+    response = client.get('/hop')
+
+    assert response.status_code == 200
+    header = response.headers['Server-Timing']
+    assert header.isprintable() and header.isascii()
+    # One hop whose desc is a single quoted-string, then the total
+    assert re.fullmatch(r'customer_service;desc="GET /customers/(?:[^"\\]|\\.)*/validate";dur=3\.0, total;dur=[0-9.]+', header)
+
+
+def test_reads_report_their_endpoint_template(tracing):
+    import upstream
+
+    service = upstream.UpstreamClient('customer_service', 'http://customers')
+    service._session, service._pid = FakeSession(), os.getpid()
+    client = make_app(tracing, lambda: service.read('/customers/<customer_id>/validate', '/customers/c1"\n/validate'))
+
+    header = client.get('/hop').headers['Server-Timing']
+
+    assert header.startswith('customer_service;desc="GET /customers/<customer_id>/validate";dur=')
+    assert service._session.urls == ['http://customers/customers/c1"\n/validate']
@@ -0,0 +1,107 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def inventory(load):
+    return load('inventory_service')
+
+
+def create_products(client, *stocks):
+    return [
+        client.post('/products', json={"name": f"P{n}", "price": 2.5, "stock_quantity": stock}).get_json()['product_id']
+        for n, stock in enumerate(stocks)
+    ]
+
+
+def reserve_batch(client, items):
+    return client.post('/reservations/batch', json={"customer_id": "c1", "items": items})
+
+
+def available(inventory, product_id):
+    return inventory.products_collection.find_one({"_id": inventory.ObjectId(product_id)})['available_quantity']
+
+
+def test_reserves_every_line(inventory):
+    client = inventory.app.test_client()
+    first, second = create_products(client, 5, 5)
+
+    response = reserve_batch(client, [{"product_id": first, "quantity": 2}, {"product_id": second, "quantity": 5}, {"product_id": first, "quantity": 1}])
+
+    assert response.status_code == 200
+    assert [line['quantity'] for line in response.get_json()['reservations']] == [2, 5, 1]
+    assert (available(inventory, first), available(inventory, second)) == (2, 0)
+    assert inventory.reservations_collection.count_documents({"status": "reserved"}) == 3
+
+
+def after_pricing(inventory, change):
+    """Run change() between the batch's pricing read and its stock updates, as a concurrent request would"""
+    remember = inventory.remember_shard_count
+    return mock.patch.object(inventory, 'remember_shard_count', lambda *args: (change(), remember(*args)))
+
+
+def test_short_line_releases_the_earlier_lines(inventory):
+    client = inventory.app.test_client()
+    first, second = create_products(client, 5, 5)
+    # Another request takes all but one unit of the second product
+    take = lambda: inventory.products_collection.update_one(
+        {"_id": inventory.ObjectId(second)}, {"$set": {"available_quantity": 1, "reserved_quantity": 4}}
+    )
+
+    with after_pricing(inventory, take):
+        response = reserve_batch(client, [{"product_id": first, "quantity": 2}, {"product_id": second, "quantity": 2}])
+
+    assert response.status_code == 400
+    assert response.get_json()['product_id'] == second
+    assert (available(inventory, first), available(inventory, second)) == (5, 1)
+    assert inventory.reservations_collection.count_documents({}) == 0
+
+
+def test_product_gone_after_pricing_is_404_without_a_phantom_product(inventory):
+    client = inventory.app.test_client()
+    existing, gone = create_products(client, 5, 5)
+    delete = lambda: inventory.products_collection.delete_one({"_id": inventory.ObjectId(gone)})
+
+    with after_pricing(inventory, delete):
+        response = reserve_batch(client, [{"product_id": existing, "quantity": 1}, {"product_id": gone, "quantity": 1}])
+
+    assert response.status_code == 404
+    assert inventory.products_collection.count_documents({}) == 1
+    assert available(inventory, existing) == 5
+
+
+@pytest.mark.parametrize('items', [
+    lambda product_id: [{"product_id": product_id}],
+    lambda product_id: [{"product_id": product_id, "quantity": "2"}],
+    lambda product_id: [{"product_id": product_id, "quantity": 0}],
+    lambda product_id: [{"product_id": product_id, "quantity": True}],
+    lambda product_id: [{"product_id": 12, "quantity": 1}],
+    lambda product_id: [product_id],
+    lambda product_id: {"product_id": product_id, "quantity": 1}
+], ids=['missing quantity', 'string quantity', 'zero quantity', 'bool quantity', 'numeric id', 'item not an object', 'items not a list'])
+def test_malformed_items_are_400(inventory, items):
+    client = inventory.app.test_client()
+    (product_id,) = create_products(client, 5)
+
+    response = reserve_batch(client, items(product_id))
+
+    assert response.status_code == 400
+    assert available(inventory, product_id) == 5
+
+
+@pytest.mark.parametrize('products', [
+    {"product_id": "p1", "quantity": 1},
+    [{"product_id": "p1"}],
+    [{"product_id": "p1", "quantity": -1}],
+    [{"quantity": 1}]
+])
+def test_gateway_rejects_malformed_products(load, products):
+    gateway = load('api_gateway')
+
+    response = gateway.app.test_client().post('/api/create_order', json={
+        "token": "t", "customer_id": "c1", "products": products, "payment_method": "card"
+    })
+
+    assert response.status_code == 400
+    assert not response.get_json()['success']
@@ -0,0 +1,103 @@
+import threading
+from unittest import mock
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+
+@pytest.fixture
+def inventory(load):
+    return load('inventory_service', RESERVE_GROUP_COMMIT='true', RESERVE_BATCH_WINDOW_MS=1)
+
+
+@pytest.fixture
+def writer(inventory):
+    import group_commit
+    return group_commit.GroupCommitWriter(inventory.products_collection, inventory.reservations_collection, window=0.05, max_size=64)
+
+
+def create_product(inventory, stock):
+    response = inventory.app.test_client().post('/products', json={"name": "P", "price": 1.0, "stock_quantity": stock})
+    return inventory.ObjectId(response.get_json()['product_id'])
+
+
+def counters(inventory, product_id):
+    product = inventory.products_collection.find_one({"_id": product_id})
+    return product['stock_quantity'], product['reserved_quantity'], product['available_quantity']
+
+
+def reserve_together(writer, requests):
+    """Reserve every (product_id, quantity) from its own thread, in one batch; returns the results in order"""
+    results = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def reserve(index, product_id, quantity):
+        start.wait()
+        try:
+            results[index] = writer.reserve(product_id, quantity, "c1")
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=reserve, args=(index, *request)) for index, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_guard_failures_answer_like_the_single_path(inventory):
+    client = inventory.app.test_client()
+    product_id = str(create_product(inventory, 3))
+
+    assert client.post(f'/products/{product_id}/reserve', json={"quantity": 4, "customer_id": "c1"}).status_code == 400
+    assert client.post(f'/products/{inventory.ObjectId()}/reserve', json={"quantity": 1, "customer_id": "c1"}).status_code == 404
+    assert client.post(f'/products/{product_id}/reserve', json={"quantity": 3, "customer_id": "c1"}).status_code == 200
+
+
+def test_product_deleted_mid_batch_is_not_recreated(inventory, writer):
+    kept, deleted = create_product(inventory, 10), create_product(inventory, 10)
+    take = writer._take
+
+    def delete_then_take(product_id, quantity, now):
+        if product_id == deleted:
+            inventory.products_collection.delete_one({"_id": deleted})
+        return take(product_id, quantity, now)
+
+    with mock.patch.object(writer, '_take', side_effect=delete_then_take):
+        results = reserve_together(writer, [(kept, 2), (deleted, 2)])
+
+    assert isinstance(results[0], inventory.ObjectId) and results[1] is None
+    assert inventory.products_collection.find_one({"_id": deleted}) is None
+    assert inventory.reservations_collection.count_documents({"product_id": deleted}) == 0
+
+
+def test_concurrent_reserves_never_oversell(inventory, writer):
+    product_id = create_product(inventory, 15)
+
+    results = reserve_together(writer, [(product_id, 1)] * 20 + [(product_id, 3)])
+
+    reserved = [result for result in results if result is not None]
+    assert all(isinstance(result, inventory.ObjectId) for result in reserved)
+    stock, reserved_quantity, available = counters(inventory, product_id)
+    assert stock == 15 and reserved_quantity + available == stock and available >= 0
+    assert reserved_quantity == sum(
+        reservation['quantity'] for reservation in inventory.reservations_collection.find({"product_id": product_id})
+    )
+
+
+def test_partial_insert_failure_releases_the_rest(inventory, writer):
+    product_id = create_product(inventory, 10)
+    insert_many = inventory.reservations_collection.insert_many
+
+    def insert_first(documents, ordered=True):
+        insert_many(documents[:1])
+        raise BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 1, "code": 1, "errmsg": "write failed"}]})
+
+    with mock.patch.object(inventory.reservations_collection, 'insert_many', side_effect=insert_first):
+        results = reserve_together(writer, [(product_id, 2), (product_id, 3), (product_id, 4)])
+
+    assert sum(isinstance(result, inventory.ObjectId) for result in results) == 1
+    assert sum(isinstance(result, RuntimeError) for result in results) == 2
+    quantity = inventory.reservations_collection.find_one({"product_id": product_id})['quantity']
+    assert counters(inventory, product_id) == (10, quantity, 10 - quantity)
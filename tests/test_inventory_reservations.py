@@ -0,0 +1,78 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def inventory(load):
+    return load('inventory_service')
+
+
+def create_product(client, stock):
+    return client.post('/products', json={"name": "P", "price": 1.0, "stock_quantity": stock}).get_json()['product_id']
+
+
+def reserve(client, product_id, quantity, customer_id="c1"):
+    return client.post(f'/products/{product_id}/reserve', json={"quantity": quantity, "customer_id": customer_id})
+
+
+def counters(inventory, product_id):
+    product = inventory.products_collection.find_one({"_id": inventory.ObjectId(product_id)})
+    return product['stock_quantity'], product['reserved_quantity'], product['available_quantity']
+
+
+def test_reservation_never_oversells(inventory):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+
+    assert reserve(client, product_id, 6).status_code == 200
+    short = reserve(client, product_id, 6)
+
+    assert short.status_code == 400
+    assert short.get_json()['available_quantity'] == 4 and short.get_json()['requested_quantity'] == 6
+    assert counters(inventory, product_id) == (10, 6, 4)
+    assert inventory.reservations_collection.count_documents({}) == 1
+
+
+def test_failed_reservation_insert_gives_the_stock_back(inventory):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+
+    with mock.patch.object(inventory.reservations_collection, 'insert_one', side_effect=RuntimeError("write failed")):
+        assert reserve(client, product_id, 4).status_code == 500
+
+    assert counters(inventory, product_id) == (10, 0, 10)
+
+
+@pytest.mark.parametrize('body, status', [
+    ({"quantity": 0, "customer_id": "c1"}, 400),
+    ({"quantity": -2, "customer_id": "c1"}, 400),
+    ({"quantity": 1}, 400)
+])
+def test_invalid_reservation_requests_change_nothing(inventory, body, status):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+
+    assert client.post(f'/products/{product_id}/reserve', json=body).status_code == status
+    assert counters(inventory, product_id) == (10, 0, 10)
+
+
+def test_unknown_product_is_404(inventory):
+    client = inventory.app.test_client()
+
+    assert reserve(client, str(inventory.ObjectId()), 1).status_code == 404
+    assert reserve(client, 'not-an-id', 1).status_code == 400
+
+
+@pytest.mark.parametrize('first, second', [('confirm', 'cancel'), ('cancel', 'confirm')])
+def test_settled_reservation_cannot_be_settled_the_other_way(inventory, first, second):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+    reservation_id = reserve(client, product_id, 3).get_json()['reservation_id']
+
+    assert client.post(f'/reservations/{reservation_id}/{first}').status_code == 200
+    settled = counters(inventory, product_id)
+
+    assert client.post(f'/reservations/{reservation_id}/{second}').status_code == 400
+    assert counters(inventory, product_id) == settled
+    assert settled == ((7, 0, 7) if first == 'confirm' else (10, 0, 10))
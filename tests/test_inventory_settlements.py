@@ -0,0 +1,124 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def inventory(load):
+    return load('inventory_service')
+
+
+def setup(inventory, stock=10, quantities=(2, 3)):
+    client = inventory.app.test_client()
+    product_id = client.post('/products', json={"name": "P", "price": 1.0, "stock_quantity": stock}).get_json()['product_id']
+    reservation_ids = [
+        client.post(f'/products/{product_id}/reserve', json={"quantity": quantity, "customer_id": "c1"}).get_json()['reservation_id']
+        for quantity in quantities
+    ]
+    return client, inventory.ObjectId(product_id), reservation_ids
+
+
+def counters(inventory, product_id):
+    product = inventory.products_collection.find_one({"_id": product_id})
+    return product['stock_quantity'], product['reserved_quantity'], product['available_quantity']
+
+
+def reap(inventory):
+    import settlements
+    return settlements.finish_settlements(
+        inventory.products_collection, inventory.stock_shards_collection, inventory.reservations_collection, min_age=0
+    )
+
+
+def test_batch_confirm_applies_stock_once(inventory):
+    client, product_id, reservation_ids = setup(inventory)
+
+    response = client.post('/reservations/confirm_batch', json={"reservation_ids": reservation_ids})
+    retry = client.post('/reservations/confirm_batch', json={"reservation_ids": reservation_ids})
+
+    assert sorted(response.get_json()['settled']) == sorted(reservation_ids)
+    assert sorted(retry.get_json()['skipped']) == sorted(reservation_ids)
+    assert counters(inventory, product_id) == (5, 0, 5)
+    assert reap(inventory) == 0
+
+
+def test_claim_left_unapplied_by_a_crash_is_finished_by_the_reaper(inventory):
+    client, product_id, reservation_ids = setup(inventory)
+
+    # The process dies after the claim, before the stock update
+    with mock.patch.object(inventory, 'apply_settlement', return_value=[]):
+        assert client.post('/reservations/cancel_batch', json={"reservation_ids": reservation_ids}).status_code == 200
+    assert counters(inventory, product_id) == (10, 5, 5)
+    assert client.post('/reservations/cancel_batch', json={"reservation_ids": reservation_ids}).get_json()['settled'] == []
+
+    assert reap(inventory) == 1
+    assert counters(inventory, product_id) == (10, 0, 10)
+    assert reap(inventory) == 0
+
+
+def test_batch_that_failed_before_marking_is_applied_once_by_the_reaper(inventory):
+    client, product_id, reservation_ids = setup(inventory)
+    reservations = inventory.reservations_collection
+    update_many = reservations.update_many
+
+    def crash_when_marking(query, update, *args, **kwargs):
+        if update.get("$set", {}).get("stock_applied") is True:
+            raise RuntimeError("process died")
+        return update_many(query, update, *args, **kwargs)
+
+    with mock.patch.object(reservations, 'update_many', crash_when_marking):
+        assert client.post('/reservations/confirm_batch', json={"reservation_ids": reservation_ids}).status_code == 500
+    assert counters(inventory, product_id) == (10, 5, 5)
+
+    assert reap(inventory) == 1
+    assert counters(inventory, product_id) == (5, 0, 5)
+    assert all(reservation['stock_applied'] for reservation in reservations.find({}))
+    assert reap(inventory) == 0
+    assert counters(inventory, product_id) == (5, 0, 5)
+
+
+def test_reaper_does_not_apply_a_marked_batch_again(inventory):
+    client, product_id, reservation_ids = setup(inventory)
+
+    # The process dies after marking the reservations, before the stock update
+    with mock.patch.object(inventory.products_collection, 'bulk_write', side_effect=RuntimeError("process died")):
+        assert client.post('/reservations/confirm_batch', json={"reservation_ids": reservation_ids}).status_code == 500
+
+    # At most once: the units stay reserved rather than risk being released twice
+    assert reap(inventory) == 0
+    assert counters(inventory, product_id) == (10, 5, 5)
+
+
+def test_settlement_leaves_products_with_only_their_counters(inventory):
+    client, product_id, reservation_ids = setup(inventory)
+    before = inventory.products_collection.find_one({"_id": product_id})
+
+    client.post(f'/reservations/{reservation_ids[0]}/confirm')
+    client.post('/reservations/cancel_batch', json={"reservation_ids": reservation_ids[1:]})
+
+    assert set(inventory.products_collection.find_one({"_id": product_id})) == set(before)
+
+
+def test_reaper_waits_for_settle_reap_age(inventory):
+    import settlements
+    client, product_id, reservation_ids = setup(inventory)
+    with mock.patch.object(inventory, 'apply_settlement', return_value=[]):
+        client.post('/reservations/confirm_batch', json={"reservation_ids": reservation_ids})
+
+    assert settlements.finish_settlements(
+        inventory.products_collection, inventory.stock_shards_collection, inventory.reservations_collection, min_age=60
+    ) == 0
+    assert counters(inventory, product_id) == (10, 5, 5)
+
+
+@pytest.mark.parametrize('action, expected', [('confirm', (8, 3, 5)), ('cancel', (10, 3, 7))])
+def test_single_settlement(inventory, action, expected):
+    client, product_id, reservation_ids = setup(inventory)
+
+    response = client.post(f'/reservations/{reservation_ids[0]}/{action}')
+    again = client.post(f'/reservations/{reservation_ids[0]}/{action}')
+
+    assert response.status_code == 200 and response.get_json()['quantity'] == 2
+    assert again.status_code == 400
+    assert counters(inventory, product_id) == expected
+    assert client.post(f'/reservations/{inventory.ObjectId()}/{action}').status_code == 404
@@ -0,0 +1,109 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def inventory(load):
+    return load('inventory_service')
+
+
+def create_product(client, stock):
+    return client.post('/products', json={"name": "Hot", "price": 5.0, "stock_quantity": stock}).get_json()['product_id']
+
+
+def reserve(client, product_id, quantity):
+    return client.post(f'/products/{product_id}/reserve', json={"quantity": quantity, "customer_id": "c1"})
+
+
+def available(client, product_id):
+    return client.get(f'/products/{product_id}/availability').get_json()['available_quantity']
+
+
+@pytest.mark.parametrize('cancel', ['single', 'batch'])
+def test_cancelled_pre_split_reservation_can_be_reserved_again(inventory, cancel):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+    reservation_id = reserve(client, product_id, 4).get_json()['reservation_id']
+    assert client.post(f'/products/{product_id}/shards', json={"shards": 2}).status_code == 200
+
+    if cancel == 'single':
+        assert client.post(f'/reservations/{reservation_id}/cancel').status_code == 200
+    else:
+        assert client.post('/reservations/cancel_batch', json={"reservation_ids": [reservation_id]}).status_code == 200
+
+    assert available(client, product_id) == 10
+    assert reserve(client, product_id, 7).status_code == 200
+    assert available(client, product_id) == 3
+
+
+def test_growing_shards_sweeps_product_document_stock(inventory):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+    client.post(f'/products/{product_id}/shards', json={"shards": 2})
+    # Stock given back to the document by a path that does not sweep, e.g. a group commit release
+    inventory.products_collection.update_one({"_id": inventory.ObjectId(product_id)}, {"$inc": {"stock_quantity": 3, "available_quantity": 3}})
+
+    client.post(f'/products/{product_id}/shards', json={"shards": 4})
+
+    shards = client.get(f'/products/{product_id}/shards').get_json()
+    assert shards['product_document']['available_quantity'] == 0
+    assert sum(shard['available_quantity'] for shard in shards['shards']) == 13
+
+
+def test_transfer_left_by_a_crash_is_finished_by_the_next_sweep(inventory):
+    import stock_shards
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+
+    # The process dies after taking the stock off the product document
+    with mock.patch.object(stock_shards, 'apply_transfer'):
+        client.post(f'/products/{product_id}/shards', json={"shards": 2})
+    assert available(client, product_id) == 0
+
+    stock_shards.sweep_product_stock(inventory.products_collection, inventory.stock_shards_collection, inventory.ObjectId(product_id))
+    stock_shards.sweep_product_stock(inventory.products_collection, inventory.stock_shards_collection, inventory.ObjectId(product_id))
+
+    assert available(client, product_id) == 10
+    product = inventory.products_collection.find_one({"_id": inventory.ObjectId(product_id)})
+    assert 'stock_transfer' not in product and product['stock_quantity'] == 0
+
+
+def test_move_left_by_a_crash_is_finished_by_a_later_sweep(inventory):
+    import stock_shards
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+    client.post(f'/products/{product_id}/shards', json={"shards": 2})
+    sweep = lambda: stock_shards.sweep_product_stock(inventory.products_collection, inventory.stock_shards_collection, inventory.ObjectId(product_id))
+
+    # The process dies after taking the stock off the source shard
+    with mock.patch.object(stock_shards, 'finish_move'):
+        assert stock_shards.move(inventory.stock_shards_collection, inventory.ObjectId(product_id), 0, 1, 3)
+    assert available(client, product_id) == 7
+
+    # Too recent: the process that made it may still be finishing it
+    sweep()
+    assert available(client, product_id) == 7
+
+    with mock.patch.object(stock_shards, 'STOCK_MOVE_RECOVERY_SECONDS', -1):
+        sweep()
+        sweep()
+
+    assert available(client, product_id) == 10
+    shards = list(inventory.stock_shards_collection.find({}).sort("shard", 1))
+    assert [shard['available_quantity'] for shard in shards] == [2, 8]
+    assert not any(shard.get('moves') or shard.get('transfers') for shard in shards)
+
+
+def test_reserving_a_sharded_product_deleted_meanwhile_is_not_found(inventory):
+    client = inventory.app.test_client()
+    product_id = create_product(client, 10)
+    client.post(f'/products/{product_id}/shards', json={"shards": 2})
+    assert reserve(client, product_id, 1).status_code == 200
+
+    # Deleted after its shard count was cached
+    inventory.products_collection.delete_one({"_id": inventory.ObjectId(product_id)})
+
+    response = reserve(client, product_id, 50)
+    assert response.status_code == 404
+    assert response.get_json()['error'] == "Product not found"
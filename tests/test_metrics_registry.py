@@ -0,0 +1,66 @@
+import multiprocessing
+
+import pytest
+
+
+@pytest.fixture
+def metrics_registry(load):
+    return load('api_gateway', 'metrics_registry')
+
+
+def build(metrics_registry, directory):
+    registry = metrics_registry.Registry(directory=str(directory))
+    metrics = (
+        registry.counter('requests_total', "Requests", ('status',)),
+        registry.gauge('in_flight', "In flight"),
+        registry.gauge('state', "State", merge='max'),
+        registry.histogram('duration_seconds', "Duration", buckets=(0.1, 1.0))
+    )
+    return registry, metrics
+
+
+def worker(metrics_registry, directory, written, release):
+    registry, (requests, in_flight, state, duration) = build(metrics_registry, directory)
+    requests.inc(200, amount=2)
+    in_flight.set(3)
+    state.set(2)
+    duration.observe(0.5)
+    registry.write()
+    written.set()
+    release.wait()
+
+
+def test_render_merges_every_worker(metrics_registry, tmp_path):
+    context = multiprocessing.get_context('fork')
+    written, release = context.Event(), context.Event()
+    other = context.Process(target=worker, args=(metrics_registry, tmp_path, written, release))
+    other.start()
+    written.wait()
+
+    registry, (requests, in_flight, state, duration) = build(metrics_registry, tmp_path)
+    requests.inc(200)
+    requests.inc(500)
+    in_flight.set(1)
+    state.set(0)
+    duration.observe(0.05)
+
+    lines = registry.render().splitlines()
+    assert 'requests_total{status="200"} 3' in lines and 'requests_total{status="500"} 1' in lines
+    assert 'in_flight 4' in lines and 'state 2' in lines
+    assert 'duration_seconds_bucket{le="0.1"} 1' in lines and 'duration_seconds_bucket{le="1.0"} 2' in lines
+    assert 'duration_seconds_count 2' in lines
+
+    # An exited worker's counts stay in the totals, its gauges do not
+    release.set()
+    other.join()
+    lines = registry.render().splitlines()
+    assert 'requests_total{status="200"} 3' in lines and 'duration_seconds_count 2' in lines
+    assert 'in_flight 1' in lines and 'state 0' in lines
+
+
+def test_without_directory_renders_this_process_only(metrics_registry):
+    registry = metrics_registry.Registry(directory=None)
+    registry.counter('requests_total', "Requests").inc()
+
+    assert 'requests_total 1' in registry.render().splitlines()
+
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeInventory:
+    """confirm_batch that answers 400 to any call containing a malformed ID, like inventory_service"""
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.calls = []
+
+    def post(self, url, json=None, **kwargs):
+        self.calls.append(json['reservation_ids'])
+        if any(reservation_id == "bad" for reservation_id in json['reservation_ids']):
+            return FakeResponse(400, {"error": "Invalid reservation ID"})
+        return FakeResponse(self.status_code, {} if self.status_code == 200 else {"error": "Inventory unavailable"})
+
+
+@pytest.fixture
+def worker(load):
+    return load('order_service', 'outbox_worker')
+
+
+def outbox_with(worker, *reservation_ids):
+    outbox = mongomock.MongoClient().db.outbox
+    now = datetime.utcnow() - timedelta(seconds=1)
+    outbox.insert_many([
+        {"type": "reservations.confirm", "payload": {"reservation_ids": [reservation_id]}, "status": "pending", "attempts": 0, "available_at": now}
+        for reservation_id in reservation_ids
+    ])
+    return outbox
+
+
+def statuses(outbox):
+    return {event['payload']['reservation_ids'][0]: event['status'] for event in outbox.find({})}
+
+
+def test_rejected_batch_falls_back_to_each_event(worker, monkeypatch):
+    inventory = FakeInventory()
+    monkeypatch.setattr(worker, 'session', inventory)
+    outbox = outbox_with(worker, "r1", "bad", "r2")
+
+    worker.run(outbox, 'w1', once=True)
+
+    assert statuses(outbox) == {"r1": "done", "bad": "failed", "r2": "done"}
+    assert inventory.calls[0] == ["r1", "bad", "r2"] and sorted(inventory.calls[1:]) == [["bad"], ["r1"], ["r2"]]
+    assert outbox.find_one({"status": "failed"})['last_error'] == "Invalid reservation ID"
+
+
+def test_server_error_retries_the_whole_batch(worker, monkeypatch):
+    inventory = FakeInventory(status_code=503)
+    monkeypatch.setattr(worker, 'session', inventory)
+    outbox = outbox_with(worker, "r1", "r2")
+
+    worker.process_batch(outbox, worker.claim_events(outbox, 'w1', 10, 30), 'w1')
+
+    assert statuses(outbox) == {"r1": "pending", "r2": "pending"}
+    assert len(inventory.calls) == 1
+    assert all(event['attempts'] == 1 and 'locked_by' not in event for event in outbox.find({}))
+
+
+def test_outcome_is_not_recorded_after_the_lease_moved_on(worker, monkeypatch):
+    monkeypatch.setattr(worker, 'session', FakeInventory(status_code=503))
+    outbox = outbox_with(worker, "r1")
+    events = worker.claim_events(outbox, 'w1', 10, 30)
+    # w1's lease ran out; w2 took the event over and confirmed it
+    outbox.update_many({}, {"$set": {"status": "done"}, "$unset": {"locked_by": "", "locked_until": ""}})
+
+    worker.process_batch(outbox, events, 'w1')
+
+    assert statuses(outbox) == {"r1": "done"}
+    assert outbox.find_one({})['attempts'] == 0
+
+
+def test_failed_pass_is_logged_and_the_worker_keeps_polling(worker, monkeypatch):
+    monkeypatch.setattr(worker, 'session', FakeInventory())
+    monkeypatch.setattr(worker, 'POLL_INTERVAL', 0)
+    outbox = outbox_with(worker, "r1")
+    claim_events = worker.claim_events
+    calls = []
+
+    def flaky_claim(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ConnectionError("Mongo unreachable")
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return claim_events(*args)
+
+    monkeypatch.setattr(worker, 'claim_events', flaky_claim)
+
+    with pytest.raises(KeyboardInterrupt):
+        worker.run(outbox, 'w1')
+
+    assert statuses(outbox) == {"r1": "done"}
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeServices:
+    """payment_service and inventory_service as seen by the reconciler's requests session"""
+
+    def __init__(self, payments):
+        self.payments = payments
+        self.inventory_calls = []
+
+    def get(self, url, **kwargs):
+        payment_id = url.rsplit('/', 1)[1]
+        if payment_id not in self.payments:
+            return FakeResponse(404, {"error": "Payment not found"})
+        return FakeResponse(200, {"status": self.payments[payment_id]})
+
+    def post(self, url, json=None, **kwargs):
+        if url.endswith('/cancel'):
+            payment_id = url.split('/')[-2]
+            if self.payments[payment_id] == 'pending':
+                self.payments[payment_id] = 'cancelled'
+                return FakeResponse(400, {"status": "cancelled"})
+            return FakeResponse(409, {"status": self.payments[payment_id]})
+        self.inventory_calls.append((url.rsplit('/', 1)[1], json['reservation_ids']))
+        return FakeResponse(200, {})
+
+
+@pytest.fixture
+def reconciler(load, monkeypatch):
+    module = load('order_service', 'payment_reconciler')
+    monkeypatch.setattr(module, 'MIN_AGE', 0)
+    return module
+
+
+def pending_order(orders, payment_id):
+    return orders.insert_one({
+        "status": "payment_pending",
+        "payment_id": payment_id,
+        "reservation_ids": [f"r-{payment_id}"],
+        "created_at": datetime.utcnow() - timedelta(seconds=1)
+    }).inserted_id
+
+
+def test_settles_orders_from_the_payment_outcome(reconciler, monkeypatch):
+    orders = mongomock.MongoClient().db.orders
+    services = FakeServices({"paid": "completed", "declined": "failed", "queued": "pending", "charging": "processing"})
+    monkeypatch.setattr(reconciler, 'session', services)
+    ids = {payment_id: pending_order(orders, payment_id) for payment_id in ("paid", "declined", "queued", "charging", "lost")}
+
+    reconciler.run(orders, once=True)
+
+    statuses = {payment_id: orders.find_one({"_id": order_id})['status'] for payment_id, order_id in ids.items()}
+    assert statuses == {
+        "paid": "confirmed",
+        "declined": "cancelled",
+        "queued": "cancelled",
+        "charging": "payment_pending",
+        "lost": "cancelled"
+    }
+    assert ("confirm_batch", ["r-paid"]) in services.inventory_calls
+    assert ("cancel_batch", ["r-queued"]) in services.inventory_calls
+    assert services.payments["queued"] == "cancelled"
+    assert all(reservation_ids != ["r-charging"] for _, reservation_ids in services.inventory_calls)
+
+
+def test_leaves_orders_that_are_not_payment_pending(reconciler, monkeypatch):
+    orders = mongomock.MongoClient().db.orders
+    services = FakeServices({"paid": "completed"})
+    monkeypatch.setattr(reconciler, 'session', services)
+    order_id = pending_order(orders, "paid")
+    orders.update_one({"_id": order_id}, {"$set": {"status": "cancelled"}})
+
+    reconciler.run(orders, once=True)
+
+    assert orders.find_one({"_id": order_id})['status'] == "cancelled"
+    assert services.inventory_calls == []
+
+
+def test_confirms_reservations_the_gateway_may_have_lost(reconciler, monkeypatch):
+    orders = mongomock.MongoClient().db.orders
+    services = FakeServices({})
+    monkeypatch.setattr(reconciler, 'session', services)
+    created_at = datetime.utcnow() - timedelta(seconds=1)
+    unchecked = [
+        orders.insert_one({"status": "confirmed", "reservation_ids": [f"r{n}"], "reservations_confirmed": False, "created_at": created_at}).inserted_id
+        for n in range(2)
+    ]
+    checked = orders.insert_one({"status": "confirmed", "reservation_ids": ["r9"], "reservations_confirmed": True, "created_at": created_at}).inserted_id
+
+    reconciler.run(orders, once=True)
+    reconciler.run(orders, once=True)
+
+    assert services.inventory_calls == [("confirm_batch", ["r0", "r1"])]
+    assert all(orders.find_one({"_id": order_id})['reservations_confirmed'] for order_id in unchecked + [checked])
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def orders(load):
+    return load('order_service')
+
+
+def insert_orders(orders, created):
+    """Insert one order per created_at; returns their IDs in page order (newest first, then highest _id)"""
+    documents = [{"_id": orders.ObjectId(), "customer_id": "c1", "status": "confirmed", "created_at": at} for at in created]
+    orders.orders_collection.insert_many(documents)
+    return [str(document['_id']) for document in sorted(documents, key=lambda document: (document['created_at'], document['_id']), reverse=True)]
+
+
+def walk(client, url, limit):
+    seen, cursor = [], None
+    while True:
+        response = client.get(url, query_string={"limit": limit, **({"after": cursor} if cursor else {})})
+        assert response.status_code == 200
+        body = response.get_json()
+        seen.extend(order['_id'] for order in body['orders'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize('limit', [1, 2, 5, 6])
+def test_pages_cover_every_order_once_across_created_at_ties(orders, limit):
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    expected = insert_orders(orders, [now, now, now, now - timedelta(seconds=1), now + timedelta(seconds=1)])
+
+    assert walk(orders.app.test_client(), '/orders', limit) == expected
+
+
+def test_orders_added_while_paging_do_not_shift_later_pages(orders):
+    client = orders.app.test_client()
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    expected = insert_orders(orders, [now - timedelta(seconds=seconds) for seconds in range(4)])
+
+    first = client.get('/orders', query_string={"limit": 2}).get_json()
+    insert_orders(orders, [now + timedelta(seconds=1)])
+    second = client.get('/orders', query_string={"limit": 2, "after": first['next_cursor']}).get_json()
+
+    assert [order['_id'] for order in first['orders'] + second['orders']] == expected
+
+
+def test_cursor_respects_the_filter(orders):
+    client = orders.app.test_client()
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    insert_orders(orders, [now - timedelta(seconds=seconds) for seconds in range(3)])
+    orders.orders_collection.insert_one({"customer_id": "c2", "status": "confirmed", "created_at": now})
+
+    assert len(walk(client, '/orders/customer/c1', 1)) == 3
+    assert len(walk(client, '/orders/customer/c2', 1)) == 1
+
+
+@pytest.mark.parametrize('args', [{"after": "not-a-cursor"}, {"after": "bm8tcGlwZQ"}, {"limit": 0}, {"limit": "ten"}])
+def test_invalid_page_arguments_are_400(orders, args):
+    assert orders.app.test_client().get('/orders', query_string=args).status_code == 400
+
+
+def test_limit_is_capped(orders):
+    import pagination
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    insert_orders(orders, [now - timedelta(seconds=seconds) for seconds in range(pagination.MAX_PAGE_SIZE + 1)])
+
+    body = orders.app.test_client().get('/orders', query_string={"limit": pagination.MAX_PAGE_SIZE + 50}).get_json()
+
+    assert len(body['orders']) == pagination.MAX_PAGE_SIZE and body['next_cursor'] is not None
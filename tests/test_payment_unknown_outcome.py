@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+
+class FlakyProvider:
+    """Raises for the first `failures` charges, then approves; records every reference"""
+
+    name = 'flaky'
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.references = []
+
+    def charge(self, payment_method, amount, currency, reference=None, timeout=None):
+        self.references.append(reference)
+        if len(self.references) <= self.failures:
+            raise TimeoutError("read timed out")
+        return {"success": True, "message": "Payment processed successfully"}
+
+
+class HangingProvider:
+    """Never answers: every charge waits out its timeout, then raises"""
+
+    name = 'hanging'
+
+    def __init__(self):
+        self.timeouts = []
+
+    def charge(self, payment_method, amount, currency, reference=None, timeout=None):
+        self.timeouts.append(timeout)
+        time.sleep(timeout)
+        raise TimeoutError("read timed out")
+
+
+@pytest.fixture
+def payments(load, monkeypatch):
+    app = load('payment_service')
+    import async_payments
+    monkeypatch.setattr(async_payments, 'PROVIDER_RETRY_BACKOFF', 0)
+    return app
+
+
+def test_provider_error_is_retried_under_the_same_reference(payments):
+    from async_payments import charge
+
+    provider = FlakyProvider(failures=2)
+    outcome = charge(provider, {"payment_method": "card", "amount": 10.0, "currency": "USD", "transaction_id": "t-1"}, 'sync', unknown_retries=2)
+
+    assert outcome['success']
+    assert provider.references == ["t-1", "t-1", "t-1"]
+
+
+def test_unknown_outcome_is_stored_as_unknown_and_reconciled(payments, monkeypatch):
+    provider = FlakyProvider(failures=3)
+    monkeypatch.setattr(payments, 'provider', provider)
+    client = payments.app.test_client()
+
+    response = client.post('/payments/process', json={"customer_id": "c1", "amount": 10.0, "payment_method": "card"})
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status'] == "unknown" and not body['success']
+    assert payments.payments_collection.find_one({"transaction_id": body['transaction_id']})['status'] == "unknown"
+
+    response = client.post(f"/payments/{body['payment_id']}/reconcile")
+
+    assert response.status_code == 200 and response.get_json()['status'] == "completed"
+    assert set(provider.references) == {body['transaction_id']}
+
+
+def test_sync_charge_to_hanging_provider_answers_unknown_within_its_deadline(load, monkeypatch):
+    payments = load('payment_service', PAYMENT_SYNC_TIMEOUT='0.3', PROVIDER_RETRY_BACKOFF='0.1')
+    provider = HangingProvider()
+    monkeypatch.setattr(payments, 'provider', provider)
+
+    started = time.monotonic()
+    response = payments.app.test_client().post('/payments/process', json={"customer_id": "c1", "amount": 10.0, "payment_method": "card"})
+    elapsed = time.monotonic() - started
+
+    # Well inside api_gateway's wait, however many retries PROVIDER_UNKNOWN_RETRIES allows
+    assert response.status_code == 202 and response.get_json()['status'] == "unknown"
+    assert elapsed < 0.6
+    assert provider.timeouts[0] <= 0.3 and len(provider.timeouts) == 1
+
+
+def test_fake_provider_answers_a_repeated_reference_without_charging_again(load):
+    fake_provider = load('payment_service', 'fake_provider')
+    import providers
+    server = fake_provider.serve(0, lost_rate=1.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        provider = providers.HttpProvider(f"http://127.0.0.1:{server.server_address[1]}", timeout=5)
+        with pytest.raises(RuntimeError):
+            provider.charge("card", 10.0, "USD", "t-lost")
+
+        fake_provider.FakeProvider.lost_rate = 0.0
+        assert provider.charge("card", 10.0, "USD", "t-lost")['success']
+        assert fake_provider.FakeProvider.counts == {500: 1, 'lost': 1, 'replayed': 1, 200: 1}
+        assert len(fake_provider.FakeProvider.charges) == 1
+    finally:
+        server.shutdown()
+        server.server_close()